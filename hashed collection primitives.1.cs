@@ -0,0 +1 @@
+'From Squeak4.5 of 27 March 2014 [latest update: #13680] on 19 October 2026 at 12:00:00 pm'!!HashedCollection methodsFor: 'private' stamp: 'spy 10/19/2026 12:00'!primScan: anArray forElement: anObject startingAt: start	"Answer the index of the first slot from start on, wrapping around, that is either empty or holds anObject, or 0 if there is none. The HashedCollectionPlugin does this without any sends."	<primitive: 'primitiveScanForElement' module: 'HashedCollectionPlugin'>	| index size |	index := start.	size := anArray size.	[ | element |		((element := anArray at: index) == nil or: [ element == anObject ])			ifTrue: [ ^index ].		(index := index \\ size + 1) = start ] whileFalse.	^0! !!HashedCollection methodsFor: 'private' stamp: 'spy 10/19/2026 12:00'!primScan: anArray forKey: anObject startingAt: start	"Answer the index of the first slot from start on, wrapping around, that is either empty or holds an association with the key anObject, or 0 if there is none. The HashedCollectionPlugin does this without any sends."	<primitive: 'primitiveScanForKey' module: 'HashedCollectionPlugin'>	| index size |	index := start.	size := anArray size.	[ | element |		((element := anArray at: index) == nil or: [ element key == anObject ])			ifTrue: [ ^index ].		(index := index \\ size + 1) = start ] whileFalse.	^0! !!Dictionary methodsFor: 'private' stamp: 'spy 10/19/2026 12:00'!scanFor: anObject	"Answer the index of a first slot containing either a nil (indicating an empty slot) or an element that matches the given object. Answer the index of that slot or raise an error if no slot is found. Symbols compare by identity, so their probe can run in the VM."	| index start size |	index := start := anObject hash \\ (size := array size) + 1.	anObject isSymbol ifTrue: [		(index := self primScan: array forKey: anObject startingAt: start) = 0			ifTrue: [ self errorNoFreeSpace ].		^index ].	[ 		| element |		((element := array at: index) == nil or: [ anObject = element key ])			ifTrue: [ ^index ].		(index := index \\ size + 1) = start ] whileFalse.	self errorNoFreeSpace! !!IdentityDictionary methodsFor: 'private' stamp: 'spy 10/19/2026 12:00'!scanFor: anObject	"Answer the index of a first slot containing either a nil (indicating an empty slot) or an element that matches the given object. Answer the index of that slot or raise an error if no slot is found."	| index |	(index := self		primScan: array		forKey: anObject		startingAt: anObject scaledIdentityHash \\ array size + 1) = 0			ifTrue: [ self errorNoFreeSpace ].	^index! !!IdentitySet methodsFor: 'private' stamp: 'spy 10/19/2026 12:00'!scanFor: anObject	"Answer the index of a first slot containing either a nil (indicating an empty slot) or an element that matches the given object. Answer the index of that slot or raise an error if no slot is found. A nil element is stored wrapped, so it is looked up by Set."	| index |	anObject == nil ifTrue: [ ^super scanFor: anObject ].	(index := self		primScan: array		forElement: anObject		startingAt: anObject scaledIdentityHash \\ array size + 1) = 0			ifTrue: [ self errorNoFreeSpace ].	^index! !
\ No newline at end of file
@@ -0,0 +1 @@
+'From Squeak4.5 of 27 March 2014 [latest update: #13680] on 19 October 2026 at 12:00:00 pm'!!Number methodsFor: 'printing' stamp: 'spy 10/19/2026 12:00'!primPrintString: base	"Answer a String with the receiver printed in base. The NumberPlugin answers exactly what the Smalltalk code would."	<primitive: 'primitivePrintString' module: 'NumberPlugin'>	^self printString: base! !!Integer methodsFor: 'printing' stamp: 'spy 10/19/2026 12:00'!printOn: aStream	aStream nextPutAll: (self primPrintString: 10)! !!Float methodsFor: 'printing' stamp: 'spy 10/19/2026 12:00'!printOn: aStream	aStream nextPutAll: (self primPrintString: 10)! !!Number class methodsFor: 'instance creation' stamp: 'spy 10/19/2026 12:00'!primReadInteger: aString base: base	"Answer the Integer in aString if it holds nothing but the number, nil otherwise."	<primitive: 'primitiveReadInteger' module: 'NumberPlugin'>	^nil! !!Number class methodsFor: 'instance creation' stamp: 'spy 10/19/2026 12:00'!primReadFloat: aString	"Answer the Float in aString if it holds nothing but a plain decimal number, nil otherwise."	<primitive: 'primitiveReadFloat' module: 'NumberPlugin'>	^nil! !!Number class methodsFor: 'instance creation' stamp: 'spy 10/19/2026 12:00'!readFrom: stringOrStream 	"Answer a number as described on aStream.  The number may	be any accepted Smalltalk literal Number format.	It can include a leading radix specification, as in 16rFADE.	It can as well be NaN, Infinity or -Infinity for conveniency.	If stringOrStream does not start with a valid number description, fail.	Strings holding nothing but a decimal number are parsed by the NumberPlugin."		stringOrStream isString ifTrue:		[((stringOrStream includes: $.)			ifTrue: [self primReadFloat: stringOrStream]			ifFalse: [self primReadInteger: stringOrStream base: 10])				ifNotNil: [:number | ^number]].	^(ExtendedNumberParser on: stringOrStream) nextNumber! !!Number class methodsFor: 'instance creation' stamp: 'spy 10/19/2026 12:00'!readFrom: stringOrStream base: base	"Answer a number as described on aStream in the given number base.	If stringOrStream does not start with a valid number description, answer 0 for backward compatibility. This is not clever and should better be changed.	Strings holding nothing but an integer are parsed by the NumberPlugin."	stringOrStream isString ifTrue:		[(self primReadInteger: stringOrStream base: base)			ifNotNil: [:number | ^number]].	^(SqNumberParser on: stringOrStream) nextNumberBase: base! !!Integer class methodsFor: 'instance creation' stamp: 'spy 10/19/2026 12:00'!readFrom: aStringOrStream base: base 	"Answer an instance of one of the concrete subclasses if Integer. 	Initial minus sign accepted, and bases > 10 use letters A-Z.	Imbedded radix specifiers not allowed;  use Number 	class readFrom: for that.	Raise an Error if there are no digits.	If stringOrStream dos not start with a valid number description, answer 0 for backward compatibility. This is not clever and should better be changed.	Strings holding nothing but the number are parsed by the NumberPlugin."	aStringOrStream isString ifTrue:		[(self primReadInteger: aStringOrStream base: base)			ifNotNil: [:number | ^number]].	^(SqNumberParser on: aStringOrStream) nextIntegerBase: base! !
\ No newline at end of file
@@ -0,0 +1,75 @@
+import time
+
+from rpython.rlib.rarithmetic import r_longlong, r_ulonglong
+from rpython.rtyper.lltypesystem import lltype, rffi
+from rpython.rtyper.tool import rffi_platform
+from rpython.translator.tool.cbuild import ExternalCompilationInfo
+
+
+class CConfig:
+    _compilation_info_ = ExternalCompilationInfo(
+        includes=['time.h'],
+        libraries=['rt'])
+    TIMESPEC = rffi_platform.Struct('struct timespec', [
+        ('tv_sec', rffi.LONG), ('tv_nsec', rffi.LONG)])
+    TM = rffi_platform.Struct('struct tm', [('tm_gmtoff', rffi.LONG)])
+    TIME_T = rffi_platform.SimpleType('time_t', rffi.LONG)
+    CLOCK_MONOTONIC = rffi_platform.ConstantInteger('CLOCK_MONOTONIC')
+
+config = rffi_platform.configure(CConfig)
+TIMESPEC = config['TIMESPEC']
+TM = config['TM']
+TIME_T = config['TIME_T']
+CLOCK_MONOTONIC = config['CLOCK_MONOTONIC']
+
+c_clock_gettime = rffi.llexternal('clock_gettime',
+                                  [rffi.INT, lltype.Ptr(TIMESPEC)], rffi.INT,
+                                  compilation_info=CConfig._compilation_info_,
+                                  releasegil=False)
+c_localtime_r = rffi.llexternal('localtime_r',
+                                [rffi.CArrayPtr(TIME_T), lltype.Ptr(TM)],
+                                lltype.Ptr(TM),
+                                compilation_info=CConfig._compilation_info_,
+                                releasegil=False)
+
+# Microseconds between the Squeak epoch (1 January 1901) and the Unix epoch
+MICROSECONDS_1901_TO_1970 = r_ulonglong((69 * 365 + 17) * 24 * 3600) * 1000000
+
+
+def monotonic_microseconds():
+    """Microseconds since an arbitrary point in the past. This clock is not
+    affected by changes of the system time, Delays are measured with it."""
+    ts = lltype.malloc(TIMESPEC, flavor='raw')
+    try:
+        if rffi.cast(lltype.Signed, c_clock_gettime(CLOCK_MONOTONIC, ts)) != 0:
+            return r_longlong(time.time() * 1000000)
+        return (r_longlong(rffi.cast(lltype.Signed, ts.c_tv_sec)) * 1000000 +
+                rffi.cast(lltype.Signed, ts.c_tv_nsec) / 1000)
+    finally:
+        lltype.free(ts, flavor='raw')
+
+
+def utc_microseconds():
+    """Microseconds since 1 January 1901 UTC."""
+    return r_ulonglong(time.time() * 1000000) + MICROSECONDS_1901_TO_1970
+
+
+def local_offset_seconds():
+    """The offset of local time from UTC in seconds, daylight saving time
+    included."""
+    now = lltype.malloc(rffi.CArray(TIME_T), 1, flavor='raw')
+    tm = lltype.malloc(TM, flavor='raw')
+    try:
+        now[0] = rffi.cast(TIME_T, int(time.time()))
+        if not c_localtime_r(now, tm):
+            return 0
+        return rffi.cast(lltype.Signed, tm.c_tm_gmtoff)
+    finally:
+        lltype.free(tm, flavor='raw')
+        lltype.free(now, flavor='raw')
+
+
+def local_microseconds():
+    """Microseconds since 1 January 1901 in local time."""
+    offset = r_longlong(local_offset_seconds()) * 1000000
+    return r_ulonglong(r_longlong(utc_microseconds()) + offset)
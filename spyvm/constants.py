@@ -190,4 +190,8 @@ def decode_compiled_method_header(header):
 
 MAX_LOOP_DEPTH = 100
 INTERRUPT_COUNTER_SIZE = 10000
+# bounds for adapting the interrupt counter to check every millisecond
+MIN_INTERRUPT_COUNTER_SIZE = 100
+MAX_INTERRUPT_COUNTER_SIZE = 1000000
+INTERRUPT_CHECK_MICROSECONDS = 1000
 CompileTime = int(time.time() * 1000)
@@ -1,4 +1,4 @@
-from rpython.rlib.rarithmetic import r_uint
+from rpython.rlib.rarithmetic import r_uint, intmask
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rpython.rlib.runicode import unicode_encode_utf_8
 from rpython.rlib import jit
@@ -35,24 +35,361 @@ WindowEventActivated = 4
 WindowEventPaint = 5
 WindowEventStinks = 6
 
+# SDL_UpdateRects is missing from rsdl
+UpdateRects = RSDL.external('SDL_UpdateRects',
+                            [RSDL.SurfacePtr, rffi.INT, RSDL.RectPtr],
+                            lltype.Void)
 
-class SDLDisplay(object):
-    _attrs_ = ["screen", "width", "height", "depth", "surface", "has_surface",
-               "mouse_position", "button", "key", "interrupt_key", "_defer_updates",
-               "_deferred_event"]
+# for RSDL.PeepEvents, to look for pending events without removing them
+SDL_PEEKEVENT = 1
+SDL_ALLEVENTS = r_uint(0xFFFFFFFF)
 
-    def __init__(self, title):
-        assert RSDL.Init(RSDL.INIT_VIDEO) >= 0
-        RSDL.WM_SetCaption(title, "RSqueakVM")
-        RSDL.EnableUNICODE(1)
-        SDLCursor.has_display = True
-        self.has_surface = False
+# While idling, the display is checked for input this often (in seconds).
+# SDL 1.2 has no SDL_WaitEventTimeout, its SDL_WaitEvent polls every 10ms.
+EVENT_POLL_INTERVAL = 0.01
+
+# Beyond this many separate damaged rectangles the display is updated with
+# their union instead.
+MAX_DAMAGE_RECTS = 16
+
+
+class DamageRects(object):
+    """The regions of the screen changed since the last update, as a flat
+    list of left, top, right, bottom (exclusive) coordinates. Overlapping
+    rectangles are merged."""
+    _attrs_ = ["rects", "max_rects"]
+
+    def __init__(self, max_rects=MAX_DAMAGE_RECTS):
+        self.rects = []
+        self.max_rects = max_rects
+
+    def is_empty(self):
+        return len(self.rects) == 0
+
+    def count(self):
+        return len(self.rects) / 4
+
+    def clear(self):
+        self.rects = []
+
+    def add(self, left, top, right, bottom):
+        if left >= right or top >= bottom:
+            return
+        i = 0
+        while i < len(self.rects):
+            if (left <= self.rects[i + 2] and self.rects[i] <= right and
+                    top <= self.rects[i + 3] and self.rects[i + 1] <= bottom):
+                # merge with the overlapping rectangle and add the union anew,
+                # it may now overlap others
+                left = min(left, self.rects[i])
+                top = min(top, self.rects[i + 1])
+                right = max(right, self.rects[i + 2])
+                bottom = max(bottom, self.rects[i + 3])
+                del self.rects[i:i + 4]
+                i = 0
+            else:
+                i += 4
+        self.rects.extend([left, top, right, bottom])
+        if self.count() > self.max_rects:
+            self.collapse()
+
+    def collapse(self):
+        left, top, right, bottom = self.bounds()
+        self.rects = [left, top, right, bottom]
+
+    def bounds(self):
+        assert not self.is_empty()
+        left, top, right, bottom = self.rects[0], self.rects[1], self.rects[2], self.rects[3]
+        i = 4
+        while i < len(self.rects):
+            left = min(left, self.rects[i])
+            top = min(top, self.rects[i + 1])
+            right = max(right, self.rects[i + 2])
+            bottom = max(bottom, self.rects[i + 3])
+            i += 4
+        return left, top, right, bottom
+
+
+class EventQueue(object):
+    """Input events waiting to be fetched by primitiveGetNextEvent, as a flat
+    list of 8 ints per event. A mouse motion right after another one with the
+    same buttons and modifiers replaces it, so a storm of moves is delivered
+    as the latest position only. Fetched events are copied into one reused
+    buffer."""
+    _attrs_ = ["events", "start", "motion_at", "buffer"]
+
+    def __init__(self):
+        self.events = []
+        self.start = 0
+        self.motion_at = -1
+        self.buffer = [0] * 8
+
+    def is_empty(self):
+        return self.start == len(self.events)
+
+    def count(self):
+        return (len(self.events) - self.start) / 8
+
+    def push(self, type, time, a, b, c, d, e, f):
+        self.motion_at = -1
+        self.events.extend([type, time, a, b, c, d, e, f])
+
+    def push_motion(self, time, x, y, buttons, modifiers):
+        i = self.motion_at
+        if (i >= self.start and self.events[i + 4] == buttons and
+                self.events[i + 5] == modifiers):
+            self.events[i + 1] = time
+            self.events[i + 2] = x
+            self.events[i + 3] = y
+            return
+        self.push(EventTypeMouse, time, x, y, buttons, modifiers, 0, 0)
+        self.motion_at = len(self.events) - 8
+
+    def pop(self):
+        """Answer the oldest event, or an EventTypeNone event. The buffer is
+        only valid until the next call."""
+        if self.is_empty():
+            for i in range(8):
+                self.buffer[i] = 0
+            return self.buffer
+        for i in range(8):
+            self.buffer[i] = self.events[self.start + i]
+        self.start += 8
+        if self.is_empty():
+            del self.events[:]
+            self.start = 0
+            self.motion_at = -1
+        return self.buffer
+
+
+def words_per_row(width, depth):
+    """The words of a row in the pixel buffer of a display. Rows of the
+    Display are word aligned, below 8 bits every pixel takes a byte."""
+    if depth < 8:
+        return (width * depth + 31) / 32 * (8 / depth)
+    return (width * depth + 31) / 32
+
+
+def squeak_colors():
+    """Squeak's indexed colors of depths up to 8 as 0xRRGGBB, see Color
+    class>>initializeIndexedColors."""
+    def rgb(r, g, b):
+        return (int(r * 255 + 0.5) << 16) | (int(g * 255 + 0.5) << 8) | int(b * 255 + 0.5)
+    colors = [rgb(1, 1, 1), rgb(0, 0, 0), rgb(1, 1, 1), rgb(0.5, 0.5, 0.5),
+              rgb(1, 0, 0), rgb(0, 1, 0), rgb(0, 0, 1), rgb(0, 1, 1),
+              rgb(1, 1, 0), rgb(1, 0, 1)]
+    for gray in [0.125, 0.25, 0.375, 0.625, 0.75, 0.875]:
+        colors.append(rgb(gray, gray, gray))
+    # 24 more shades of gray, skipping the eighths
+    gray = 0
+    while len(colors) < 40:
+        if gray % 4 == 0:
+            gray += 1
+        colors.append(rgb(gray / 32.0, gray / 32.0, gray / 32.0))
+        gray += 1
+    # a color cube with 6 steps per primary, green and blue are swapped
+    colors.extend([0] * 216)
+    for r in range(6):
+        for g in range(6):
+            for b in range(6):
+                colors[40 + 36 * r + 6 * b + g] = rgb(r / 5.0, g / 5.0, b / 5.0)
+    return colors
+
+SQUEAK_COLORS = squeak_colors()
+
+
+class Display(object):
+    """A display backend: the pixel buffer W_DisplayBitmaps write the screen
+    contents to, the damaged regions, and the mouse and keyboard state."""
+    _attrs_ = ["width", "height", "depth", "mouse_position", "button", "key",
+               "interrupt_key", "_defer_updates", "_deferred_event", "damage",
+               "pixel_source"]
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.depth = 0
         self.mouse_position = [0, 0]
         self.interrupt_key = 15 << 8 # pushing all four meta keys, of which we support three...
         self.button = 0
         self.key = 0
         self._deferred_event = None
         self._defer_updates = False
+        self.damage = DamageRects()
+        self.pixel_source = None
+
+    def set_video_mode(self, w, h, d):
+        raise NotImplementedError
+
+    def get_pixelbuffer(self):
+        raise NotImplementedError
+
+    def get_next_event(self, time=0):
+        raise NotImplementedError
+
+    def get_modifier_mask(self, shift):
+        raise NotImplementedError
+
+    def has_pending_events(self):
+        return False
+
+    def poll_events(self, time=0):
+        """Collect the input that arrived since the last call for
+        get_next_event. Answer whether there was any."""
+        return False
+
+    def wait_for_event(self, timeout):
+        """Block for up to timeout seconds, returning early when input arrives
+        in the meantime. Input that is already pending does not end the wait,
+        the image fetches it when it is scheduled again. Answer whether the
+        wait ended because of new input."""
+        import time
+        deadline = time.time() + timeout
+        if self.has_pending_events():
+            sleep_until(deadline)
+            return False
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, EVENT_POLL_INTERVAL))
+            if self.has_pending_events():
+                return True
+
+    def defer_updates(self, flag):
+        self._defer_updates = flag
+
+    def sync_pixels(self):
+        """Convert the words the image stored since the last update into the
+        pixel buffer, see W_DisplayBitmap.convert_dirty."""
+        if self.pixel_source is not None:
+            self.pixel_source.convert_dirty()
+
+    def flip(self, force=False):
+        if (not self._defer_updates) or force:
+            self.sync_pixels()
+            self.damage.clear()
+
+    def invalidate(self, left, top, right, bottom):
+        """Remember a changed region of the screen for the next update."""
+        self.damage.add(max(left, 0), max(top, 0),
+                        min(right, self.width), min(bottom, self.height))
+
+    def invalidate_all(self):
+        self.damage.add(0, 0, self.width, self.height)
+
+    def flush_damage(self, force=False):
+        if (not self._defer_updates) or force:
+            self.sync_pixels()
+            self.damage.clear()
+
+    def check_interrupt_key(self):
+        interrupt = self.interrupt_key
+        if (interrupt & 0xFF == self.key and interrupt >> 8 == self.get_modifier_mask(0)):
+            raise KeyboardInterrupt
+
+    def mouse_buttons_and_modifiers(self):
+        mods = self.get_modifier_mask(3)
+        btn = self.button
+        if btn == RedButtonBit:
+            if mods & CtrlKeyBit:
+                btn = BlueButtonBit
+            elif mods & CommandKeyBit:
+                btn = YellowButtonBit
+        return btn, mods
+
+    def get_next_mouse_event(self, time):
+        btn, mods = self.mouse_buttons_and_modifiers()
+        return [EventTypeMouse,
+                time,
+                int(self.mouse_position[0]),
+                int(self.mouse_position[1]),
+                btn,
+                mods,
+                0,
+                0]
+
+    def get_next_key_event(self, t, time):
+        mods = self.get_modifier_mask(3)
+        return [EventTypeKeyboard,
+                time,
+                self.key,
+                t,
+                mods,
+                self.key,
+                0,
+                0]
+
+    def mouse_point(self):
+        return self.mouse_position
+
+    def mouse_button(self):
+        mod = self.get_modifier_mask(3)
+        return self.button | mod
+
+    def next_keycode(self):
+        key = self.key
+        self.key = 0
+        return key | self.get_modifier_mask(8)
+
+    def peek_keycode(self):
+        self.key |= self.get_modifier_mask(8)
+        return self.key
+
+    def set_interrupt_key(self, space, encoded_key):
+        self.interrupt_key = encoded_key
+
+    def rgb_at(self, pixelbuffer, x, y):
+        """The color of a pixel of the pixel buffer as 0xRRGGBB."""
+        pitch = words_per_row(self.width, self.depth)
+        if self.depth == 32:
+            return intmask(r_uint(pixelbuffer[y * pitch + x]) & 0xFFFFFF)
+        elif self.depth == 16:
+            # two 5-5-5 pixels with red in the low bits, see W_16BitDisplayBitmap
+            word = r_uint(pixelbuffer[y * pitch + x / 2])
+            value = intmask((word >> (16 * (x & 1))) & 0xFFFF)
+            r = value & 0x1F
+            g = (value >> 6) & 0x1F
+            b = (value >> 11) & 0x1F
+            return ((r << 3 | r >> 2) << 16) | ((g << 3 | g >> 2) << 8) | (b << 3 | b >> 2)
+        else:
+            word = r_uint(pixelbuffer[y * pitch + x / 4])
+            return SQUEAK_COLORS[intmask((word >> (8 * (x & 3))) & 0xFF)]
+
+    def dump_ppm(self, filename):
+        """Write the screen contents to a binary PPM file."""
+        from rpython.rlib.streamio import open_file_as_stream
+        self.sync_pixels()
+        pixelbuffer = self.get_pixelbuffer()
+        data = ["P6\n%d %d\n255\n" % (self.width, self.height)]
+        for y in range(self.height):
+            row = ["\x00"] * (self.width * 3)
+            for x in range(self.width):
+                rgb = self.rgb_at(pixelbuffer, x, y)
+                row[x * 3] = chr((rgb >> 16) & 0xFF)
+                row[x * 3 + 1] = chr((rgb >> 8) & 0xFF)
+                row[x * 3 + 2] = chr(rgb & 0xFF)
+            data.append("".join(row))
+        f = open_file_as_stream(filename, mode="wb")
+        try:
+            f.write("".join(data))
+        finally:
+            f.close()
+
+
+class SDLDisplay(Display):
+    _attrs_ = ["screen", "surface", "has_surface", "queue", "c_event"]
+
+    def __init__(self, title):
+        Display.__init__(self)
+        assert RSDL.Init(RSDL.INIT_VIDEO) >= 0
+        RSDL.WM_SetCaption(title, "RSqueakVM")
+        RSDL.EnableUNICODE(1)
+        SDLCursor.has_display = True
+        self.has_surface = False
+        self.queue = EventQueue()
+        # reused for every event read from SDL, lives as long as the display
+        self.c_event = lltype.malloc(RSDL.Event, flavor="raw")
 
     def set_video_mode(self, w, h, d):
         assert w > 0 and h > 0
@@ -73,12 +410,30 @@ class SDLDisplay(object):
     def get_pixelbuffer(self):
         return rffi.cast(rffi.ULONGP, self.screen.c_pixels)
 
-    def defer_updates(self, flag):
-        self._defer_updates = flag
-
     def flip(self, force=False):
         if (not self._defer_updates) or force:
+            self.sync_pixels()
             RSDL.Flip(self.screen)
+            self.damage.clear()
+
+    def flush_damage(self, force=False):
+        """Copy the regions changed since the last update to the screen."""
+        if self.damage.is_empty() or (self._defer_updates and not force):
+            return
+        self.sync_pixels()
+        count = self.damage.count()
+        rects = lltype.malloc(rffi.CArray(RSDL.Rect), count, flavor='raw')
+        try:
+            damage = self.damage.rects
+            for i in range(count):
+                rffi.setintfield(rects[i], 'c_x', damage[i * 4])
+                rffi.setintfield(rects[i], 'c_y', damage[i * 4 + 1])
+                rffi.setintfield(rects[i], 'c_w', damage[i * 4 + 2] - damage[i * 4])
+                rffi.setintfield(rects[i], 'c_h', damage[i * 4 + 3] - damage[i * 4 + 1])
+            UpdateRects(self.screen, count, rffi.cast(RSDL.RectPtr, rects))
+        finally:
+            lltype.free(rects, flavor='raw')
+        self.damage.clear()
 
     def set_squeak_colormap(self, screen):
         # TODO: fix this up from the image
@@ -140,96 +495,83 @@ class SDLDisplay(object):
                     self.key = asciivalue
         if self.key == 0 and sym <= 255:
             self.key = sym
-        interrupt = self.interrupt_key
-        if (interrupt & 0xFF == self.key and interrupt >> 8 == self.get_modifier_mask(0)):
-            raise KeyboardInterrupt
-
-    def get_next_mouse_event(self, time):
+        self.check_interrupt_key()
+
+    def poll_events(self, time=0):
+        """Move all pending SDL events to the queue."""
+        polled = False
+        while rffi.cast(lltype.Signed, RSDL.PollEvent(self.c_event)) == 1:
+            self.queue_event(time)
+            polled = True
+        return polled
+
+    def queue_event(self, time):
+        event = self.c_event
+        c_type = rffi.getintfield(event, 'c_type')
+        if c_type in [RSDL.MOUSEBUTTONDOWN, RSDL.MOUSEBUTTONUP]:
+            self.handle_mouse_button(c_type, event)
+            btn, mods = self.mouse_buttons_and_modifiers()
+            self.queue.push(EventTypeMouse, time, int(self.mouse_position[0]),
+                            int(self.mouse_position[1]), btn, mods, 0, 0)
+        elif c_type == RSDL.MOUSEMOTION:
+            self.handle_mouse_move(c_type, event)
+            btn, mods = self.mouse_buttons_and_modifiers()
+            self.queue.push_motion(time, int(self.mouse_position[0]),
+                                   int(self.mouse_position[1]), btn, mods)
+        elif c_type == RSDL.KEYDOWN:
+            self.handle_keypress(c_type, event)
+            self.queue_key_event(EventKeyDown, time)
+        elif c_type == RSDL.KEYUP:
+            self.queue_key_event(EventKeyChar, time)
+            self.queue_key_event(EventKeyUp, time)
+        elif c_type == RSDL.VIDEORESIZE:
+            self.screen = RSDL.GetVideoSurface()
+            w, h = int(self.screen.c_w), int(self.screen.c_h)
+            self.queue.push(EventTypeWindow, time, WindowEventMetricChange, 0, 0, w, h, 0)
+            self.queue.push(EventTypeWindow, time, WindowEventPaint, 0, 0, w, h, 0)
+        elif c_type == RSDL.VIDEOEXPOSE:
+            w, h = int(self.screen.c_w), int(self.screen.c_h)
+            self.queue.push(EventTypeWindow, time, WindowEventActivated, 0, 0, 0, 0, 0)
+            self.queue.push(EventTypeWindow, time, WindowEventPaint, 0, 0, w, h, 0)
+        elif c_type == RSDL.QUIT:
+            self.queue.push(EventTypeWindow, time, WindowEventClose, 0, 0, 0, 0, 0)
+
+    def queue_key_event(self, t, time):
         mods = self.get_modifier_mask(3)
-        btn = self.button
-        if btn == RedButtonBit:
-            if mods & CtrlKeyBit:
-                btn = BlueButtonBit
-            elif mods & CommandKeyBit:
-                btn = YellowButtonBit
-        return [EventTypeMouse,
-                time,
-                int(self.mouse_position[0]),
-                int(self.mouse_position[1]),
-                btn,
-                mods,
-                0,
-                0]
-
-    def get_next_key_event(self, t, time):
-        mods = self.get_modifier_mask(3)
-        btn = self.button
-        return [EventTypeKeyboard,
-                time,
-                self.key,
-                t,
-                mods,
-                self.key,
-                0,
-                0]
+        self.queue.push(EventTypeKeyboard, time, self.key, t, mods, self.key, 0, 0)
 
     def get_next_event(self, time=0):
-        if self._deferred_event:
-            deferred = self._deferred_event
-            self._deferred_event = None
-            return deferred
+        if self.queue.is_empty():
+            self.poll_events(time)
+        return self.queue.pop()
 
-        event = lltype.malloc(RSDL.Event, flavor="raw")
-        try:
-            if rffi.cast(lltype.Signed, RSDL.PollEvent(event)) == 1:
-                c_type = rffi.getintfield(event, 'c_type')
-                if c_type in [RSDL.MOUSEBUTTONDOWN, RSDL.MOUSEBUTTONUP]:
-                    self.handle_mouse_button(c_type, event)
-                    return self.get_next_mouse_event(time)
-                elif c_type == RSDL.MOUSEMOTION:
-                    self.handle_mouse_move(c_type, event)
-                    return self.get_next_mouse_event(time)
-                elif c_type == RSDL.KEYDOWN:
-                    self.handle_keypress(c_type, event)
-                    return self.get_next_key_event(EventKeyDown, time)
-                elif c_type == RSDL.KEYUP:
-                    self._deferred_event = self.get_next_key_event(EventKeyUp, time)
-                    return self.get_next_key_event(EventKeyChar, time)
-                elif c_type == RSDL.VIDEORESIZE:
-                    self.screen = RSDL.GetVideoSurface()
-                    self._deferred_event = [EventTypeWindow, time, WindowEventPaint,
-                                            0, 0, int(self.screen.c_w), int(self.screen.c_h), 0]
-                    return [EventTypeWindow, time, WindowEventMetricChange,
-                            0, 0, int(self.screen.c_w), int(self.screen.c_h), 0]
-                elif c_type == RSDL.VIDEOEXPOSE:
-                    self._deferred_event = [EventTypeWindow, time, WindowEventPaint,
-                                            0, 0, int(self.screen.c_w), int(self.screen.c_h), 0]
-                    return [EventTypeWindow, time, WindowEventActivated, 0, 0, 0, 0, 0]
-                elif c_type == RSDL.QUIT:
-                    return [EventTypeWindow, time, WindowEventClose, 0, 0, 0, 0, 0]
-        finally:
-            lltype.free(event, flavor='raw')
-        return [EventTypeNone, 0, 0, 0, 0, 0, 0, 0]
+    def has_pending_events(self):
+        if not self.queue.is_empty():
+            return True
+        RSDL.PumpEvents()
+        # rsdl declares the event buffer as an array of event pointers, SDL
+        # copies the peeked event into c_event
+        events = rffi.cast(RSDL.EventPtrs, self.c_event)
+        peeked = RSDL.PeepEvents(events, 1, SDL_PEEKEVENT,
+                                 rffi.cast(RSDL.Uint32, SDL_ALLEVENTS))
+        return rffi.cast(lltype.Signed, peeked) > 0
 
     # Old style event handling
     def pump_events(self):
-        event = lltype.malloc(RSDL.Event, flavor="raw")
-        try:
-            if rffi.cast(lltype.Signed, RSDL.PollEvent(event)) == 1:
-                c_type = rffi.getintfield(event, 'c_type')
-                if c_type == RSDL.MOUSEBUTTONDOWN or c_type == RSDL.MOUSEBUTTONUP:
-                    self.handle_mouse_button(c_type, event)
-                    return
-                elif c_type == RSDL.MOUSEMOTION:
-                    self.handle_mouse_move(c_type, event)
-                elif c_type == RSDL.KEYDOWN:
-                    self.handle_keypress(c_type, event)
-                    return
-                elif c_type == RSDL.QUIT:
-                    from spyvm.error import Exit
-                    raise Exit("Window closed..")
-        finally:
-            lltype.free(event, flavor='raw')
+        event = self.c_event
+        if rffi.cast(lltype.Signed, RSDL.PollEvent(event)) == 1:
+            c_type = rffi.getintfield(event, 'c_type')
+            if c_type == RSDL.MOUSEBUTTONDOWN or c_type == RSDL.MOUSEBUTTONUP:
+                self.handle_mouse_button(c_type, event)
+                return
+            elif c_type == RSDL.MOUSEMOTION:
+                self.handle_mouse_move(c_type, event)
+            elif c_type == RSDL.KEYDOWN:
+                self.handle_keypress(c_type, event)
+                return
+            elif c_type == RSDL.QUIT:
+                from spyvm.error import Exit
+                raise Exit("Window closed..")
 
     def get_modifier_mask(self, shift):
         RSDL.PumpEvents()
@@ -245,29 +587,175 @@ class SDLDisplay(object):
 
     def mouse_point(self):
         self.pump_events()
-        return self.mouse_position
+        return Display.mouse_point(self)
 
     def mouse_button(self):
         self.pump_events()
-        mod = self.get_modifier_mask(3)
-        return self.button | mod
+        return Display.mouse_button(self)
 
-    def next_keycode(self):
-        key = self.key
-        self.key = 0
-        return key | self.get_modifier_mask(8)
+    def peek_keycode(self):
+        self.pump_events()
+        return Display.peek_keycode(self)
+
+
+class HeadlessDisplay(Display):
+    """A display without SDL. The pixel buffer is kept in memory and can be
+    dumped with dump_ppm, input comes from synthetic events in the format of
+    primitiveGetNextEvent queued with post_event."""
+    _attrs_ = ["pixelbuffer", "buffer_size", "events", "modifiers", "posted"]
+
+    def __init__(self):
+        Display.__init__(self)
+        self.pixelbuffer = lltype.nullptr(rffi.ULONGP.TO)
+        self.buffer_size = 0
+        self.events = []
+        self.modifiers = 0
+        self.posted = False
+
+    def set_video_mode(self, w, h, d):
+        assert w > 0 and h > 0
+        assert d in [1, 2, 4, 8, 16, 32]
+        self.width = w
+        self.height = h
+        self.depth = d
+        size = words_per_row(w, d) * h
+        if size > self.buffer_size:
+            # like SDL_SetVideoMode, this invalidates the previous buffer
+            if self.buffer_size > 0:
+                lltype.free(self.pixelbuffer, flavor='raw')
+            self.pixelbuffer = lltype.malloc(rffi.ULONGP.TO, size, flavor='raw')
+            self.buffer_size = size
+        for i in range(self.buffer_size):
+            self.pixelbuffer[i] = rffi.cast(rffi.ULONG, 0)
+
+    def get_pixelbuffer(self):
+        return self.pixelbuffer
+
+    def post_event(self, event):
+        """Queue an event, a list of 8 ints. A time of 0 is replaced by the
+        time it is fetched at."""
+        assert len(event) == 8
+        self.events.append(event)
+        self.posted = True
+
+    def poll_events(self, time=0):
+        posted = self.posted
+        self.posted = False
+        return posted
+
+    def has_pending_events(self):
+        return len(self.events) > 0 or self._deferred_event is not None
+
+    def wait_for_event(self, timeout):
+        # events are only posted by the image, none can arrive while it idles
+        import time
+        sleep_until(time.time() + timeout)
+        return False
+
+    def get_next_event(self, time=0):
+        if self._deferred_event:
+            deferred = self._deferred_event
+            self._deferred_event = None
+            return deferred
+        if not self.events:
+            return [EventTypeNone, 0, 0, 0, 0, 0, 0, 0]
+        event = self.events.pop(0)
+        if event[1] == 0:
+            event[1] = time
+        if event[0] == EventTypeMouse:
+            self.mouse_position = [event[2], event[3]]
+            self.button = event[4]
+            self.modifiers = event[5]
+        elif event[0] == EventTypeKeyboard:
+            self.modifiers = event[4]
+            if event[3] == EventKeyChar:
+                self.key = event[2]
+            elif event[3] == EventKeyDown:
+                self.key = event[2]
+                self.check_interrupt_key()
+        return event
+
+    def pump_events(self):
+        """Apply the queued events to the old style polling state."""
+        while self.events:
+            self.get_next_event()
+
+    def get_modifier_mask(self, shift):
+        return self.modifiers << shift
+
+    def mouse_point(self):
+        self.pump_events()
+        return Display.mouse_point(self)
+
+    def mouse_button(self):
+        self.pump_events()
+        return Display.mouse_button(self)
 
     def peek_keycode(self):
         self.pump_events()
-        self.key |= self.get_modifier_mask(8)
-        return self.key
+        return Display.peek_keycode(self)
 
-    def set_interrupt_key(self, space, encoded_key):
-        self.interrupt_key = encoded_key
+
+def sleep_until(deadline):
+    import time
+    remaining = deadline - time.time()
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+def create_display(title, headless=False):
+    if headless:
+        return HeadlessDisplay()
+    return SDLDisplay(title)
+
+
+# The number of SDL cursors kept for switching back to them
+CURSOR_CACHE_SIZE = 16
+
+
+def hash_words(h, words):
+    if words:
+        for word in words:
+            h = intmask((h * 1000003) ^ intmask(word))
+    return h
+
+def same_words(words, other):
+    if not words or not other:
+        return (not words) == (not other)
+    if len(words) != len(other):
+        return False
+    for i in range(len(words)):
+        if words[i] != other[i]:
+            return False
+    return True
+
+
+class CachedCursor(object):
+    """An SDL cursor with the cursor Form contents it was created from."""
+    _attrs_ = ["content_hash", "data_words", "mask_words", "w", "h", "x", "y", "cursor"]
+
+    def __init__(self, content_hash, data_words, mask_words, w, h, x, y, cursor):
+        self.content_hash = content_hash
+        self.data_words = data_words
+        self.mask_words = mask_words
+        self.w = w
+        self.h = h
+        self.x = x
+        self.y = y
+        self.cursor = cursor
+
+    def matches(self, content_hash, data_words, mask_words, w, h, x, y):
+        return (self.content_hash == content_hash and self.w == w and self.h == h and
+                self.x == x and self.y == y and
+                same_words(self.data_words, data_words) and
+                same_words(self.mask_words, mask_words))
 
 
 class SDLCursorClass(object):
-    _attrs_ = ["cursor", "has_cursor", "has_display"]
+    """The cursor shown by SDL. The SDL cursors are cached by the contents
+    of the cursor Forms, least recently used first, so switching back to a
+    cursor is a single SDL_SetCursor."""
+    _attrs_ = ["cursor", "has_cursor", "has_display", "cache"]
 
     instance = None
 
@@ -275,23 +763,47 @@ class SDLCursorClass(object):
         self.cursor = lltype.nullptr(RSDL.CursorPtr.TO)
         self.has_cursor = False
         self.has_display = False
+        self.cache = []
 
     def set(self, data_words, w, h, x, y, mask_words=None):
         if not self.has_display:
             return
-        if self.has_cursor:
-            RSDL.FreeCursor(self.cursor)
+        content_hash = intmask((w << 16) ^ (h << 8) ^ (x << 4) ^ y)
+        content_hash = hash_words(hash_words(content_hash, data_words), mask_words)
+        for i in range(len(self.cache)):
+            entry = self.cache[i]
+            if entry.matches(content_hash, data_words, mask_words, w, h, x, y):
+                del self.cache[i]
+                self.cache.append(entry)
+                self.show(entry.cursor)
+                return
         data = self.words_to_bytes(len(data_words) * 4, data_words)
         try:
             mask = self.words_to_bytes(len(data_words) * 4, mask_words)
             try:
-                self.cursor = RSDL.CreateCursor(data, mask, w * 2, h, x, y)
-                self.has_cursor = True
-                RSDL.SetCursor(self.cursor)
+                cursor = RSDL.CreateCursor(data, mask, w * 2, h, x, y)
             finally:
                 lltype.free(mask, flavor="raw")
         finally:
             lltype.free(data, flavor="raw")
+        # the Form's words may change later, keep a copy
+        if mask_words:
+            mask_copy = list(mask_words)
+        else:
+            mask_copy = None
+        self.cache.append(CachedCursor(content_hash, list(data_words), mask_copy,
+                                       w, h, x, y, cursor))
+        self.show(cursor)
+        if len(self.cache) > CURSOR_CACHE_SIZE:
+            # the least recently used cursor is not the one shown
+            RSDL.FreeCursor(self.cache.pop(0).cursor)
+
+    def show(self, cursor):
+        if self.has_cursor and self.cursor == cursor:
+            return
+        self.cursor = cursor
+        self.has_cursor = True
+        RSDL.SetCursor(cursor)
 
     def words_to_bytes(self, bytenum, words):
         bytes = lltype.malloc(RSDL.Uint8P.TO, bytenum, flavor="raw")
@@ -1,11 +1,12 @@
 import py
 import os
 from spyvm.shadow import ContextPartShadow, MethodContextShadow, BlockContextShadow, MethodNotFound
-from spyvm import model, constants, primitives, conftest, wrapper
+from spyvm import model, constants, primitives, conftest, wrapper, clock
 from spyvm.tool.bitmanipulation import splitter
 
 from rpython.rlib import jit
 from rpython.rlib import objectmodel, unroll
+from rpython.rlib.rarithmetic import intmask, r_longlong
 
 class MissingBytecode(Exception):
     """Bytecode not implemented yet."""
@@ -25,7 +26,8 @@ def get_printable_location(pc, self, method):
 class Interpreter(object):
     _immutable_fields_ = ["space", "image", "image_name",
                           "max_stack_depth", "interrupt_counter_size",
-                          "startup_time", "evented"]
+                          "adaptive_interrupt_checks", "startup_time",
+                          "evented", "headless"]
     _w_last_active_context = None
     cnt = 0
     _last_indent = ""
@@ -37,26 +39,33 @@ class Interpreter(object):
     )
 
     def __init__(self, space, image=None, image_name="", trace=False,
-                 evented=True,
+                 evented=True, headless=False,
                  max_stack_depth=constants.MAX_LOOP_DEPTH):
-        import time
         self.space = space
         self.image = image
         self.image_name = image_name
+        # in microseconds of the monotonic clock
         if image:
             self.startup_time = image.startup_time
         else:
-            self.startup_time = constants.CompileTime
+            self.startup_time = r_longlong(0)
         self.max_stack_depth = max_stack_depth
         self.remaining_stack_depth = max_stack_depth
         self._loop = False
+        self.primitive_failed = False
         self.next_wakeup_tick = 0
+        self.input_semaphore_index = 0
         self.evented = evented
+        self.headless = headless
         try:
             self.interrupt_counter_size = int(os.environ["SPY_ICS"])
+            self.adaptive_interrupt_checks = False
         except KeyError:
             self.interrupt_counter_size = constants.INTERRUPT_COUNTER_SIZE
+            self.adaptive_interrupt_checks = True
+        self.interrupt_check_interval = self.interrupt_counter_size
         self.interrupt_check_counter = self.interrupt_counter_size
+        self.last_interrupt_check = r_longlong(0)
         # ######################################################################
         self.trace = trace
         self.trace_proxy = False
@@ -180,20 +189,50 @@ class Interpreter(object):
     def quick_check_for_interrupt(self, s_frame, dec=1):
         self.interrupt_check_counter -= dec
         if self.interrupt_check_counter <= 0:
-            self.interrupt_check_counter = self.interrupt_counter_size
+            if dec > 0:
+                # the counter ran out, rather than a primitive forcing a check
+                self.adjust_interrupt_check_interval()
+            self.interrupt_check_counter = self.interrupt_check_interval
             self.check_for_interrupts(s_frame)
 
+    def adjust_interrupt_check_interval(self):
+        # parallel to the feedback in Interpreter>>#checkForInterrupts: the
+        # counter is sized so the checks happen about every
+        # INTERRUPT_CHECK_MICROSECONDS, and Delays are signaled on time no
+        # matter how fast the bytecodes run
+        if not self.adaptive_interrupt_checks:
+            return
+        elapsed = self.microseconds_now() - self.last_interrupt_check
+        interval = self.interrupt_check_interval
+        if elapsed < constants.INTERRUPT_CHECK_MICROSECONDS / 2:
+            interval += interval / 4
+        elif elapsed > constants.INTERRUPT_CHECK_MICROSECONDS * 2:
+            interval /= 2
+        if interval < constants.MIN_INTERRUPT_COUNTER_SIZE:
+            interval = constants.MIN_INTERRUPT_COUNTER_SIZE
+        elif interval > constants.MAX_INTERRUPT_COUNTER_SIZE:
+            interval = constants.MAX_INTERRUPT_COUNTER_SIZE
+        self.interrupt_check_interval = interval
+
     def check_for_interrupts(self, s_frame):
         # parallel to Interpreter>>#checkForInterrupts
 
         # Profiling is skipped
-        # We don't adjust the check counter size
+        self.last_interrupt_check = self.microseconds_now()
 
         # use the same time value as the primitive MILLISECOND_CLOCK
-        now = self.time_now()
+        now = intmask(self.last_interrupt_check / 1000)
 
         # XXX the low space semaphore may be signaled here
-        # Process inputs
+        # Update the screen regions changed since the last check
+        sdldisplay = self.space.display_or_none()
+        if sdldisplay is not None:
+            sdldisplay.flush_damage()
+        # Process inputs, with -p the events are left to the polling primitives
+        if (self.evented and self.input_semaphore_index != 0 and
+                sdldisplay is not None):
+            if sdldisplay.poll_events(now):
+                self.signal_external_semaphore(self.input_semaphore_index, s_frame)
         # Process User Interrupt?
         if not self.next_wakeup_tick == 0 and now >= self.next_wakeup_tick:
             self.next_wakeup_tick = 0
@@ -201,13 +240,46 @@ class Interpreter(object):
             if not semaphore.is_same_object(self.space.w_nil):
                 wrapper.SemaphoreWrapper(self.space, semaphore).signal(s_frame.w_self())
         # We have no finalization process, so far.
-        # We do not support external semaphores.
-            # In cog, the method to add such a semaphore is only called in GC.
+        # External semaphores are only signaled for input, see above.
+
+    def signal_external_semaphore(self, index, s_frame):
+        # parallel to Interpreter>>#signalExternalSemaphores, index is one-based
+        # into the ExternalObjectsArray, which the image replaces when it grows
+        if self.image is None:
+            return
+        w_objects = self.image.w_special_objects.fetch(
+            self.space, constants.SO_EXTERNAL_OBJECTS_ARRAY)
+        if not isinstance(w_objects, model.W_PointersObject) or not 0 < index <= w_objects.size():
+            return
+        w_semaphore = w_objects.fetch(self.space, index - 1)
+        if w_semaphore.getclass(self.space).is_same_object(self.space.w_Semaphore):
+            wrapper.SemaphoreWrapper(self.space, w_semaphore).signal(s_frame.w_self())
+
+    def idle(self, microseconds):
+        """Relinquish the processor until the timer semaphore is due or input
+        arrives. Without a pending timer, idle for the given microseconds at
+        most. The idle process is only scheduled when nothing else can run,
+        so it is safe to sleep past its own time slice up to the next timer
+        wakeup, like Cog's ioRelinquishProcessorForMicroseconds does."""
+        import time
+        if self.next_wakeup_tick != 0:
+            wait = r_longlong(self.next_wakeup_tick) * 1000 - self.microseconds_now()
+        else:
+            wait = r_longlong(microseconds)
+        if wait <= 0:
+            return
+        timeout = float(wait) / 1000000.0
+        sdldisplay = self.space.display_or_none()
+        if sdldisplay is not None:
+            sdldisplay.wait_for_event(timeout)
+        else:
+            time.sleep(timeout)
 
     def time_now(self):
-        import time
-        from rpython.rlib.rarithmetic import intmask
-        return intmask((int(time.time() * 1000) - self.startup_time))
+        return intmask(self.microseconds_now() / 1000)
+
+    def microseconds_now(self):
+        return clock.monotonic_microseconds() - self.startup_time
 
     def padding(self, symbol=' '):
         return symbol * (self.max_stack_depth - self.remaining_stack_depth)
@@ -244,11 +316,10 @@ def make_call_primitive_bytecode(primitive, selector, argcount):
         # The rule of thumb is that primitives with only int and float
         # in their unwrap_spec are safe.
         # XXX move next line out of callPrimitive?
-        func = primitives.prim_table[primitive]
-        try:
-            return func(interp, self, argcount)
-        except primitives.PrimitiveFailedError:
-            pass
+        func = primitives.prim_holder.status_table[primitive]
+        s_new_frame = func(interp, self, argcount)
+        if not interp.primitive_failed:
+            return s_new_frame
         return self._sendSelfSelectorSpecial(selector, argcount, interp)
     return callPrimitive
 
@@ -256,15 +327,16 @@ def make_call_primitive_bytecode_classbased(a_class_name, a_primitive, alternati
     def callPrimitive(self, interp, current_bytecode):
         rcvr = self.peek(argcount)
         receiver_class = rcvr.getclass(self.space)
-        try:
-            if receiver_class is getattr(self.space, a_class_name):
-                func = primitives.prim_table[a_primitive]
-                return func(interp, self, argcount)
-            elif receiver_class is getattr(self.space, alternative_class_name):
-                func = primitives.prim_table[alternative_primitive]
-                return func(interp, self, argcount)
-        except primitives.PrimitiveFailedError:
-            pass
+        if receiver_class is getattr(self.space, a_class_name):
+            func = primitives.prim_holder.status_table[a_primitive]
+            s_new_frame = func(interp, self, argcount)
+            if not interp.primitive_failed:
+                return s_new_frame
+        elif receiver_class is getattr(self.space, alternative_class_name):
+            func = primitives.prim_holder.status_table[alternative_primitive]
+            s_new_frame = func(interp, self, argcount)
+            if not interp.primitive_failed:
+                return s_new_frame
         return self._sendSelfSelectorSpecial(selector, argcount, interp)
     return callPrimitive
 
@@ -370,10 +442,10 @@ class __extend__(ContextPartShadow):
 
         code = s_method.primitive()
         if code:
-            try:
-                return self._call_primitive(code, interp, argcount, s_method, w_selector)
-            except primitives.PrimitiveFailedError:
-                pass # ignore this error and fall back to the Smalltalk version
+            s_new_frame = self._call_primitive(code, interp, argcount, s_method, w_selector)
+            if not interp.primitive_failed:
+                return s_new_frame
+            # fall back to the Smalltalk version
         arguments = self.pop_and_return_n(argcount)
         s_frame = s_method.create_frame(self.space, receiver, arguments, self)
         self.pop() # receiver
@@ -410,26 +482,26 @@ class __extend__(ContextPartShadow):
         return interp.stack_frame(s_frame)
 
     def _call_primitive(self, code, interp, argcount, s_method, w_selector):
-        # the primitive pushes the result (if any) onto the stack itself
+        # the primitive pushes the result (if any) onto the stack itself,
+        # whether it failed is left in interp.primitive_failed
         if interp.should_trace():
             print "%sActually calling primitive %d" % (interp._last_indent, code,)
-        func = primitives.prim_holder.prim_table[code]
+        func = primitives.prim_holder.status_table[code]
         # ##################################################################
         if interp.trace:
             print "%s-> primitive %d \t(in #%s, named #%s)" % (
                 ' ' * (interp.max_stack_depth - interp.remaining_stack_depth),
                     code, self.w_method()._likely_methodname, w_selector.as_repr_string())
-        try:
-            # note: argcount does not include rcvr
-            return func(interp, self, argcount, s_method)
-        except primitives.PrimitiveFailedError, e:
+        # note: argcount does not include rcvr
+        s_new_frame = func(interp, self, argcount, s_method)
+        if interp.primitive_failed:
             if interp.trace:
                 print "%s primitive FAILED" % (
                 ' ' * (interp.max_stack_depth - interp.remaining_stack_depth),)
 
             if interp.should_trace(True):
                 print "PRIMITIVE FAILED: %d %s" % (s_method.primitive, w_selector.as_repr_string())
-            raise e
+        return s_new_frame
 
 
     def _return(self, return_value, interp, s_return_to):
@@ -926,9 +998,8 @@ def debugging():
 
     def stepping_debugger_failed_primitive_halt(original):
         def meth(self, code, interp, argcount, s_method, w_selector):
-            try:
-                original(self, code, interp, argcount, s_method, w_selector)
-            except primitives.PrimitiveFailedError, e:
+            s_new_frame = original(self, code, interp, argcount, s_method, w_selector)
+            if interp.primitive_failed:
                 if interp.halt_on_failing_primitives:
                     func = primitives.prim_holder.prim_table[code]
                     if func.func_name != 'raise_failing_default' and code != 83:
@@ -937,7 +1008,8 @@ def debugging():
                             func(interp, self, argcount, s_method) # will fail again
                         except primitives.PrimitiveFailedError:
                             pass
-                raise e
+                interp.primitive_failed = True
+            return s_new_frame
         return meth
 
     ContextPartShadow._call_primitive = stepping_debugger_failed_primitive_halt(ContextPartShadow._call_primitive)
@@ -962,6 +1034,7 @@ def debugging():
         return meth
 
     primitives.prim_table[primitives.EXTERNAL_CALL] = trace_missing_named_primitives(primitives.prim_table[primitives.EXTERNAL_CALL])
+    primitives.status_table[primitives.EXTERNAL_CALL] = primitives.status_from_raising(primitives.prim_table[primitives.EXTERNAL_CALL])
     debugging.missing_named_primitives = set()
 
 # debugging()
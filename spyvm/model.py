@@ -24,6 +24,12 @@ from rpython.rlib.objectmodel import instantiate, compute_hash
 from rpython.rtyper.lltypesystem import lltype, rffi
 from rsdl import RSDL, RSDL_helper
 
+def copies_into_itself(w_self, start, w_source, repstart, stop):
+    """Whether copying repstart.. of w_source forward into start..stop reads
+    elements the copy has already written. Then it can't be done in bulk."""
+    return w_self is w_source and repstart < start <= repstart + stop - start
+
+
 class W_Object(object):
     """Root of Squeak model, abstract."""
     _attrs_ = []    # no RPython-level instance variables allowed in W_Object
@@ -120,6 +126,16 @@ class W_Object(object):
     def clone(self, space):
         raise NotImplementedError
 
+    def replace_from_to(self, space, start, stop, w_source, repstart):
+        """Copy the indexable fields repstart.. of w_source into start..stop of
+        the receiver. The indices are 0-based, already range-checked and
+        w_source has the same representation as the receiver. Answer False if
+        there is no bulk path and the caller has to fall back to at0/atput0.
+        Like primitiveStringReplace, overlapping ranges are copied forward one
+        element at a time, so a source range starting before the destination
+        repeats itself (InflateStream relies on that for back-references)."""
+        return False
+
     def has_class(self):
         """All Smalltalk objects should have classes. Unfortuantely for
         bootstrapping the metaclass-cycle and during testing, that is not
@@ -662,11 +678,34 @@ class W_PointersObject(W_AbstractPointersObject):
 
     @jit.unroll_safe
     def clone(self, space):
-        w_result = W_PointersObject(self.space, self.getclass(space),
-                                    len(self._vars))
-        w_result._vars = [self.fetch(space, i) for i in range(len(self._vars))]
+        if self.has_shadow():
+            w_result = W_PointersObject(self.space, self.getclass(space),
+                                        len(self._vars))
+            w_result._vars = [self.fetch(space, i) for i in range(len(self._vars))]
+        else:
+            # without a shadow, the fields and their types can be copied as is
+            w_result = W_PointersObject(self.space, self.getclass(space), 0)
+            w_result._vars = list(self._vars)
+            w_result.fieldtypes = self.fieldtypes
         return w_result
 
+    def replace_from_to(self, space, start, stop, w_source, repstart):
+        from spyvm.fieldtypes import nilTyper
+        assert isinstance(w_source, W_PointersObject)
+        if copies_into_itself(self, start, w_source, repstart, stop):
+            return False
+        # shadows and typed fields have to see every store
+        if (self.has_shadow() or w_source.has_shadow() or
+                self.fieldtypes is not nilTyper):
+            return False
+        offset = self.instsize(space)
+        repoffset = w_source.instsize(space)
+        start += offset
+        stop += offset
+        repstart += repoffset
+        self._vars[start:stop + 1] = w_source._vars[repstart:repstart + stop + 1 - start]
+        return True
+
     def fieldtype(self):
         from spyvm.fieldtypes import obj
         return obj
@@ -814,6 +853,23 @@ class W_BytesObject(W_AbstractObjectWithClassReference):
                 return False
         return True
 
+    def replace_from_to(self, space, start, stop, w_source, repstart):
+        assert isinstance(w_source, W_BytesObject)
+        if (self.bytes is not None and w_source.bytes is not None and
+                not copies_into_itself(self, start, w_source, repstart, stop)):
+            self.bytes[start:stop + 1] = w_source.bytes[repstart:repstart + stop + 1 - start]
+        else:
+            for i in range(start, stop + 1):
+                self.setchar(i, w_source.getchar(repstart + i - start))
+        return True
+
+    def fill(self, character):
+        if self.bytes is not None:
+            self.bytes = [character] * self.size()
+        else:
+            for i in range(self.size()):
+                self.c_bytes[i] = character
+
     def clone(self, space):
         size = self.size()
         w_result = W_BytesObject(self.space, self.getclass(space), size)
@@ -919,6 +975,23 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
         return (W_AbstractObjectWithClassReference.invariant(self) and
                 isinstance(self.words, list))
 
+    def replace_from_to(self, space, start, stop, w_source, repstart):
+        assert isinstance(w_source, W_WordsObject)
+        if (self.words is not None and w_source.words is not None and
+                not copies_into_itself(self, start, w_source, repstart, stop)):
+            self.words[start:stop + 1] = w_source.words[repstart:repstart + stop + 1 - start]
+        else:
+            for i in range(start, stop + 1):
+                self.setword(i, w_source.getword(repstart + i - start))
+        return True
+
+    def fill(self, word):
+        if self.words is not None:
+            self.words = [word] * self.size()
+        else:
+            for i in range(self.size()):
+                self.c_words[i] = intmask(word)
+
     def clone(self, space):
         size = self.size()
         w_result = W_WordsObject(self.space, self.getclass(space), size)
@@ -954,7 +1027,7 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
         depth = interp.space.unwrap_int(w_form.fetch(interp.space, 3))
         if not sdldisplay:
             from spyvm import display
-            sdldisplay = display.SDLDisplay(interp.image_name)
+            sdldisplay = display.create_display(interp.image_name, interp.headless)
             sdldisplay.set_video_mode(width, height, depth)
         w_display_bitmap = W_DisplayBitmap.create(
             interp.space,
@@ -974,7 +1047,12 @@ class W_WordsObject(W_AbstractObjectWithClassReference):
 
 
 class W_DisplayBitmap(W_AbstractObjectWithClassReference):
-    _attrs_ = ['pixelbuffer', '_realsize', '_real_depth_buffer', 'display', '_depth']
+    """The bits of the Display. The image's words are kept in
+    _real_depth_buffer and converted into the display's pixel buffer lazily:
+    stores only extend the span of dirty words, which is converted in one go
+    right before the screen is updated (see Display.sync_pixels)."""
+    _attrs_ = ['pixelbuffer', '_realsize', '_real_depth_buffer', 'display', '_depth',
+               '_dirty_start', '_dirty_stop']
     _immutable_fields_ = ['_realsize', 'display', '_depth']
 
     @staticmethod
@@ -990,11 +1068,15 @@ class W_DisplayBitmap(W_AbstractObjectWithClassReference):
 
     def __init__(self, space, w_class, size, depth, display):
         W_AbstractObjectWithClassReference.__init__(self, space, w_class)
-        self._real_depth_buffer = lltype.malloc(rffi.CArray(rffi.UINT), size, flavor='raw')
+        self._real_depth_buffer = lltype.malloc(rffi.CArray(rffi.UINT), size,
+                                                flavor='raw', zero=True)
         self.pixelbuffer = display.get_pixelbuffer()
         self._realsize = size
         self.display = display
         self._depth = depth
+        self._dirty_start = 0
+        self._dirty_stop = 0
+        display.pixel_source = self
 
     def at0(self, space, index0):
         val = self.getword(index0)
@@ -1003,6 +1085,18 @@ class W_DisplayBitmap(W_AbstractObjectWithClassReference):
     def atput0(self, space, index0, w_value):
         word = space.unwrap_uint(w_value)
         self.setword(index0, word)
+        self.invalidate_word(index0)
+
+    def invalidate_word(self, index0):
+        # rows of the Display are word aligned
+        pixels_per_word = 32 / self._depth
+        words_per_row = (self.display.width + pixels_per_word - 1) / pixels_per_word
+        x = (index0 % words_per_row) * pixels_per_word
+        y = index0 / words_per_row
+        self.display.invalidate(x, y, x + pixels_per_word, y + 1)
+
+    def invalidate(self, left, top, right, bottom):
+        self.display.invalidate(left, top, right, bottom)
 
     def flush_to_screen(self):
         self.display.flip()
@@ -1023,18 +1117,44 @@ class W_DisplayBitmap(W_AbstractObjectWithClassReference):
 
     def getword(self, n):
         assert self.size() > n >= 0
-        return self._real_depth_buffer[n]
+        return r_uint(self._real_depth_buffer[n])
 
     def setword(self, n, word):
-        self._real_depth_buffer[n] = word
-        self.pixelbuffer[n] = word
+        self._real_depth_buffer[n] = rffi.cast(rffi.UINT, word)
+        if self._dirty_start == self._dirty_stop:
+            self._dirty_start = n
+            self._dirty_stop = n + 1
+        elif n < self._dirty_start:
+            self._dirty_start = n
+        elif n >= self._dirty_stop:
+            self._dirty_stop = n + 1
 
     def is_array_object(self):
         return True
 
     def update_from_buffer(self):
-        for i in range(self._realsize):
-            self.setword(i, self.getword(i))
+        self._dirty_start = 0
+        self._dirty_stop = self._realsize
+
+    def attach(self):
+        """Make this the bitmap shown on the display again, after another
+        one was shown."""
+        self.pixelbuffer = self.display.get_pixelbuffer()
+        self.display.pixel_source = self
+        self.update_from_buffer()
+
+    @jit.dont_look_inside
+    def convert_dirty(self):
+        """Convert the words stored since the last update into the pixel
+        buffer."""
+        if self._dirty_start < self._dirty_stop:
+            self.convert_words(self._dirty_start, self._dirty_stop)
+        self._dirty_start = 0
+        self._dirty_stop = 0
+
+    def convert_words(self, start, stop):
+        for n in range(start, stop):
+            self.pixelbuffer[n] = rffi.cast(rffi.ULONG, self._real_depth_buffer[n])
 
     def convert_to_c_layout(self):
         return self._real_depth_buffer
@@ -1043,57 +1163,82 @@ class W_DisplayBitmap(W_AbstractObjectWithClassReference):
         lltype.free(self._real_depth_buffer, flavor='raw')
 
 
-class W_16BitDisplayBitmap(W_DisplayBitmap):
-    def setword(self, n, word):
-        self._real_depth_buffer[n] = word
-        mask = 0b11111
-        lsb = (r_uint(word) & r_uint(0xffff0000)) >> 16
-        msb = (r_uint(word) & r_uint(0x0000ffff))
-
-        lsb = (
-            ((lsb >> 10) & mask) |
-            (((lsb >> 5) & mask) << 6) |
-            ((lsb & mask) << 11)
-        )
-        msb = (
-            ((msb >> 10) & mask) |
-            (((msb >> 5) & mask) << 6) |
-            ((msb & mask) << 11)
-        )
+def swizzle_16bit_pixels():
+    # Squeak's 5-5-5 pixels have red in the high bits, the pixel buffer has
+    # it in the low bits and green shifted up by one
+    table = [0] * (1 << 15)
+    mask = 0b11111
+    for pixel in range(1 << 15):
+        table[pixel] = (((pixel >> 10) & mask) |
+                        (((pixel >> 5) & mask) << 6) |
+                        ((pixel & mask) << 11))
+    return table
+
+SWIZZLE_16BIT = swizzle_16bit_pixels()
+
 
-        self.pixelbuffer[n] = r_uint(lsb | (msb << 16))
+class W_16BitDisplayBitmap(W_DisplayBitmap):
+    def convert_words(self, start, stop):
+        for n in range(start, stop):
+            word = r_uint(self._real_depth_buffer[n])
+            lsb = r_uint(SWIZZLE_16BIT[intmask(word >> 16) & 0x7FFF])
+            msb = r_uint(SWIZZLE_16BIT[intmask(word) & 0x7FFF])
+            self.pixelbuffer[n] = rffi.cast(rffi.ULONG, lsb | (msb << 16))
 
 
 class W_8BitDisplayBitmap(W_DisplayBitmap):
-    def setword(self, n, word):
-        self._real_depth_buffer[n] = word
-        self.pixelbuffer[n] = r_uint(
-            (word >> 24) |
-            ((word >> 8) & 0x0000ff00) |
-            ((word << 8) & 0x00ff0000) |
-            (word << 24)
-        )
+    def convert_words(self, start, stop):
+        for n in range(start, stop):
+            word = r_uint(self._real_depth_buffer[n])
+            self.pixelbuffer[n] = rffi.cast(rffi.ULONG,
+                (word >> 24) |
+                ((word >> 8) & 0x0000ff00) |
+                ((word << 8) & 0x00ff0000) |
+                ((word << 24) & 0xff000000)
+            )
 
 
 NATIVE_DEPTH = 8
+
+def expand_pixels(depth):
+    # the native word for every group of four pixels at depth, the first
+    # pixel is in the high bits of the group and goes to the lowest byte
+    mask = (1 << depth) - 1
+    table = [0] * (1 << (4 * depth))
+    for group in range(1 << (4 * depth)):
+        mapword = 0
+        for i in range(4):
+            mapword |= ((group >> ((3 - i) * depth)) & mask) << (i * 8)
+        table[group] = mapword
+    return table
+
+EXPAND_1BIT = expand_pixels(1)
+EXPAND_2BIT = expand_pixels(2)
+EXPAND_4BIT = expand_pixels(4)
+
 class W_MappingDisplayBitmap(W_DisplayBitmap):
-    @jit.unroll_safe
-    def setword(self, n, word):
-        self._real_depth_buffer[n] = word
-        word = r_uint(word)
-        pos = self.compute_pos(n)
+    def convert_words(self, start, stop):
         assert self._depth <= 4
-        rshift = 32 - self._depth
-        for i in xrange(8 / self._depth):
-            if pos >= self.size():
-                return
-            mapword = r_uint(0)
-            for i in xrange(4):
-                pixel = r_uint(word) >> rshift
-                mapword |= (r_uint(pixel) << (i * 8))
-                word <<= self._depth
-            self.pixelbuffer[pos] = mapword
-            pos += 1
+        if self._depth == 1:
+            table = EXPAND_1BIT
+        elif self._depth == 2:
+            table = EXPAND_2BIT
+        else:
+            table = EXPAND_4BIT
+        group_bits = 4 * self._depth
+        group_mask = (r_uint(1) << group_bits) - 1
+        groups = 8 / self._depth
+        size = self.size()
+        for n in range(start, stop):
+            word = r_uint(self._real_depth_buffer[n])
+            pos = self.compute_pos(n)
+            for i in range(groups):
+                if pos >= size:
+                    break
+                group = intmask((word >> (32 - group_bits)) & group_mask)
+                self.pixelbuffer[pos] = rffi.cast(rffi.ULONG, table[group])
+                word <<= group_bits
+                pos += 1
 
     def compute_pos(self, n):
         return n * (NATIVE_DEPTH / self._depth)
@@ -1132,10 +1277,12 @@ class W_CompiledMethod(W_AbstractObjectWithIdentityHash):
         self.bytes = ["\x00"] * bytecount
 
     def fillin(self, space, g_self):
+        self.hash = g_self.get_hash()
         # Implicitely sets the header, including self.literalsize
         for i, w_object in enumerate(g_self.get_pointers()):
             self.literalatput0(space, i, w_object)
-        self.setbytes(g_self.get_bytes()[(self.literalsize + 1) * 4:])
+        word_size = g_self.reader.word_size
+        self.setbytes(g_self.get_bytes()[(self.literalsize + 1) * word_size:])
 
     def become(self, w_other):
         if not isinstance(w_other, W_CompiledMethod):
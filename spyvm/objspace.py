@@ -4,7 +4,7 @@ from spyvm import constants, model, shadow, wrapper
 from spyvm.error import UnwrappingError, WrappingError, PrimitiveFailedError
 from rpython.rlib import jit, rpath
 from rpython.rlib.objectmodel import instantiate, specialize
-from rpython.rlib.rarithmetic import intmask, r_uint, int_between
+from rpython.rlib.rarithmetic import intmask, r_uint, r_ulonglong, int_between
 
 class ObjSpace(object):
     def __init__(self):
@@ -219,6 +219,21 @@ class ObjSpace(object):
         else:
             return model.W_LargePositiveInteger1Word(val)
 
+    def wrap_positive_64bit_int(self, val):
+        # val is an r_ulonglong, larger values become LargePositiveIntegers
+        # with the bytes in little endian order
+        if val <= r_ulonglong(constants.MAXINT):
+            return model.W_SmallInteger(intmask(val))
+        size = 0
+        rest = val
+        while rest != 0:
+            size += 1
+            rest = rest >> 8
+        w_result = self.w_LargePositiveInteger.as_class_get_shadow(self).new(size)
+        for i in range(size):
+            w_result.setchar(i, chr(intmask((val >> (8 * i)) & 0xFF)))
+        return w_result
+
     def wrap_float(self, i):
         return model.W_Float(i)
 
@@ -303,12 +318,18 @@ class ObjSpace(object):
         return [w_array.at0(self, i) for i in range(w_array.size())]
 
     def get_display(self):
+        sdldisplay = self.display_or_none()
+        if sdldisplay is None:
+            raise PrimitiveFailedError("No display")
+        return sdldisplay
+
+    def display_or_none(self):
         w_display = self.objtable['w_display']
         if w_display:
             w_bitmap = w_display.fetch(self, 0)
             if isinstance(w_bitmap, model.W_DisplayBitmap):
                 return w_bitmap.display
-        raise PrimitiveFailedError("No display")
+        return None
 
     def _freeze_(self):
         return True
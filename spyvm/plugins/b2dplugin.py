@@ -0,0 +1,1016 @@
+import math, os, time, weakref
+
+from rpython.rlib.rarithmetic import r_uint, intmask
+
+from spyvm import model, wrapper
+from spyvm.error import PrimitiveFailedError
+from spyvm.plugins.plugin import Plugin
+from spyvm.plugins.bitblt import BitBltShadow, FormShadow, rgb_map
+from spyvm.plugins.floatarrayplugin import word_to_float
+
+B2DPlugin = Plugin()
+
+# The Balloon engine behind BalloonEngine and BalloonCanvas. The C plugin
+# keeps its edge and fill lists inside the work buffer and renders scan line
+# by scan line, handing external edges and fills back to the image. Here the
+# work buffer only carries a magic number, the handle of an EngineState and
+# the session the handle belongs to.
+# Every shape is flattened into line segments per fill, and the whole image
+# is rendered at once with supersampling into the 32 bit destination form of
+# the engine's BitBlt. External edges and fills are not supported.
+
+# BalloonEngine instance variables
+BE_WORKBUFFER = 0
+BE_SPAN = 1
+BE_BITBLT = 2
+BE_FORMS = 3
+BE_SIZE = 4
+
+# work buffer header
+WB_MAGIC = r_uint(0x416E6469)
+WB_HANDLE = 1
+WB_SESSION = 2
+WB_HEADER_SIZE = 3
+
+# fill values with a non-zero alpha byte are premultiplied 32 bit colors,
+# smaller non-zero values are handles of gradient and bitmap fills
+FILL_COLOR_MASK = r_uint(0xFF000000)
+
+MAX_FLATTEN_STEPS = 64
+
+
+class Fill(object):
+    def pixel_at(self, x, y):
+        raise NotImplementedError
+
+
+class SolidFill(Fill):
+    def __init__(self, color):
+        self.color = color
+
+    def pixel_at(self, x, y):
+        return self.color
+
+
+class GradientFill(Fill):
+    """A color ramp along the direction from the origin, or around it if the
+    fill is radial; direction and normal are the radii of radial fills."""
+    def __init__(self, ramp, ox, oy, dx, dy, nx, ny, radial):
+        self.ramp = ramp
+        self.ox = ox
+        self.oy = oy
+        self.dx = dx
+        self.dy = dy
+        self.nx = nx
+        self.ny = ny
+        self.radial = radial
+
+    def pixel_at(self, x, y):
+        px = x - self.ox
+        py = y - self.oy
+        t = (px * self.dx + py * self.dy) / (self.dx * self.dx + self.dy * self.dy)
+        if self.radial:
+            s = (px * self.nx + py * self.ny) / (self.nx * self.nx + self.ny * self.ny)
+            t = math.sqrt(t * t + s * s)
+        size = len(self.ramp)
+        index = int(math.floor(t * size))
+        if index < 0:
+            index = 0
+        elif index >= size:
+            index = size - 1
+        return self.ramp[index]
+
+
+class BitmapFill(Fill):
+    """A form mapped onto the plane so that direction and normal span its
+    width and height, optionally tiled."""
+    def __init__(self, s_form, w_cmap, tile, ox, oy, dx, dy, nx, ny, color_transform):
+        self.w_bits = s_form.w_bits
+        self.width = s_form.width
+        self.height = s_form.height
+        self.depth = s_form.depth
+        self.msb = s_form.msb
+        self.pitch = s_form.pitch
+        self.pix_per_word = s_form.pixPerWord
+        self.w_cmap = w_cmap
+        self.tile = tile
+        self.ox = ox
+        self.oy = oy
+        self.dx = dx
+        self.dy = dy
+        self.nx = nx
+        self.ny = ny
+        self.color_transform = color_transform
+
+    def pixel_at(self, x, y):
+        px = x - self.ox
+        py = y - self.oy
+        u = (px * self.dx + py * self.dy) / (self.dx * self.dx + self.dy * self.dy)
+        v = (px * self.nx + py * self.ny) / (self.nx * self.nx + self.ny * self.ny)
+        ix = int(math.floor(u * self.width))
+        iy = int(math.floor(v * self.height))
+        if self.tile:
+            ix = ix % self.width
+            if ix < 0:
+                ix += self.width
+            iy = iy % self.height
+            if iy < 0:
+                iy += self.height
+        elif ix < 0 or iy < 0 or ix >= self.width or iy >= self.height:
+            return r_uint(0)
+        word = r_uint(self.w_bits.getword(iy * self.pitch + ix / self.pix_per_word))
+        pixel_index = ix % self.pix_per_word
+        if self.msb:
+            shift = 32 - (pixel_index + 1) * self.depth
+        else:
+            shift = pixel_index * self.depth
+        value = (word >> shift) & BitBltShadow.MaskTable[self.depth]
+        if self.w_cmap is not None:
+            value = r_uint(self.w_cmap.getword(intmask(value) % self.w_cmap.size()))
+        elif self.depth == 16:
+            if value != 0:
+                value = rgb_map(value, 5, 8)
+        if value != 0 and value & FILL_COLOR_MASK == 0:
+            value |= FILL_COLOR_MASK
+        return transform_color(self.color_transform, value)
+
+
+class Layer(object):
+    """The line segments bounding the area of one fill, as flat x0, y0, x1,
+    y1 quadruples. Edges toggle the fill (even-odd), strokes are the union of
+    their quads (non-zero winding)."""
+    def __init__(self, fill, fill_value, z, nonzero, edges):
+        self.fill = fill
+        self.fill_value = fill_value
+        self.z = z
+        self.nonzero = nonzero
+        self.edges = edges
+        self.segments = []
+        self.left = 0.0
+        self.top = 0.0
+        self.right = 0.0
+        self.bottom = 0.0
+
+    def add_segment(self, x0, y0, x1, y1):
+        if not self.segments:
+            self.left = min(x0, x1)
+            self.top = min(y0, y1)
+            self.right = max(x0, x1)
+            self.bottom = max(y0, y1)
+        else:
+            self.left = min(self.left, min(x0, x1))
+            self.top = min(self.top, min(y0, y1))
+            self.right = max(self.right, max(x0, x1))
+            self.bottom = max(self.bottom, max(y0, y1))
+        self.segments.append(x0)
+        self.segments.append(y0)
+        self.segments.append(x1)
+        self.segments.append(y1)
+
+    def add_bezier(self, x0, y0, x1, y1, x2, y2):
+        """Flatten the quadratic bezier from x0@y0 via x1@y1 to x2@y2."""
+        deviation = abs(x0 - 2 * x1 + x2) + abs(y0 - 2 * y1 + y2)
+        steps = int(math.sqrt(deviation)) + 1
+        if steps > MAX_FLATTEN_STEPS:
+            steps = MAX_FLATTEN_STEPS
+        last_x = x0
+        last_y = y0
+        for i in range(1, steps + 1):
+            t = float(i) / steps
+            u = 1.0 - t
+            x = u * u * x0 + 2 * u * t * x1 + t * t * x2
+            y = u * u * y0 + 2 * u * t * y1 + t * t * y2
+            self.add_segment(last_x, last_y, x, y)
+            last_x = x
+            last_y = y
+
+    def add_stroke(self, x0, y0, x1, y1, width):
+        """A quad of the given width along the segment, extended by half the
+        width at both ends so that consecutive strokes join."""
+        dx = x1 - x0
+        dy = y1 - y0
+        length = math.sqrt(dx * dx + dy * dy)
+        if length == 0.0 or width <= 0.0:
+            return
+        ex = dx / length * width / 2
+        ey = dy / length * width / 2
+        ax = x0 - ex
+        ay = y0 - ey
+        bx = x1 + ex
+        by = y1 + ey
+        self.add_segment(ax - ey, ay + ex, bx - ey, by + ex)
+        self.add_segment(bx - ey, by + ex, bx + ey, by - ex)
+        self.add_segment(bx + ey, by - ex, ax + ey, ay - ex)
+        self.add_segment(ax + ey, ay - ex, ax - ey, ay + ex)
+
+    def add_bezier_stroke(self, x0, y0, x1, y1, x2, y2, width):
+        path = Layer(self.fill, self.fill_value, self.z, False, False)
+        path.add_bezier(x0, y0, x1, y1, x2, y2)
+        for i in range(0, len(path.segments), 4):
+            self.add_stroke(path.segments[i], path.segments[i + 1],
+                            path.segments[i + 2], path.segments[i + 3], width)
+
+    def crossings(self, y, xs, windings):
+        """Collect the sorted x positions where the segments cross the
+        horizontal line at y, with their winding direction."""
+        del xs[:]
+        del windings[:]
+        segments = self.segments
+        for i in range(0, len(segments), 4):
+            y0 = segments[i + 1]
+            y1 = segments[i + 3]
+            if y0 == y1:
+                continue
+            if y0 < y1:
+                if y < y0 or y >= y1:
+                    continue
+                winding = 1
+            else:
+                if y < y1 or y >= y0:
+                    continue
+                winding = -1
+            x0 = segments[i]
+            x = x0 + (y - y0) * (segments[i + 2] - x0) / (y1 - y0)
+            j = len(xs)
+            xs.append(x)
+            windings.append(winding)
+            while j > 0 and xs[j - 1] > x:
+                xs[j] = xs[j - 1]
+                windings[j] = windings[j - 1]
+                j -= 1
+            xs[j] = x
+            windings[j] = winding
+
+
+def transform_color(transform, pixel):
+    """Apply a color transform of per channel scale and offset pairs."""
+    if transform is None or pixel == 0:
+        return pixel
+    result = r_uint(0)
+    for channel in range(4):
+        shift = 16 - 8 * channel
+        if channel == 3:
+            shift = 24
+        value = float(intmask((pixel >> shift) & 0xFF))
+        value = value * transform[2 * channel] + transform[2 * channel + 1]
+        component = int(value)
+        if component < 0:
+            component = 0
+        elif component > 255:
+            component = 255
+        result |= r_uint(component) << shift
+    return result
+
+
+def scale_pixel(pixel, coverage, samples):
+    if coverage == samples:
+        return pixel
+    result = r_uint(0)
+    for shift in range(0, 32, 8):
+        component = intmask((pixel >> shift) & 0xFF) * coverage / samples
+        result |= r_uint(component) << shift
+    return result
+
+
+def alpha_blend_scaled(source, dest):
+    """Blend a premultiplied source pixel over the destination, like BitBlt
+    rule 34."""
+    un_alpha = intmask(255 - (source >> 24))
+    result = r_uint(0)
+    for shift in range(0, 32, 8):
+        component = ((intmask((dest >> shift) & 0xFF) * un_alpha) >> 8) + intmask((source >> shift) & 0xFF)
+        if component > 255:
+            component = 255
+        result |= r_uint(component) << shift
+    return result
+
+
+class EngineState(object):
+    def __init__(self, w_buffer):
+        # the buffer carrying the handle, the state is dropped with it
+        self.buffer_ref = weakref.ref(w_buffer)
+        self.reset()
+
+    def reset(self):
+        self.clip_set = False
+        self.clip_left = 0
+        self.clip_top = 0
+        self.clip_right = 0
+        self.clip_bottom = 0
+        self.offset_x = 0
+        self.offset_y = 0
+        self.edge_transform = None
+        self.color_transform = None
+        self.aa_level = 1
+        self.depth = 0
+        self.needs_flush = False
+        self.fills = []
+        self.layers = []
+
+    def finished(self):
+        return not self.layers
+
+    def transform_point(self, x, y):
+        t = self.edge_transform
+        if t is not None:
+            tx = t[0] * x + t[1] * y + t[2]
+            y = t[3] * x + t[4] * y + t[5]
+            x = tx
+        return x + self.offset_x, y + self.offset_y
+
+    def transform_vector(self, x, y):
+        t = self.edge_transform
+        if t is not None:
+            tx = t[0] * x + t[1] * y
+            y = t[3] * x + t[4] * y
+            x = tx
+        return x, y
+
+    def transform_width(self, width):
+        t = self.edge_transform
+        if t is not None:
+            return width * math.sqrt(abs(t[0] * t[4] - t[1] * t[3]))
+        return width
+
+    def fill_for(self, value):
+        if value & FILL_COLOR_MASK != 0:
+            return SolidFill(transform_color(self.color_transform, value))
+        handle = intmask(value)
+        if handle < 1 or handle > len(self.fills):
+            raise PrimitiveFailedError("Invalid fill %d" % handle)
+        return self.fills[handle - 1]
+
+    def new_layer(self, value, nonzero, edges=False):
+        """A new layer for the fill value, on top of all layers at the
+        current depth; None for the empty fill."""
+        if value == 0:
+            return None
+        layer = Layer(self.fill_for(value), value, self.depth, nonzero, edges)
+        i = len(self.layers)
+        while i > 0 and self.layers[i - 1].z > layer.z:
+            i -= 1
+        self.layers.insert(i, layer)
+        return layer
+
+    def edge_layer(self, value):
+        """The layer collecting loose edges of the fill at the current
+        depth."""
+        for layer in self.layers:
+            if layer.edges and layer.fill_value == value and layer.z == self.depth:
+                return layer
+        return self.new_layer(value, False, edges=True)
+
+    def add_fill(self, fill):
+        self.fills.append(fill)
+        return len(self.fills)
+
+    def render(self, space, s_form):
+        """Render all layers into the 32 bit form and answer the bounds of
+        the changed area as left, top, right, bottom."""
+        left = 0
+        top = 0
+        right = s_form.width
+        bottom = s_form.height
+        if self.clip_set:
+            left = max(left, self.clip_left)
+            top = max(top, self.clip_top)
+            right = min(right, self.clip_right)
+            bottom = min(bottom, self.clip_bottom)
+        damage = [right, bottom, left, top]
+        for layer in self.layers:
+            self.render_layer(layer, s_form, left, top, right, bottom, damage)
+        self.layers = []
+        return damage[0], damage[1], damage[2], damage[3]
+
+    def render_layer(self, layer, s_form, clip_left, clip_top, clip_right, clip_bottom, damage):
+        if not layer.segments:
+            return
+        left = max(clip_left, int(math.floor(layer.left)))
+        top = max(clip_top, int(math.floor(layer.top)))
+        right = min(clip_right, int(math.ceil(layer.right)))
+        bottom = min(clip_bottom, int(math.ceil(layer.bottom)))
+        if left >= right or top >= bottom:
+            return
+        n = self.aa_level
+        samples = n * n
+        width = right - left
+        coverage = [0] * width
+        xs = []
+        windings = []
+        w_bits = s_form.w_bits
+        for y in range(top, bottom):
+            for i in range(width):
+                coverage[i] = 0
+            covered = False
+            for sub in range(n):
+                layer.crossings(y + (sub + 0.5) / n, xs, windings)
+                winding = 0
+                for i in range(len(xs) - 1):
+                    winding += windings[i]
+                    if layer.nonzero:
+                        inside = winding != 0
+                    else:
+                        inside = winding & 1 != 0
+                    if inside and add_span(coverage, left, right, xs[i], xs[i + 1], n):
+                        covered = True
+            if not covered:
+                continue
+            row = y * s_form.pitch
+            for i in range(width):
+                if coverage[i] == 0:
+                    continue
+                x = left + i
+                pixel = layer.fill.pixel_at(x + 0.5, y + 0.5)
+                if pixel == 0:
+                    continue
+                pixel = scale_pixel(pixel, coverage[i], samples)
+                index = row + x
+                w_bits.setword(index, alpha_blend_scaled(pixel, r_uint(w_bits.getword(index))))
+            damage[0] = min(damage[0], left)
+            damage[1] = min(damage[1], y)
+            damage[2] = max(damage[2], right)
+            damage[3] = max(damage[3], y + 1)
+
+
+def add_span(coverage, left, right, x0, x1, n):
+    """Count the sample columns with centers in [x0, x1) into the coverage
+    of their pixels."""
+    first = int(math.ceil(x0 * n - 0.5))
+    last = int(math.ceil(x1 * n - 0.5))
+    first = max(first, left * n)
+    last = min(last, right * n)
+    if first >= last:
+        return False
+    sample = first
+    while sample < last:
+        pixel = sample / n
+        stop = min(last, (pixel + 1) * n)
+        coverage[pixel - left] += stop - sample
+        sample = stop
+    return True
+
+
+class EngineRegistry(object):
+    """The EngineStates of the work buffers by handle. Handles are only valid
+    in the session they were registered in: work buffers saved in an image
+    come back with the handles of the session that saved it."""
+
+    def __init__(self):
+        self.states = {}
+        self.next_handle = 1
+        # set when first used, the registry is created at translation time
+        self.session = r_uint(0)
+
+    def session_id(self):
+        if self.session == 0:
+            seed = r_uint(int(time.time() * 1000000)) ^ (r_uint(os.getpid()) << 16)
+            self.session = seed | r_uint(1)
+        return self.session
+
+    def lookup(self, w_buffer):
+        if (w_buffer.getword(0) != WB_MAGIC or
+                w_buffer.getword(WB_SESSION) != self.session_id()):
+            return None
+        return self.states.get(intmask(w_buffer.getword(WB_HANDLE)), None)
+
+    def register(self, w_buffer):
+        self.drop_unused()
+        state = EngineState(w_buffer)
+        handle = self.next_handle
+        self.next_handle += 1
+        self.states[handle] = state
+        w_buffer.setword(0, WB_MAGIC)
+        w_buffer.setword(WB_HANDLE, r_uint(handle))
+        w_buffer.setword(WB_SESSION, self.session_id())
+        return state
+
+    def drop_unused(self):
+        for handle in self.states.keys():
+            if self.states[handle].buffer_ref() is None:
+                del self.states[handle]
+
+engines = EngineRegistry()
+
+
+def buffer_state(w_buffer):
+    if not isinstance(w_buffer, model.W_WordsObject) or w_buffer.size() < WB_HEADER_SIZE:
+        raise PrimitiveFailedError("Invalid work buffer")
+    state = engines.lookup(w_buffer)
+    if state is None:
+        raise PrimitiveFailedError("Work buffer not initialized")
+    return state
+
+def engine_state(space, w_engine):
+    if not isinstance(w_engine, model.W_PointersObject) or w_engine.size() < BE_SIZE:
+        raise PrimitiveFailedError("Not a BalloonEngine")
+    return buffer_state(w_engine.fetch(space, BE_WORKBUFFER))
+
+def load_coordinate(space, w_value):
+    if isinstance(w_value, model.W_Float):
+        return w_value.value
+    return float(space.unwrap_int(w_value))
+
+def load_point(space, w_point):
+    if not isinstance(w_point, model.W_PointersObject) or w_point.size() < 2:
+        raise PrimitiveFailedError("Not a point")
+    return (load_coordinate(space, w_point.fetch(space, 0)),
+            load_coordinate(space, w_point.fetch(space, 1)))
+
+def short_value(value):
+    value = intmask(value & 0xFFFF)
+    if value >= 0x8000:
+        value -= 0x10000
+    return value
+
+def load_points(space, w_points, count):
+    """The coordinates of a PointArray, ShortPointArray or Array of Points as
+    flat x, y pairs."""
+    result = [0.0] * (2 * count)
+    if isinstance(w_points, model.W_WordsObject):
+        if w_points.size() == 2 * count:
+            for i in range(2 * count):
+                result[i] = float(intmask(w_points.getword(i)))
+        elif w_points.size() == count:
+            for i in range(count):
+                word = w_points.getword(i)
+                result[2 * i] = float(short_value(word))
+                result[2 * i + 1] = float(short_value(word >> 16))
+        else:
+            raise PrimitiveFailedError("Wrong number of points")
+    elif isinstance(w_points, model.W_PointersObject) and w_points.size() == count:
+        for i in range(count):
+            x, y = load_point(space, w_points.fetch(space, i))
+            result[2 * i] = x
+            result[2 * i + 1] = y
+    else:
+        raise PrimitiveFailedError("Not a point array")
+    return result
+
+def load_runs(w_runs, count):
+    """Expand a ShortRunArray of run length and value pairs."""
+    if not isinstance(w_runs, model.W_WordsObject):
+        raise PrimitiveFailedError("Not a ShortRunArray")
+    result = [0] * count
+    i = 0
+    for run in range(w_runs.size()):
+        word = w_runs.getword(run)
+        value = short_value(word)
+        for j in range(intmask(word >> 16)):
+            if i >= count:
+                return result
+            result[i] = value
+            i += 1
+    if i < count:
+        raise PrimitiveFailedError("Not enough runs")
+    return result
+
+def load_float_array(w_array, size):
+    if not isinstance(w_array, model.W_WordsObject) or w_array.size() != size:
+        raise PrimitiveFailedError("Wrong transform size")
+    return [word_to_float(w_array.getword(i)) for i in range(size)]
+
+def fill_value(space, w_fill):
+    return space.unwrap_positive_32bit_int(w_fill)
+
+def transformed_points(state, points):
+    for i in range(0, len(points), 2):
+        x, y = state.transform_point(points[i], points[i + 1])
+        points[i] = x
+        points[i + 1] = y
+    return points
+
+def add_polygon(state, points, fill, width, line_fill):
+    count = len(points) / 2
+    layer = state.new_layer(fill, False)
+    if layer is not None:
+        for i in range(count):
+            j = (i + 1) % count
+            layer.add_segment(points[2 * i], points[2 * i + 1], points[2 * j], points[2 * j + 1])
+    if width > 0.0:
+        layer = state.new_layer(line_fill, True)
+        if layer is not None:
+            for i in range(count):
+                j = (i + 1) % count
+                layer.add_stroke(points[2 * i], points[2 * i + 1],
+                                 points[2 * j], points[2 * j + 1], width)
+
+# ___________________________________________________________________________
+# Engine state
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveInitializeBuffer(interp, s_frame, w_rcvr, w_buffer):
+    if not isinstance(w_buffer, model.W_WordsObject) or w_buffer.size() < WB_HEADER_SIZE:
+        raise PrimitiveFailedError("Work buffer too small")
+    state = engines.lookup(w_buffer)
+    if state is None:
+        engines.register(w_buffer)
+    else:
+        state.reset()
+        state.buffer_ref = weakref.ref(w_buffer)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveCopyBuffer(interp, s_frame, w_rcvr, w_old, w_new):
+    state = buffer_state(w_old)
+    if not isinstance(w_new, model.W_WordsObject) or w_new.size() < w_old.size():
+        raise PrimitiveFailedError("Work buffer too small")
+    for i in range(WB_HEADER_SIZE):
+        w_new.setword(i, w_old.getword(i))
+    # the image grows the work buffer and continues with the copy
+    state.buffer_ref = weakref.ref(w_new)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitiveSetAALevel(interp, s_frame, w_rcvr, level):
+    state = engine_state(interp.space, w_rcvr)
+    if level >= 4:
+        state.aa_level = 4
+    elif level >= 2:
+        state.aa_level = 2
+    else:
+        state.aa_level = 1
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveGetAALevel(interp, s_frame, w_rcvr):
+    return interp.space.wrap_int(engine_state(interp.space, w_rcvr).aa_level)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSetClipRect(interp, s_frame, w_rcvr, w_rect):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if not isinstance(w_rect, model.W_PointersObject) or w_rect.size() < 2:
+        raise PrimitiveFailedError("Not a rectangle")
+    left, top = load_point(space, w_rect.fetch(space, 0))
+    right, bottom = load_point(space, w_rect.fetch(space, 1))
+    state.clip_set = True
+    state.clip_left = int(left)
+    state.clip_top = int(top)
+    state.clip_right = int(right)
+    state.clip_bottom = int(bottom)
+    return w_rcvr
+
+def make_point(space, x, y):
+    w_point = space.w_Point.as_class_get_shadow(space).new(2)
+    point = wrapper.PointWrapper(space, w_point)
+    point.store_x(x)
+    point.store_y(y)
+    return w_point
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveGetClipRect(interp, s_frame, w_rcvr, w_rect):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if not isinstance(w_rect, model.W_PointersObject) or w_rect.size() < 2:
+        raise PrimitiveFailedError("Not a rectangle")
+    w_rect.store(space, 0, make_point(space, state.clip_left, state.clip_top))
+    w_rect.store(space, 1, make_point(space, state.clip_right, state.clip_bottom))
+    return w_rect
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSetOffset(interp, s_frame, w_rcvr, w_point):
+    state = engine_state(interp.space, w_rcvr)
+    x, y = load_point(interp.space, w_point)
+    state.offset_x = int(x)
+    state.offset_y = int(y)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveGetOffset(interp, s_frame, w_rcvr):
+    state = engine_state(interp.space, w_rcvr)
+    return make_point(interp.space, state.offset_x, state.offset_y)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitiveSetDepth(interp, s_frame, w_rcvr, depth):
+    engine_state(interp.space, w_rcvr).depth = depth
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveGetDepth(interp, s_frame, w_rcvr):
+    return interp.space.wrap_int(engine_state(interp.space, w_rcvr).depth)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSetEdgeTransform(interp, s_frame, w_rcvr, w_transform):
+    state = engine_state(interp.space, w_rcvr)
+    if w_transform is interp.space.w_nil:
+        state.edge_transform = None
+    else:
+        state.edge_transform = load_float_array(w_transform, 6)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveSetColorTransform(interp, s_frame, w_rcvr, w_transform):
+    state = engine_state(interp.space, w_rcvr)
+    if w_transform is interp.space.w_nil:
+        state.color_transform = None
+    else:
+        state.color_transform = load_float_array(w_transform, 8)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveNeedsFlush(interp, s_frame, w_rcvr):
+    return interp.space.wrap_bool(engine_state(interp.space, w_rcvr).needs_flush)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, bool])
+def primitiveNeedsFlushPut(interp, s_frame, w_rcvr, needs_flush):
+    engine_state(interp.space, w_rcvr).needs_flush = needs_flush
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveGetFailureReason(interp, s_frame, w_rcvr):
+    engine_state(interp.space, w_rcvr)
+    return interp.space.wrap_int(0)
+
+for name in ["primitiveGetTimes", "primitiveGetCounts", "primitiveGetBezierStats"]:
+    def make_func():
+        def func(interp, s_frame, w_rcvr, w_stats):
+            """There are no statistics, the array is zeroed."""
+            space = interp.space
+            engine_state(space, w_rcvr)
+            if isinstance(w_stats, model.W_WordsObject):
+                for i in range(w_stats.size()):
+                    w_stats.setword(i, r_uint(0))
+            elif isinstance(w_stats, model.W_PointersObject):
+                for i in range(w_stats.size()):
+                    w_stats.store(space, i, space.wrap_int(0))
+            else:
+                raise PrimitiveFailedError("Not a statistics array")
+            return w_rcvr
+        return func
+    func = make_func()
+    func.func_name = name
+    B2DPlugin.expose_primitive(unwrap_spec=[object, object])(func)
+
+# ___________________________________________________________________________
+# Shapes
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, object, int, object])
+def primitiveAddRect(interp, s_frame, w_rcvr, w_start, w_end, w_fill, border_width, w_border_fill):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    left, top = load_point(space, w_start)
+    right, bottom = load_point(space, w_end)
+    points = transformed_points(state, [left, top, right, top, right, bottom, left, bottom])
+    add_polygon(state, points, fill_value(space, w_fill),
+                state.transform_width(float(border_width)), fill_value(space, w_border_fill))
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, object, int, object])
+def primitiveAddOval(interp, s_frame, w_rcvr, w_start, w_end, w_fill, border_width, w_border_fill):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    left, top = load_point(space, w_start)
+    right, bottom = load_point(space, w_end)
+    cx = (left + right) / 2
+    cy = (top + bottom) / 2
+    rx = (right - left) / 2
+    ry = (bottom - top) / 2
+    steps = int(state.transform_width(abs(rx) + abs(ry))) + 16
+    if steps > 256:
+        steps = 256
+    points = [0.0] * (2 * steps)
+    for i in range(steps):
+        angle = 2 * math.pi * i / steps
+        points[2 * i] = cx + rx * math.cos(angle)
+        points[2 * i + 1] = cy + ry * math.sin(angle)
+    add_polygon(state, transformed_points(state, points), fill_value(space, w_fill),
+                state.transform_width(float(border_width)), fill_value(space, w_border_fill))
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, int, object, int, object])
+def primitiveAddPolygon(interp, s_frame, w_rcvr, w_points, npoints, w_fill, line_width, w_line_fill):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if npoints < 1:
+        raise PrimitiveFailedError("Empty polygon")
+    points = transformed_points(state, load_points(space, w_points, npoints))
+    add_polygon(state, points, fill_value(space, w_fill),
+                state.transform_width(float(line_width)), fill_value(space, w_line_fill))
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, int, object, int, object])
+def primitiveAddBezierShape(interp, s_frame, w_rcvr, w_points, nsegments, w_fill, line_width, w_line_fill):
+    """A closed shape of quadratic bezier segments, each given by its start,
+    control and end point."""
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    p = transformed_points(state, load_points(space, w_points, 3 * nsegments))
+    layer = state.new_layer(fill_value(space, w_fill), False)
+    if layer is not None:
+        for i in range(0, 6 * nsegments, 6):
+            layer.add_bezier(p[i], p[i + 1], p[i + 2], p[i + 3], p[i + 4], p[i + 5])
+    width = state.transform_width(float(line_width))
+    if width > 0.0:
+        layer = state.new_layer(fill_value(space, w_line_fill), True)
+        if layer is not None:
+            for i in range(0, 6 * nsegments, 6):
+                layer.add_bezier_stroke(p[i], p[i + 1], p[i + 2], p[i + 3], p[i + 4], p[i + 5], width)
+    return w_rcvr
+
+def fill_list_value(w_fill_list, index):
+    """The fill of a one-based index into the fill list, 0 means no fill."""
+    if index == 0:
+        return r_uint(0)
+    if index < 0 or index > w_fill_list.size():
+        raise PrimitiveFailedError("Fill index out of range")
+    return r_uint(w_fill_list.getword(index - 1))
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, int, object, object, object, object, object])
+def primitiveAddCompressedShape(interp, s_frame, w_rcvr, w_points, nsegments, w_left_fills,
+                                w_right_fills, w_line_widths, w_line_fills, w_fill_list):
+    """A shape of bezier segments with the fills to their left and right and
+    their line width and fill as ShortRunArrays, the fills being indices into
+    the fill list."""
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if not isinstance(w_fill_list, model.W_WordsObject):
+        raise PrimitiveFailedError("Not a fill list")
+    p = transformed_points(state, load_points(space, w_points, 3 * nsegments))
+    left_fills = load_runs(w_left_fills, nsegments)
+    right_fills = load_runs(w_right_fills, nsegments)
+    line_widths = load_runs(w_line_widths, nsegments)
+    line_fills = load_runs(w_line_fills, nsegments)
+    fill_count = w_fill_list.size()
+    layers = [None] * fill_count
+    for i in range(nsegments):
+        left = left_fills[i]
+        right = right_fills[i]
+        if left == right:
+            continue
+        for index in [left, right]:
+            value = fill_list_value(w_fill_list, index)
+            if value == 0:
+                continue
+            layer = layers[index - 1]
+            if layer is None:
+                layer = state.new_layer(value, False)
+                layers[index - 1] = layer
+            j = 6 * i
+            layer.add_bezier(p[j], p[j + 1], p[j + 2], p[j + 3], p[j + 4], p[j + 5])
+    stroke_layers = [None] * fill_count
+    for i in range(nsegments):
+        index = line_fills[i]
+        value = fill_list_value(w_fill_list, index)
+        width = state.transform_width(float(line_widths[i]))
+        if value == 0 or width <= 0.0:
+            continue
+        layer = stroke_layers[index - 1]
+        if layer is None:
+            layer = state.new_layer(value, True)
+            stroke_layers[index - 1] = layer
+        j = 6 * i
+        layer.add_bezier_stroke(p[j], p[j + 1], p[j + 2], p[j + 3], p[j + 4], p[j + 5], width)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, object, object])
+def primitiveAddLine(interp, s_frame, w_rcvr, w_start, w_end, w_left_fill, w_right_fill):
+    """A loose edge between two fills, closed shapes are built from several
+    of them."""
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    x0, y0 = load_point(space, w_start)
+    x1, y1 = load_point(space, w_end)
+    x0, y0 = state.transform_point(x0, y0)
+    x1, y1 = state.transform_point(x1, y1)
+    left = fill_value(space, w_left_fill)
+    right = fill_value(space, w_right_fill)
+    if left != right:
+        for value in [left, right]:
+            if value != 0:
+                state.edge_layer(value).add_segment(x0, y0, x1, y1)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, object, object, object])
+def primitiveAddBezier(interp, s_frame, w_rcvr, w_start, w_end, w_via, w_left_fill, w_right_fill):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    x0, y0 = load_point(space, w_start)
+    x1, y1 = load_point(space, w_via)
+    x2, y2 = load_point(space, w_end)
+    x0, y0 = state.transform_point(x0, y0)
+    x1, y1 = state.transform_point(x1, y1)
+    x2, y2 = state.transform_point(x2, y2)
+    left = fill_value(space, w_left_fill)
+    right = fill_value(space, w_right_fill)
+    if left != right:
+        for value in [left, right]:
+            if value != 0:
+                state.edge_layer(value).add_bezier(x0, y0, x1, y1, x2, y2)
+    return w_rcvr
+
+# ___________________________________________________________________________
+# Fills
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, object, object, bool])
+def primitiveAddGradientFill(interp, s_frame, w_rcvr, w_ramp, w_origin, w_direction, w_normal, radial):
+    """Answer the fill of a color ramp (premultiplied 32 bit pixels)."""
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if not isinstance(w_ramp, model.W_WordsObject) or w_ramp.size() == 0:
+        raise PrimitiveFailedError("Not a color ramp")
+    ramp = [transform_color(state.color_transform, r_uint(w_ramp.getword(i)))
+            for i in range(w_ramp.size())]
+    ox, oy = load_point(space, w_origin)
+    ox, oy = state.transform_point(ox, oy)
+    dx, dy = load_point(space, w_direction)
+    dx, dy = state.transform_vector(dx, dy)
+    nx, ny = load_point(space, w_normal)
+    nx, ny = state.transform_vector(nx, ny)
+    if dx == 0.0 and dy == 0.0 or radial and nx == 0.0 and ny == 0.0:
+        raise PrimitiveFailedError("Degenerate gradient")
+    return space.wrap_int(state.add_fill(GradientFill(ramp, ox, oy, dx, dy, nx, ny, radial)))
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object, bool, object, object, object, int])
+def primitiveAddBitmapFill(interp, s_frame, w_rcvr, w_form, w_cmap, tile, w_origin,
+                           w_direction, w_normal, x_index):
+    """Answer the fill of a form, forms of less than 16 bits need a
+    colormap."""
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if not isinstance(w_form, model.W_PointersObject):
+        raise PrimitiveFailedError("Not a form")
+    s_form = w_form.as_special_get_shadow(space, FormShadow)
+    if s_form.invalid or s_form.width == 0 or s_form.height == 0:
+        raise PrimitiveFailedError("Invalid form")
+    if w_cmap is space.w_nil:
+        w_cmap = None
+        if s_form.depth < 16:
+            raise PrimitiveFailedError("Missing colormap")
+    elif not isinstance(w_cmap, model.W_WordsObject) or w_cmap.size() == 0:
+        raise PrimitiveFailedError("Not a colormap")
+    ox, oy = load_point(space, w_origin)
+    ox, oy = state.transform_point(ox, oy)
+    dx, dy = load_point(space, w_direction)
+    dx, dy = state.transform_vector(dx, dy)
+    nx, ny = load_point(space, w_normal)
+    nx, ny = state.transform_vector(nx, ny)
+    if dx == 0.0 and dy == 0.0 or nx == 0.0 and ny == 0.0:
+        raise PrimitiveFailedError("Degenerate bitmap fill")
+    return space.wrap_int(state.add_fill(BitmapFill(s_form, w_cmap, tile, ox, oy, dx, dy,
+                                                    nx, ny, state.color_transform)))
+
+# ___________________________________________________________________________
+# Rendering
+
+def render(interp, w_rcvr):
+    space = interp.space
+    state = engine_state(space, w_rcvr)
+    if state.finished():
+        return
+    w_bitblt = w_rcvr.fetch(space, BE_BITBLT)
+    if not isinstance(w_bitblt, model.W_PointersObject) or w_bitblt.size() < 1:
+        raise PrimitiveFailedError("Missing BitBlt")
+    w_dest_form = w_bitblt.fetch(space, 0)
+    if not isinstance(w_dest_form, model.W_PointersObject):
+        raise PrimitiveFailedError("Missing destination form")
+    s_form = w_dest_form.as_special_get_shadow(space, FormShadow)
+    if s_form.invalid or s_form.depth != 32:
+        raise PrimitiveFailedError("Only 32 bit destination forms are supported")
+    left, top, right, bottom = state.render(space, s_form)
+    w_bits = s_form.w_bits
+    if isinstance(w_bits, model.W_DisplayBitmap) and left < right:
+        w_bits.invalidate(left, top, right, bottom)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveInitializeProcessing(interp, s_frame, w_rcvr):
+    engine_state(interp.space, w_rcvr)
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveFinishedProcessing(interp, s_frame, w_rcvr):
+    return interp.space.wrap_bool(engine_state(interp.space, w_rcvr).finished())
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveAbortProcessing(interp, s_frame, w_rcvr):
+    engine_state(interp.space, w_rcvr).layers = []
+    return w_rcvr
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveRenderImage(interp, s_frame, w_rcvr, w_edge, w_fill):
+    """Render everything and answer 0, as there never are external edges or
+    fills to stop for."""
+    render(interp, w_rcvr)
+    return interp.space.wrap_int(0)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveRenderScanline(interp, s_frame, w_rcvr, w_edge, w_fill):
+    render(interp, w_rcvr)
+    return interp.space.wrap_int(0)
+
+@B2DPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveDisplaySpanBuffer(interp, s_frame, w_rcvr):
+    render(interp, w_rcvr)
+    return w_rcvr
+
+for name in ["primitiveNextGlobalEdgeEntry", "primitiveNextActiveEdgeEntry",
+             "primitiveNextFillEntry"]:
+    def make_func():
+        def func(interp, s_frame, w_rcvr, w_entry):
+            """Without external edges and fills there is nothing to answer,
+            the image's copy loop is told it has finished."""
+            engine_state(interp.space, w_rcvr)
+            return interp.space.w_true
+        return func
+    func = make_func()
+    func.func_name = name
+    B2DPlugin.expose_primitive(unwrap_spec=[object, object])(func)
@@ -31,9 +31,38 @@ def primitiveCopyBits(interp, s_frame, w_rcvr):
         s_frame.pop() # pops the next value under BitBlt
         s_frame.push(interp.space.wrap_int(s_bitblt.bitCount))
     elif w_dest_form.is_same_object(space.objtable['w_display']):
+        # the screen is updated at the next interrupt check
         w_bitmap = w_dest_form.fetch(space, 0)
         assert isinstance(w_bitmap, model.W_DisplayBitmap)
-        w_bitmap.flush_to_screen()
+        w_bitmap.invalidate(s_bitblt.dx, s_bitblt.dy,
+                            s_bitblt.dx + s_bitblt.bbW, s_bitblt.dy + s_bitblt.bbH)
+    return w_rcvr
+
+
+@BitBltPlugin.expose_primitive(unwrap_spec=[object, int, object], clean_stack=True)
+def primitiveWarpBits(interp, s_frame, w_rcvr, smoothing, w_source_map):
+    """WarpBlt>>warpBitsSmoothing:sourceMap:, copies the quadrilateral p1..p4
+    of the source form (in 14 bit fixed point) into the destination
+    rectangle. With smoothing n > 1 every destination pixel is the average of
+    n*n source pixels, mapped to 32 bit RGB by the sourceMap."""
+    if not isinstance(w_rcvr, model.W_PointersObject) or w_rcvr.size() < WARP_BASE + 12:
+        raise PrimitiveFailedError("WarpBlt primitive not called in WarpBlt object!")
+    space = interp.space
+    combinationRule = space.unwrap_positive_32bit_int(w_rcvr.fetch(space, 3))
+    if combinationRule > 41:
+        raise PrimitiveFailedError("Missing combinationRule %d" % combinationRule)
+    if smoothing < 1:
+        raise PrimitiveFailedError("Invalid smoothing %d" % smoothing)
+    s_bitblt = w_rcvr.as_special_get_shadow(space, BitBltShadow)
+    s_bitblt.loadBitBlt()
+    s_bitblt.warpBits(smoothing, w_source_map)
+
+    w_dest_form = w_rcvr.fetch(space, 0)
+    if w_dest_form.is_same_object(space.objtable['w_display']) and s_bitblt.source:
+        w_bitmap = w_dest_form.fetch(space, 0)
+        assert isinstance(w_bitmap, model.W_DisplayBitmap)
+        w_bitmap.invalidate(s_bitblt.dx, s_bitblt.dy,
+                            s_bitblt.dx + s_bitblt.bbW, s_bitblt.dy + s_bitblt.bbH)
     return w_rcvr
 
 
@@ -46,6 +75,62 @@ def intOrIfNil(space, w_int, i):
         return space.unwrap_int(w_int)
 
 
+def copy_words(w_source, source_index, w_dest, dest_index, count):
+    if (isinstance(w_source, model.W_WordsObject) and w_source.words is not None and
+            isinstance(w_dest, model.W_WordsObject) and w_dest.words is not None):
+        # the slice is copied first, so overlapping rows are fine
+        w_dest.words[dest_index:dest_index + count] = w_source.words[source_index:source_index + count]
+    else:
+        for i in range(count):
+            w_dest.setword(dest_index + i, w_source.getword(source_index + i))
+
+def fill_words(w_dest, dest_index, count, word):
+    if isinstance(w_dest, model.W_WordsObject) and w_dest.words is not None:
+        words = w_dest.words
+        for i in range(dest_index, dest_index + count):
+            words[i] = word
+    else:
+        for i in range(count):
+            w_dest.setword(dest_index + i, word)
+
+
+# WarpBlt adds the source quadrilateral p1 (x, y, z) ... p4 to BitBlt
+WARP_BASE = 15
+FIXED_PT1 = 1 << 14 # the points are 14 bit fixed point numbers
+BINARY_POINT = 14
+
+def warp_delta(x1, x2, n_steps):
+    # BitBltSimulation>>deltaFrom:to:nSteps:
+    if x2 > x1:
+        return (x2 - x1 + FIXED_PT1) // (n_steps + 1) + 1
+    elif x2 == x1:
+        return 0
+    return -((x1 - x2 + FIXED_PT1) // (n_steps + 1) + 1)
+
+def rgb_map(pixel, src_bits, dst_bits):
+    """Convert an RGB pixel between src_bits and dst_bits per component,
+    keeping non-transparent pixels from becoming 0."""
+    if src_bits == dst_bits:
+        return pixel
+    src_mask = (1 << src_bits) - 1
+    result = r_uint(0)
+    for i in range(3):
+        component = (pixel >> (i * src_bits)) & src_mask
+        if src_bits > dst_bits:
+            component = component >> (src_bits - dst_bits)
+        else:
+            component = component << (dst_bits - src_bits)
+        result |= component << (i * dst_bits)
+    if result == 0 and pixel != 0:
+        return r_uint(1)
+    return result
+
+def bits_per_color(depth):
+    if depth == 16:
+        return 5
+    return 8
+
+
 class BitBltShadow(AbstractCachingShadow):
     WordSize = 32
     MaskTable = [r_uint(0)]
@@ -123,14 +208,99 @@ class BitBltShadow(AbstractCachingShadow):
             return
         self.destMaskAndPointerInit()
         if not self.source:
-            self.copyLoopNoSource()
+            if self.combinationRule == 0 or self.combinationRule == 3:
+                self.fillLoop()
+            else:
+                self.copyLoopNoSource()
         else:
             self.checkSourceOverlap()
             if self.source.depth != self.dest.depth:
                 self.copyLoopPixMap()
             else:
                 self.sourceSkewAndPointerInit()
-                self.copyLoop()
+                if self.isAligned():
+                    self.copyLoopAlignedForRule()
+                else:
+                    self.copyLoop()
+
+    def isAligned(self):
+        """Whether every destination word takes exactly one source word, so
+        no rotating is needed: same depth (checked by the caller), the same
+        pixel offset within a word, left to right and no halftone."""
+        if self.halftone or self.hDir != 1:
+            return False
+        if self.preload:
+            return self.skew == -32
+        return self.skew == 0
+
+    def copyLoopAlignedForRule(self):
+        # pick the kernel once per blit, not per word
+        rule = self.combinationRule
+        if rule == 3:
+            self.copyLoopAligned(3)
+        elif rule == 0:
+            self.copyLoopAligned(0)
+        elif rule == 34 and self.dest.depth == 32:
+            self.copyLoopAligned(34)
+        elif rule == 24 and self.dest.depth == 32:
+            self.copyLoopAligned(24)
+        else:
+            self.copyLoop()
+
+    @objectmodel.specialize.arg(1)
+    def copyLoopAligned(self, combinationRule):
+        w_source = self.source.w_bits
+        w_dest = self.dest.w_bits
+        sourceIndex = self.sourceIndex
+        destIndex = self.destIndex
+        sourceDelta = self.source.pitch * self.vDir
+        destDelta = self.dest.pitch * self.vDir
+        nWords = self.nWords
+        for i in range(self.bbH):
+            # first and last word in row are masked
+            self.mergeMasked(w_source.getword(sourceIndex), destIndex,
+                             self.mask1, combinationRule)
+            if nWords > 2:
+                if combinationRule == 3:
+                    copy_words(w_source, sourceIndex + 1, w_dest, destIndex + 1, nWords - 2)
+                elif combinationRule == 0:
+                    fill_words(w_dest, destIndex + 1, nWords - 2, r_uint(0))
+                else:
+                    for word in range(1, nWords - 1):
+                        w_dest.setword(destIndex + word, self.merge(
+                            r_uint(w_source.getword(sourceIndex + word)),
+                            r_uint(w_dest.getword(destIndex + word)),
+                            combinationRule))
+            if nWords > 1:
+                self.mergeMasked(w_source.getword(sourceIndex + nWords - 1),
+                                 destIndex + nWords - 1, self.mask2, combinationRule)
+            sourceIndex += sourceDelta
+            destIndex += destDelta
+
+    @objectmodel.specialize.arg(4)
+    def mergeMasked(self, sourceWord, destIndex, destMask, combinationRule):
+        destWord = r_uint(self.dest.w_bits.getword(destIndex))
+        mergeWord = self.merge(r_uint(sourceWord), destWord, combinationRule)
+        self.dest.w_bits.setword(destIndex, (destMask & mergeWord) | (destWord & (~destMask)))
+
+    def fillLoop(self):
+        # rules 0 and 3 without a source store a constant word per row
+        w_dest = self.dest.w_bits
+        destIndex = self.destIndex
+        nWords = self.nWords
+        for i in range(self.bbH):
+            if self.combinationRule == 0:
+                fillWord = r_uint(0)
+            elif self.halftone:
+                fillWord = r_uint(self.halftone[(self.dy + i) % len(self.halftone)])
+            else:
+                fillWord = BitBltShadow.AllOnes
+            self.mergeMasked(fillWord, destIndex, self.mask1, 3)
+            if nWords > 2:
+                fill_words(w_dest, destIndex + 1, nWords - 2, fillWord)
+            if nWords > 1:
+                self.mergeMasked(fillWord, destIndex + nWords - 1, self.mask2, 3)
+            destIndex += self.dest.pitch
 
     def checkSourceOverlap(self):
         if (self.w_sourceForm is self.w_destForm and self.dy >= self.sy):
@@ -512,6 +682,228 @@ class BitBltShadow(AbstractCachingShadow):
             self.sourceIndex += self.sourceDelta
             self.destIndex += self.destDelta
 
+    # _______________________________________________________________________
+    # WarpBlt
+
+    def fetchWarpPoint(self, index):
+        return self.intOrIfNil(self.fetch(WARP_BASE + index), 0)
+
+    def warpBits(self, smoothing, w_source_map):
+        if not self.source:
+            return
+        # only clip against the destination, the source quad may lie anywhere
+        source = self.source
+        self.source = None
+        self.clipRange()
+        self.source = source
+        if self.bbW <= 0 or self.bbH <= 0:
+            return
+        if smoothing > 1:
+            if w_source_map is self.space.w_nil:
+                if self.source.depth < 16:
+                    raise PrimitiveFailedError("Smoothing needs a sourceMap")
+                sourceMap = None
+            elif (not isinstance(w_source_map, model.W_WordsObject) or
+                    w_source_map.size() < (1 << self.source.depth)):
+                raise PrimitiveFailedError("sourceMap too short")
+            else:
+                sourceMap = w_source_map
+        else:
+            sourceMap = None
+        self.destMaskAndPointerInit()
+        self.warpLoop(smoothing, sourceMap)
+
+    @jit.unroll_safe
+    def warpLoop(self, smoothing, sourceMap):
+        # BitBltSimulation>>warpLoop, the rows of the destination walk down the
+        # edges p1-p2 and p4-p3 of the source quad, the pixels of each row
+        # walk from one edge to the other
+        nSteps = max(self.height - 1, 1)
+        pAx = self.fetchWarpPoint(0)
+        pAy = self.fetchWarpPoint(1)
+        pBx = self.fetchWarpPoint(9)
+        pBy = self.fetchWarpPoint(10)
+        p2x = self.fetchWarpPoint(3)
+        p2y = self.fetchWarpPoint(4)
+        p3x = self.fetchWarpPoint(6)
+        p3y = self.fetchWarpPoint(7)
+        deltaP12x = warp_delta(pAx, p2x, nSteps)
+        if deltaP12x < 0:
+            pAx = p2x - nSteps * deltaP12x
+        deltaP12y = warp_delta(pAy, p2y, nSteps)
+        if deltaP12y < 0:
+            pAy = p2y - nSteps * deltaP12y
+        deltaP43x = warp_delta(pBx, p3x, nSteps)
+        if deltaP43x < 0:
+            pBx = p3x - nSteps * deltaP43x
+        deltaP43y = warp_delta(pBy, p3y, nSteps)
+        if deltaP43y < 0:
+            pBy = p3y - nSteps * deltaP43y
+
+        nSteps = max(self.width - 1, 1)
+        startBits = self.dest.pixPerWord - (self.dx & (self.dest.pixPerWord - 1))
+        endBits = ((self.dx + self.bbW - 1) & (self.dest.pixPerWord - 1)) + 1
+        if self.bbW < startBits:
+            startBits = self.bbW
+        if self.destY < self.clipY:
+            # advance the increments if there was clipping in y
+            pAx += (self.clipY - self.destY) * deltaP12x
+            pAy += (self.clipY - self.destY) * deltaP12y
+            pBx += (self.clipY - self.destY) * deltaP43x
+            pBy += (self.clipY - self.destY) * deltaP43y
+
+        if self.dest.msb:
+            dstShiftInc = -self.dest.depth
+            dstShiftLeft = 32 - self.dest.depth
+        else:
+            dstShiftInc = self.dest.depth
+            dstShiftLeft = 0
+        for i in range(self.bbH):
+            xDelta = warp_delta(pAx, pBx, nSteps)
+            if xDelta >= 0:
+                self.sx = pAx
+            else:
+                self.sx = pBx - nSteps * xDelta
+            yDelta = warp_delta(pAy, pBy, nSteps)
+            if yDelta >= 0:
+                self.sy = pAy
+            else:
+                self.sy = pBy - nSteps * yDelta
+            if self.dest.msb:
+                self.dstBitShift = 32 - (((self.dx & (self.dest.pixPerWord - 1)) + 1) * self.dest.depth)
+            else:
+                self.dstBitShift = (self.dx & (self.dest.pixPerWord - 1)) * self.dest.depth
+            if self.destX < self.clipX:
+                # advance the increments if there was clipping in x
+                self.sx += (self.clipX - self.destX) * xDelta
+                self.sy += (self.clipX - self.destX) * yDelta
+            if self.halftone:
+                halftoneWord = r_uint(self.halftone[(self.dy + i) % len(self.halftone)])
+            else:
+                halftoneWord = BitBltShadow.AllOnes
+            destMask = self.mask1
+            nPix = startBits
+            for word in range(self.nWords, 0, -1):
+                if smoothing == 1:
+                    skewWord = self.warpPickSourcePixels(nPix, xDelta, yDelta, dstShiftInc)
+                else:
+                    skewWord = self.warpPickSmoothPixels(
+                        nPix, xDelta, yDelta, deltaP12x, deltaP12y, sourceMap,
+                        smoothing, dstShiftInc)
+                # align next word to leftmost pixel
+                self.dstBitShift = dstShiftLeft
+                destWord = self.dest.w_bits.getword(self.destIndex)
+                mergeWord = self.mergeFn(skewWord & halftoneWord, destWord & destMask)
+                destWord = (destMask & mergeWord) | (destWord & (~destMask))
+                self.dest.w_bits.setword(self.destIndex, destWord)
+                self.destIndex += 1
+                if word == 2: # is the next word the last word?
+                    destMask = self.mask2
+                    nPix = endBits
+                else:
+                    destMask = BitBltShadow.AllOnes
+                    nPix = self.dest.pixPerWord
+            pAx += deltaP12x
+            pAy += deltaP12y
+            pBx += deltaP43x
+            pBy += deltaP43y
+            self.destIndex += self.destDelta
+
+    def pickWarpPixelAt(self, xx, yy):
+        """The source pixel at the fixed point position xx @ yy, 0 outside of
+        the source form."""
+        if xx < 0 or yy < 0:
+            return r_uint(0)
+        x = xx >> BINARY_POINT
+        y = yy >> BINARY_POINT
+        if x >= self.source.width or y >= self.source.height:
+            return r_uint(0)
+        sourceWord = r_uint(self.source.w_bits.getword(
+            y * self.source.pitch + x / self.source.pixPerWord))
+        pixelIndex = x & (self.source.pixPerWord - 1)
+        if self.source.msb:
+            srcBitShift = 32 - (pixelIndex + 1) * self.source.depth
+        else:
+            srcBitShift = pixelIndex * self.source.depth
+        return (sourceWord >> srcBitShift) & BitBltShadow.MaskTable[self.source.depth]
+
+    def warpMapPixel(self, pixel, sourceDepth):
+        """Map a pixel of the given depth through the color map, or convert
+        between 16 and 32 bit RGB if there is none."""
+        if self.w_cmLookupTable:
+            if sourceDepth >= 16:
+                tableSize = self.cmMask + 1
+                if tableSize == 1 << 9:
+                    pixel = rgb_map(pixel, bits_per_color(sourceDepth), 3)
+                elif tableSize == 1 << 12:
+                    pixel = rgb_map(pixel, bits_per_color(sourceDepth), 4)
+                elif tableSize == 1 << 15:
+                    pixel = rgb_map(pixel, bits_per_color(sourceDepth), 5)
+            return r_uint(self.w_cmLookupTable.getword(intmask(pixel & self.cmMask)))
+        if sourceDepth >= 16 and self.dest.depth >= 16:
+            return rgb_map(pixel, bits_per_color(sourceDepth), bits_per_color(self.dest.depth))
+        return pixel
+
+    @jit.unroll_safe
+    def warpPickSourcePixels(self, nPixels, xDeltah, yDeltah, dstShiftInc):
+        dstMask = BitBltShadow.MaskTable[self.dest.depth]
+        destWord = r_uint(0)
+        for i in range(nPixels):
+            sourcePix = self.pickWarpPixelAt(self.sx, self.sy)
+            destPix = self.warpMapPixel(sourcePix, self.source.depth)
+            destWord |= (destPix & dstMask) << self.dstBitShift
+            self.dstBitShift += dstShiftInc
+            self.sx += xDeltah
+            self.sy += yDeltah
+        return destWord
+
+    @jit.unroll_safe
+    def warpPickSmoothPixels(self, nPixels, xDeltah, yDeltah, xDeltav, yDeltav,
+                             sourceMap, n, dstShiftInc):
+        # average n*n sub pixels as 32 bit ARGB, then map them to the
+        # destination depth
+        dstMask = BitBltShadow.MaskTable[self.dest.depth]
+        destWord = r_uint(0)
+        xdh = xDeltah // n
+        ydh = yDeltah // n
+        xdv = xDeltav // n
+        ydv = yDeltav // n
+        for i in range(nPixels):
+            x = self.sx
+            y = self.sy
+            count = 0
+            a = r = g = b = r_uint(0)
+            for j in range(n):
+                xx = x
+                yy = y
+                for k in range(n):
+                    rgb = self.pickWarpPixelAt(xx, yy)
+                    if not (self.combinationRule == 25 and rgb == 0):
+                        if sourceMap is not None:
+                            rgb = r_uint(sourceMap.getword(intmask(rgb)))
+                        elif self.source.depth == 16 and rgb != 0:
+                            rgb = rgb_map(rgb, 5, 8) | r_uint(0xFF000000)
+                        b += rgb & 0xFF
+                        g += (rgb >> 8) & 0xFF
+                        r += (rgb >> 16) & 0xFF
+                        a += rgb >> 24
+                        count += 1
+                    xx += xdh
+                    yy += ydh
+                x += xdv
+                y += ydv
+            if count == 0 or (self.combinationRule == 25 and count < n * n // 2):
+                rgb = r_uint(0) # all pixels were 0, or most were transparent
+            else:
+                rgb = (((a / count) << 24) | ((r / count) << 16) |
+                       ((g / count) << 8) | (b / count))
+                rgb = self.warpMapPixel(rgb, 32)
+            destWord |= (rgb & dstMask) << self.dstBitShift
+            self.dstBitShift += dstShiftInc
+            self.sx += xDeltah
+            self.sy += yDeltah
+        return destWord
+
     def mergeFn(self, src, dest):
         return r_uint(self.merge(
             r_uint(src),
@@ -583,7 +975,7 @@ class BitBltShadow(AbstractCachingShadow):
                 self.dest.depth,
                 self.dest.pixPerWord
             )
-        elif combinationRule == 37:
+        elif combinationRule == 34 or combinationRule == 37:
             return self.alphaBlendScaled(source_word, dest_word)
         else:
             raise PrimitiveFailedError("Not implemented combinationRule %d" % combinationRule)
@@ -0,0 +1,137 @@
+import math
+
+from rpython.rlib import rfloat
+from rpython.rlib.longlong2float import uint2singlefloat, singlefloat2uint
+from rpython.rlib.rarithmetic import r_singlefloat, r_uint
+from rpython.rtyper.lltypesystem import rffi
+
+from spyvm import model
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, index1_0
+
+FloatArrayPlugin = Plugin()
+
+# FloatArrays are words objects holding C floats. All primitives work on the
+# raw words and only box the scalar results, the element-wise operations
+# modify the receiver in place and answer it.
+
+# anything at or above FLT_MAX + 1/2 ulp rounds to infinity
+FLOAT32_OVERFLOW = 3.4028235677973366e+38
+
+def float_array(w_object):
+    if not isinstance(w_object, model.W_WordsObject):
+        raise PrimitiveFailedError
+    return w_object
+
+def word_to_float(word):
+    return float(uint2singlefloat(rffi.cast(rffi.UINT, word)))
+
+def float_to_word(value):
+    if not rfloat.isinf(value) and abs(value) >= FLOAT32_OVERFLOW:
+        value = rfloat.copysign(rfloat.INFINITY, value)
+    return r_uint(singlefloat2uint(r_singlefloat(value)))
+
+def load(w_array, index0):
+    return word_to_float(w_array.getword(index0))
+
+def store(w_array, index0, value):
+    w_array.setword(index0, float_to_word(value))
+
+def same_size_arrays(w_rcvr, w_arg):
+    w_rcvr = float_array(w_rcvr)
+    w_arg = float_array(w_arg)
+    if w_rcvr.size() != w_arg.size():
+        raise PrimitiveFailedError
+    return w_rcvr, w_arg
+
+def add(a, b): return a + b
+def sub(a, b): return a - b
+def mul(a, b): return a * b
+def div(a, b): return a / b
+
+for (name, op) in [("Add", add), ("Sub", sub), ("Mul", mul), ("Div", div)]:
+    def make_funcs(name, op):
+        def array_func(interp, s_frame, w_rcvr, w_arg):
+            w_rcvr, w_arg = same_size_arrays(w_rcvr, w_arg)
+            size = w_rcvr.size()
+            if op is div:
+                for i in range(size):
+                    if load(w_arg, i) == 0.0:
+                        raise PrimitiveFailedError
+            for i in range(size):
+                store(w_rcvr, i, op(load(w_rcvr, i), load(w_arg, i)))
+            return w_rcvr
+        array_func.func_name = "primitive%sFloatArray" % name
+        FloatArrayPlugin.expose_primitive(unwrap_spec=[object, object])(array_func)
+
+        def scalar_func(interp, s_frame, w_rcvr, value):
+            w_rcvr = float_array(w_rcvr)
+            if op is div and value == 0.0:
+                raise PrimitiveFailedError
+            # the scalar is rounded to a float before it is applied
+            value = word_to_float(float_to_word(value))
+            for i in range(w_rcvr.size()):
+                store(w_rcvr, i, op(load(w_rcvr, i), value))
+            return w_rcvr
+        scalar_func.func_name = "primitive%sScalar" % name
+        FloatArrayPlugin.expose_primitive(unwrap_spec=[object, float])(scalar_func)
+    make_funcs(name, op)
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object, index1_0])
+def primitiveAt(interp, s_frame, w_rcvr, index):
+    w_rcvr = float_array(w_rcvr)
+    if not 0 <= index < w_rcvr.size():
+        raise PrimitiveFailedError
+    return interp.space.wrap_float(load(w_rcvr, index))
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object, index1_0, object])
+def primitiveAtPut(interp, s_frame, w_rcvr, index, w_value):
+    w_rcvr = float_array(w_rcvr)
+    if not 0 <= index < w_rcvr.size():
+        raise PrimitiveFailedError
+    store(w_rcvr, index, interp.space.unwrap_float(w_value))
+    return w_value
+
+def dot_product(w_rcvr, w_arg):
+    result = 0.0
+    for i in range(w_rcvr.size()):
+        result += load(w_rcvr, i) * load(w_arg, i)
+    return result
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveDotProduct(interp, s_frame, w_rcvr, w_arg):
+    w_rcvr, w_arg = same_size_arrays(w_rcvr, w_arg)
+    return interp.space.wrap_float(dot_product(w_rcvr, w_arg))
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveSum(interp, s_frame, w_rcvr):
+    w_rcvr = float_array(w_rcvr)
+    result = 0.0
+    for i in range(w_rcvr.size()):
+        result += load(w_rcvr, i)
+    return interp.space.wrap_float(result)
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveLength(interp, s_frame, w_rcvr):
+    w_rcvr = float_array(w_rcvr)
+    return interp.space.wrap_float(math.sqrt(dot_product(w_rcvr, w_rcvr)))
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object])
+def primitiveNormalize(interp, s_frame, w_rcvr):
+    w_rcvr = float_array(w_rcvr)
+    length = math.sqrt(dot_product(w_rcvr, w_rcvr))
+    if length == 0.0:
+        raise PrimitiveFailedError
+    for i in range(w_rcvr.size()):
+        store(w_rcvr, i, load(w_rcvr, i) / length)
+    return w_rcvr
+
+@FloatArrayPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveEqual(interp, s_frame, w_rcvr, w_arg):
+    w_rcvr = float_array(w_rcvr)
+    if not isinstance(w_arg, model.W_WordsObject) or w_arg.size() != w_rcvr.size():
+        return interp.space.w_false
+    for i in range(w_rcvr.size()):
+        if load(w_rcvr, i) != load(w_arg, i):
+            return interp.space.w_false
+    return interp.space.w_true
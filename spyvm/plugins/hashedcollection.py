@@ -0,0 +1,49 @@
+from spyvm import model
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, index1_0
+
+HashedCollectionPlugin = Plugin()
+
+# Open-addressing probes for HashedCollections whose elements or keys compare
+# by identity (identity collections, or Symbol keys in a Dictionary). The
+# image computes the start index from whatever hash it uses and calls
+#     primScan: anArray forKey: anObject startingAt: start
+#     primScan: anArray forElement: anObject startingAt: start
+# which answer the 1-based index of the first slot from start on (wrapping
+# around) that is nil or matches, or 0 if the array is full. Images without
+# these methods never reach the plugin.
+
+def scan(space, w_array, w_object, start, keyed):
+    if not isinstance(w_array, model.W_PointersObject):
+        raise PrimitiveFailedError
+    offset = w_array.instsize(space)
+    size = w_array.size() - offset
+    if not 0 <= start < size:
+        raise PrimitiveFailedError
+    index = start
+    while True:
+        w_element = w_array.fetch(space, offset + index)
+        if w_element.is_same_object(space.w_nil):
+            return index + 1
+        if keyed:
+            if not (isinstance(w_element, model.W_PointersObject) and
+                    w_element.size() > 0):
+                raise PrimitiveFailedError
+            w_element = w_element.fetch(space, 0)
+        if w_element.is_same_object(w_object):
+            return index + 1
+        index += 1
+        if index == size:
+            index = 0
+        if index == start:
+            return 0
+
+@HashedCollectionPlugin.expose_primitive(unwrap_spec=[object, object, object, index1_0])
+def primitiveScanForKey(interp, s_frame, w_rcvr, w_array, w_key, start):
+    """The slots hold associations, match their keys."""
+    return interp.space.wrap_int(scan(interp.space, w_array, w_key, start, True))
+
+@HashedCollectionPlugin.expose_primitive(unwrap_spec=[object, object, object, index1_0])
+def primitiveScanForElement(interp, s_frame, w_rcvr, w_array, w_element, start):
+    """The slots hold the elements themselves."""
+    return interp.space.wrap_int(scan(interp.space, w_array, w_element, start, False))
@@ -0,0 +1,243 @@
+from rpython.rlib.rarithmetic import r_uint
+from rpython.rlib.rbigint import rbigint
+
+from spyvm import model, constants
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, pos_32bit_int
+
+LargeIntegersPlugin = Plugin()
+
+# The digit arithmetic of Squeak's LargeIntegers plugin. Receivers and
+# arguments are SmallIntegers or Large(Positive|Negative)Integers, which are
+# unboxed into rbigints; unless stated otherwise the digit operations work on
+# the magnitudes and all results are normalized.
+
+def large_negative_integer_class(interp):
+    image = interp.image
+    if image is None or len(image.special_objects) <= constants.SO_LARGENEGATIVEINTEGER_CLASS:
+        return None
+    return image.special(constants.SO_LARGENEGATIVEINTEGER_CLASS)
+
+def is_large_integer(space, w_object):
+    """Answer 1 for LargePositiveIntegers, -1 for LargeNegativeIntegers (a
+    subclass of LargePositiveInteger) and 0 for anything else."""
+    w_class = w_object.getclass(space)
+    if w_class.is_same_object(space.w_LargePositiveInteger):
+        return 1
+    s_superclass = w_class.as_class_get_shadow(space).s_superclass()
+    if (s_superclass is not None and
+            s_superclass.w_self().is_same_object(space.w_LargePositiveInteger)):
+        return -1
+    return 0
+
+def unwrap_bigint(space, w_integer):
+    if isinstance(w_integer, model.W_SmallInteger):
+        return rbigint.fromint(w_integer.value)
+    elif isinstance(w_integer, model.W_LargePositiveInteger1Word):
+        return rbigint.fromrarith_int(r_uint(w_integer.value))
+    elif isinstance(w_integer, model.W_BytesObject):
+        sign = is_large_integer(space, w_integer)
+        if sign == 0:
+            raise PrimitiveFailedError
+        magnitude = rbigint.frombytes(w_integer.as_string(), 'little', False)
+        if sign < 0:
+            return magnitude.neg()
+        return magnitude
+    raise PrimitiveFailedError
+
+def wrap_bigint(interp, value):
+    space = interp.space
+    try:
+        return space.wrap_int(value.toint())
+    except OverflowError:
+        pass
+    if value.sign > 0:
+        if value.bit_length() <= 32:
+            return space.wrap_uint(value.touint())
+        w_class = space.w_LargePositiveInteger
+    else:
+        w_class = large_negative_integer_class(interp)
+        if w_class is None:
+            raise PrimitiveFailedError
+    nbytes = (value.bit_length() + 7) // 8
+    data = value.abs().tobytes(nbytes, 'little', False)
+    w_result = model.W_BytesObject(space, w_class, nbytes)
+    for i in range(nbytes):
+        w_result.setchar(i, data[i])
+    return w_result
+
+def with_sign(magnitude, negative):
+    if negative:
+        return magnitude.neg()
+    return magnitude
+
+ZERO = rbigint.fromint(0)
+
+# ___________________________________________________________________________
+# Arithmetic
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object])
+def primDigitAdd(interp, s_frame, w_rcvr, w_arg):
+    """Integer>>digitAdd:, the sum of the magnitudes with the sign of the
+    receiver."""
+    rcvr = unwrap_bigint(interp.space, w_rcvr)
+    arg = unwrap_bigint(interp.space, w_arg)
+    return wrap_bigint(interp, with_sign(rcvr.abs().add(arg.abs()), rcvr.sign < 0))
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object])
+def primDigitSubtract(interp, s_frame, w_rcvr, w_arg):
+    """Integer>>digitSubtract:, the difference of the magnitudes, negated if
+    the receiver is negative."""
+    rcvr = unwrap_bigint(interp.space, w_rcvr)
+    arg = unwrap_bigint(interp.space, w_arg)
+    return wrap_bigint(interp, with_sign(rcvr.abs().sub(arg.abs()), rcvr.sign < 0))
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object, bool])
+def primDigitMultiplyNegative(interp, s_frame, w_rcvr, w_arg, negative):
+    """Integer>>digitMultiply:neg:"""
+    rcvr = unwrap_bigint(interp.space, w_rcvr)
+    arg = unwrap_bigint(interp.space, w_arg)
+    return wrap_bigint(interp, with_sign(rcvr.abs().mul(arg.abs()), negative))
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object, bool])
+def primDigitDivNegative(interp, s_frame, w_rcvr, w_arg, negative):
+    """Integer>>digitDiv:neg:, answers an Array with the quotient of the
+    magnitudes with the given sign and the remainder with the sign of the
+    receiver."""
+    space = interp.space
+    rcvr = unwrap_bigint(space, w_rcvr)
+    arg = unwrap_bigint(space, w_arg)
+    if arg.sign == 0:
+        raise PrimitiveFailedError
+    quotient, remainder = rcvr.abs().divmod(arg.abs())
+    return space.wrap_list([wrap_bigint(interp, with_sign(quotient, negative)),
+                            wrap_bigint(interp, with_sign(remainder, rcvr.sign < 0))])
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object])
+def primDigitCompare(interp, s_frame, w_rcvr, w_arg):
+    """Integer>>digitCompare:, compares the magnitudes."""
+    rcvr = unwrap_bigint(interp.space, w_rcvr).abs()
+    arg = unwrap_bigint(interp.space, w_arg).abs()
+    if rcvr.gt(arg):
+        return interp.space.wrap_int(1)
+    elif rcvr.lt(arg):
+        return interp.space.wrap_int(-1)
+    return interp.space.wrap_int(0)
+
+def normalize(interp, w_rcvr):
+    """Answer the receiver itself if it is in its shortest form."""
+    value = unwrap_bigint(interp.space, w_rcvr)
+    if isinstance(w_rcvr, model.W_BytesObject):
+        size = w_rcvr.size()
+        if size > 0 and w_rcvr.getchar(size - 1) != '\x00':
+            try:
+                value.toint()
+            except OverflowError:
+                return w_rcvr
+    elif isinstance(w_rcvr, model.W_LargePositiveInteger1Word):
+        return w_rcvr
+    return wrap_bigint(interp, value)
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object])
+def primNormalizePositive(interp, s_frame, w_rcvr):
+    return normalize(interp, w_rcvr)
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object])
+def primNormalizeNegative(interp, s_frame, w_rcvr):
+    return normalize(interp, w_rcvr)
+
+# ___________________________________________________________________________
+# Bit operations
+
+def unwrap_positive(space, w_integer):
+    value = unwrap_bigint(space, w_integer)
+    if value.sign < 0:
+        raise PrimitiveFailedError
+    return value
+
+def bit_and(a, b): return a.and_(b)
+def bit_or(a, b): return a.or_(b)
+def bit_xor(a, b): return a.xor(b)
+
+for (name, op) in [("And", bit_and), ("Or", bit_or), ("Xor", bit_xor)]:
+    def make_func(op):
+        def func(interp, s_frame, w_rcvr, w_arg):
+            rcvr = unwrap_positive(interp.space, w_rcvr)
+            arg = unwrap_positive(interp.space, w_arg)
+            return wrap_bigint(interp, op(rcvr, arg))
+        return func
+    func = make_func(op)
+    func.func_name = "primDigitBit%s" % name
+    LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object])(func)
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, int])
+def primDigitBitShiftMagnitude(interp, s_frame, w_rcvr, shift):
+    """Integer>>bitShiftMagnitude:, shifts the magnitude and keeps the sign."""
+    rcvr = unwrap_bigint(interp.space, w_rcvr)
+    magnitude = rcvr.abs()
+    if shift >= 0:
+        magnitude = magnitude.lshift(shift)
+    else:
+        magnitude = magnitude.rshift(-shift)
+    return wrap_bigint(interp, with_sign(magnitude, rcvr.sign < 0))
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, int, int])
+def primAnyBitFromTo(interp, s_frame, w_rcvr, start, stop):
+    """Integer>>anyBitOfMagnitudeFrom:to:, with one-based bit indices."""
+    if start < 1 or stop < 1:
+        raise PrimitiveFailedError
+    magnitude = unwrap_bigint(interp.space, w_rcvr).abs()
+    if stop < start or start > magnitude.bit_length():
+        return interp.space.w_false
+    bits = magnitude.rshift(start - 1)
+    mask = rbigint.fromint(1).lshift(stop - start + 1).sub(rbigint.fromint(1))
+    return interp.space.wrap_bool(bits.and_(mask).sign != 0)
+
+# ___________________________________________________________________________
+# Montgomery multiplication
+
+DIGIT_BITS = 32
+DIGIT_MASK = rbigint.fromrarith_int(r_uint(0xFFFFFFFF))
+
+def digit_length(value):
+    """The number of 32 bit digits of the magnitude."""
+    return (value.bit_length() + DIGIT_BITS - 1) // DIGIT_BITS
+
+def montgomery_times(x, y, m, m_inv):
+    """x * y * R^-1 mod m for R = 2^(32 * digits of m), digit by digit like
+    the C plugin; m_inv is -m^-1 mod 2^32."""
+    result = ZERO
+    big_m_inv = rbigint.fromrarith_int(m_inv)
+    for i in range(digit_length(m)):
+        x_i = x.rshift(i * DIGIT_BITS).and_(DIGIT_MASK)
+        result = result.add(y.mul(x_i))
+        u = result.and_(DIGIT_MASK).mul(big_m_inv).and_(DIGIT_MASK)
+        result = result.add(m.mul(u)).rshift(DIGIT_BITS)
+    if result.ge(m):
+        result = result.sub(m)
+    return result
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object])
+def primMontgomeryDigitLength(interp, s_frame, w_rcvr):
+    """LargePositiveInteger>>montgomeryDigitLength, the image derives
+    montgomeryDigitBase and mInvModB from it."""
+    return interp.space.wrap_int(DIGIT_BITS)
+
+@LargeIntegersPlugin.expose_primitive(unwrap_spec=[object, object, object, pos_32bit_int])
+def primMontgomeryTimesModulo(interp, s_frame, w_rcvr, w_arg, w_modulo, m_inv):
+    """LargePositiveInteger>>montgomeryTimes:modulo:mInvModB:, the factors
+    must not have more digits than the odd modulus."""
+    space = interp.space
+    rcvr = unwrap_positive(space, w_rcvr)
+    arg = unwrap_positive(space, w_arg)
+    modulo = unwrap_positive(space, w_modulo)
+    if modulo.sign == 0 or not modulo.int_and_(1).tobool():
+        raise PrimitiveFailedError
+    length = digit_length(modulo)
+    if digit_length(rcvr) > length or digit_length(arg) > length:
+        raise PrimitiveFailedError
+    # mInvModB must be for our digit base, not the image fallback of 8 bits
+    low = modulo.and_(DIGIT_MASK).mul(rbigint.fromrarith_int(m_inv))
+    if not low.and_(DIGIT_MASK).eq(DIGIT_MASK):
+        raise PrimitiveFailedError
+    return wrap_bigint(interp, montgomery_times(rcvr, arg, modulo, m_inv))
@@ -0,0 +1,246 @@
+from rpython.rlib.rarithmetic import r_uint, intmask
+
+from spyvm import model
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, index1_0
+
+MiscPrimitivePlugin = Plugin()
+
+# These are the translated versions of the Smalltalk methods in the
+# MiscPrimitivePlugin. The image falls back to the very same code when the
+# primitives fail, so the semantics (including the 1-based return values)
+# follow the Smalltalk sources.
+
+def bytes_of(w_object):
+    if not isinstance(w_object, model.W_BytesObject):
+        raise PrimitiveFailedError
+    return w_object
+
+def words_of(w_object):
+    if not isinstance(w_object, model.W_WordsObject):
+        raise PrimitiveFailedError
+    return w_object
+
+def byte_at(w_bytes, index0):
+    return ord(w_bytes.getchar(index0))
+
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, object, object])
+def primitiveCompareString(interp, s_frame, w_rcvr, w_string1, w_string2, w_order):
+    """String class>>compare:with:collated: answers 1, 2 or 3 for less,
+    equal and greater."""
+    w_string1 = bytes_of(w_string1)
+    w_string2 = bytes_of(w_string2)
+    w_order = bytes_of(w_order)
+    if w_order.size() < 256:
+        raise PrimitiveFailedError
+    len1 = w_string1.size()
+    len2 = w_string2.size()
+    for i in range(min(len1, len2)):
+        c1 = byte_at(w_order, byte_at(w_string1, i))
+        c2 = byte_at(w_order, byte_at(w_string2, i))
+        if c1 != c2:
+            if c1 < c2:
+                return interp.space.wrap_int(1)
+            return interp.space.wrap_int(3)
+    if len1 == len2:
+        return interp.space.wrap_int(2)
+    if len1 < len2:
+        return interp.space.wrap_int(1)
+    return interp.space.wrap_int(3)
+
+def string_hash(w_string, species_hash):
+    hash = species_hash & 0xFFFFFFF
+    for i in range(w_string.size()):
+        hash += byte_at(w_string, i)
+        # hashMultiply
+        low = hash & 16383
+        hash = (0x260D * low + (((0x260D * (hash >> 14) + 0x0065 * low) & 16383) * 16384)) & 0x0FFFFFFF
+    return hash
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveStringHash(interp, s_frame, w_rcvr, w_string, species_hash):
+    w_string = bytes_of(w_string)
+    return interp.space.wrap_int(string_hash(w_string, species_hash))
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, int, object, index1_0])
+def primitiveIndexOfAsciiInString(interp, s_frame, w_rcvr, ascii, w_string, start):
+    w_string = bytes_of(w_string)
+    if start < 0:
+        raise PrimitiveFailedError
+    for i in range(start, w_string.size()):
+        if byte_at(w_string, i) == ascii:
+            return interp.space.wrap_int(i + 1)
+    return interp.space.wrap_int(0)
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, index1_0, index1_0, object])
+def primitiveTranslateStringWithTable(interp, s_frame, w_rcvr, w_string, start, stop, w_table):
+    w_string = bytes_of(w_string)
+    w_table = bytes_of(w_table)
+    if start < 0 or stop >= w_string.size() or w_table.size() < 256:
+        raise PrimitiveFailedError
+    for i in range(start, stop + 1):
+        w_string.setchar(i, w_table.getchar(byte_at(w_string, i)))
+    return w_rcvr
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, object, int, object])
+def primitiveFindSubstring(interp, s_frame, w_rcvr, w_key, w_body, start, w_match_table):
+    w_key = bytes_of(w_key)
+    w_body = bytes_of(w_body)
+    w_match_table = bytes_of(w_match_table)
+    if w_match_table.size() < 256:
+        raise PrimitiveFailedError
+    key_size = w_key.size()
+    if key_size == 0:
+        return interp.space.wrap_int(0)
+    # 0-based start index into body
+    for start0 in range(max(start, 1) - 1, w_body.size() - key_size + 1):
+        index = 0
+        while (byte_at(w_match_table, byte_at(w_body, start0 + index)) ==
+               byte_at(w_match_table, byte_at(w_key, index))):
+            if index == key_size - 1:
+                return interp.space.wrap_int(start0 + 1)
+            index += 1
+    return interp.space.wrap_int(0)
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, object, int])
+def primitiveFindFirstInString(interp, s_frame, w_rcvr, w_string, w_inclusion_map, start):
+    w_string = bytes_of(w_string)
+    w_inclusion_map = bytes_of(w_inclusion_map)
+    if w_inclusion_map.size() != 256:
+        return interp.space.wrap_int(0)
+    if start < 1:
+        raise PrimitiveFailedError
+    size = w_string.size()
+    i = start - 1
+    while i < size and byte_at(w_inclusion_map, byte_at(w_string, i)) == 0:
+        i += 1
+    if i >= size:
+        return interp.space.wrap_int(0)
+    return interp.space.wrap_int(i + 1)
+
+
+# Bitmap run-length compression, as used when storing Forms on ByteArrays.
+
+def put_byte(w_bytes, index0, value):
+    if index0 >= w_bytes.size():
+        raise PrimitiveFailedError
+    w_bytes.setchar(index0, chr(value & 0xFF))
+    return index0 + 1
+
+def encode_bytes_of(word, w_bytes, index0):
+    word = r_uint(word)
+    for shift in [24, 16, 8, 0]:
+        index0 = put_byte(w_bytes, index0, intmask((word >> shift) & 0xFF))
+    return index0
+
+def encode_int(value, w_bytes, index0):
+    if value <= 223:
+        return put_byte(w_bytes, index0, value)
+    if value <= 7935:
+        index0 = put_byte(w_bytes, index0, value // 256 + 224)
+        return put_byte(w_bytes, index0, value % 256)
+    index0 = put_byte(w_bytes, index0, 255)
+    return encode_bytes_of(value, w_bytes, index0)
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveCompressToByteArray(interp, s_frame, w_rcvr, w_bitmap, w_bytes):
+    w_bitmap = words_of(w_bitmap)
+    w_bytes = bytes_of(w_bytes)
+    size = w_bitmap.size()
+    i = encode_int(size, w_bytes, 0)
+    k = 0
+    while k < size:
+        word = w_bitmap.getword(k)
+        low_byte = intmask(word & 0xFF)
+        eq_bytes = (intmask((word >> 8) & 0xFF) == low_byte and
+                    intmask((word >> 16) & 0xFF) == low_byte and
+                    intmask((word >> 24) & 0xFF) == low_byte)
+        j = k
+        while j + 1 < size and word == w_bitmap.getword(j + 1):
+            j += 1
+        if j > k:
+            # two or more equal words, ending at j
+            if eq_bytes:
+                i = encode_int((j - k + 1) * 4 + 1, w_bytes, i)
+                i = put_byte(w_bytes, i, low_byte)
+            else:
+                i = encode_int((j - k + 1) * 4 + 2, w_bytes, i)
+                i = encode_bytes_of(word, w_bytes, i)
+            k = j + 1
+        elif eq_bytes:
+            # a single word of four equal bytes
+            i = encode_int(1 * 4 + 1, w_bytes, i)
+            i = put_byte(w_bytes, i, low_byte)
+            k += 1
+        else:
+            # a run of unequal words, ending before j
+            while j + 1 < size and w_bitmap.getword(j) != w_bitmap.getword(j + 1):
+                j += 1
+            if j + 1 == size:
+                j += 1
+            i = encode_int((j - k) * 4 + 3, w_bytes, i)
+            for m in range(k, j):
+                i = encode_bytes_of(w_bitmap.getword(m), w_bytes, i)
+            k = j
+    return interp.space.wrap_int(i)
+
+def get_byte(w_bytes, index0):
+    if index0 >= w_bytes.size():
+        raise PrimitiveFailedError
+    return ord(w_bytes.getchar(index0))
+
+def get_word(w_bytes, index0):
+    word = r_uint(0)
+    for j in range(4):
+        word = (word << 8) | r_uint(get_byte(w_bytes, index0 + j))
+    return word
+
+@MiscPrimitivePlugin.expose_primitive(unwrap_spec=[object, object, object, index1_0])
+def primitiveDecompressFromByteArray(interp, s_frame, w_rcvr, w_bitmap, w_bytes, index):
+    w_bitmap = words_of(w_bitmap)
+    w_bytes = bytes_of(w_bytes)
+    if index < 0:
+        raise PrimitiveFailedError
+    i = index
+    end = w_bytes.size()
+    k = 0
+    size = w_bitmap.size()
+    while i < end:
+        # decode the next run length and code
+        an_int = r_uint(get_byte(w_bytes, i))
+        i += 1
+        if an_int > 223:
+            if an_int <= 254:
+                an_int = (an_int - 224) * 256 + r_uint(get_byte(w_bytes, i))
+                i += 1
+            else:
+                an_int = get_word(w_bytes, i)
+                i += 4
+        n = intmask(an_int >> 2)
+        if n < 0 or k + n > size:
+            raise PrimitiveFailedError
+        code = intmask(an_int & 3)
+        if code == 1:
+            # n words of four bytes equal to the next byte
+            data = r_uint(get_byte(w_bytes, i))
+            i += 1
+            data = data | (data << 8)
+            data = data | (data << 16)
+            for j in range(n):
+                w_bitmap.setword(k, data)
+                k += 1
+        elif code == 2:
+            # n words equal to the next four bytes
+            data = get_word(w_bytes, i)
+            i += 4
+            for j in range(n):
+                w_bitmap.setword(k, data)
+                k += 1
+        elif code == 3:
+            # n words taken from the data
+            for j in range(n):
+                w_bitmap.setword(k, get_word(w_bytes, i))
+                i += 4
+                k += 1
+    return w_rcvr
@@ -0,0 +1,211 @@
+import math
+
+from rpython.rlib import rfloat
+from rpython.rlib.rbigint import rbigint
+from rpython.rlib.rstring import StringBuilder
+
+from spyvm import model
+from spyvm.plugins.largeintegers import unwrap_bigint, wrap_bigint
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError
+
+NumberPlugin = Plugin()
+
+# Printing and parsing of Integers and Floats. The results are the same as
+# those of the Smalltalk code in the image (Integer>>printString:,
+# Float>>absPrintExactlyOn:base: and the number parsers); anything the
+# primitives do not understand fails and is left to that code. The changeset
+# routes printOn: and Number class>>readFrom: and readFrom:base: of Strings
+# through them.
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def check_base(base):
+    if not 2 <= base <= 36:
+        raise PrimitiveFailedError
+
+# ___________________________________________________________________________
+# Printing
+
+def print_integer(value, base):
+    return value.format(DIGITS[:base])
+
+LN2 = math.log(2.0)
+HIDDEN_BIT = 4503599627370496.0 # 2 ** 52
+MIN_EXPONENT = -1022
+MIN_VAL_LOG_BASE2 = -1074
+
+def print_float(value, base):
+    """Float>>printOn:base:"""
+    if rfloat.isnan(value):
+        return "NaN"
+    if value > 0.0:
+        return abs_print_exactly(value, base)
+    if rfloat.copysign(1.0, value) < 0.0:
+        sign = "-"
+    else:
+        sign = ""
+    if value == 0.0:
+        return sign + "0.0"
+    return sign + abs_print_exactly(-value, base)
+
+def abs_print_exactly(value, base):
+    """Float>>absPrintExactlyOn:base:, the free-format algorithm from Burger
+    and Dybvig, "Printing Floating-Point Numbers Quickly and Accurately",
+    using exact integer arithmetic."""
+    if rfloat.isinf(value):
+        return "Infinity"
+    big_base = rbigint.fromint(base)
+    exponent = math.frexp(value)[1] - 1
+    significand_float = math.ldexp(value, 52 - max(exponent, MIN_EXPONENT))
+    significand = rbigint.fromfloat(significand_float)
+    rounding_includes_limits = math.fmod(significand_float, 2.0) == 0.0
+    exp = max(exponent - 52, MIN_VAL_LOG_BASE2)
+    base_exp_estimate = int(math.ceil(exponent * (LN2 / math.log(float(base))) - 1.0e-10))
+    one = rbigint.fromint(1)
+    if exp >= 0:
+        if significand_float != HIDDEN_BIT:
+            r = significand.lshift(1 + exp)
+            s = rbigint.fromint(2)
+            m_plus = m_minus = one.lshift(exp)
+        else:
+            r = significand.lshift(2 + exp)
+            s = rbigint.fromint(4)
+            m_minus = one.lshift(exp)
+            m_plus = m_minus.int_mul(2)
+    else:
+        if exp == MIN_VAL_LOG_BASE2 or significand_float != HIDDEN_BIT:
+            r = significand.lshift(1)
+            s = one.lshift(1 - exp)
+            m_plus = m_minus = one
+        else:
+            r = significand.lshift(2)
+            s = one.lshift(2 - exp)
+            m_plus = rbigint.fromint(2)
+            m_minus = one
+    if base_exp_estimate >= 0:
+        s = s.mul(big_base.pow(rbigint.fromint(base_exp_estimate)))
+    else:
+        scale = big_base.pow(rbigint.fromint(-base_exp_estimate))
+        r = r.mul(scale)
+        m_plus = m_plus.mul(scale)
+        m_minus = m_minus.mul(scale)
+    if r.add(m_plus).ge(s) and (rounding_includes_limits or r.add(m_plus).gt(s)):
+        base_exp_estimate += 1
+    else:
+        r = r.int_mul(base)
+        m_plus = m_plus.int_mul(base)
+        m_minus = m_minus.int_mul(base)
+
+    builder = StringBuilder()
+    fixed_format = -3 <= base_exp_estimate <= 16
+    if fixed_format:
+        dec_point_count = base_exp_estimate
+        if base_exp_estimate <= 0:
+            builder.append("0.")
+            builder.append("0" * -base_exp_estimate)
+    else:
+        dec_point_count = 1
+    while True:
+        d, r = r.divmod(s)
+        digit = d.toint()
+        tc1 = r.lt(m_minus) or (rounding_includes_limits and r.eq(m_minus))
+        tc2 = (r.add(m_plus).gt(s) or
+               (rounding_includes_limits and r.add(m_plus).eq(s)))
+        if tc1 or tc2:
+            break
+        builder.append(DIGITS[digit])
+        r = r.int_mul(base)
+        m_plus = m_plus.int_mul(base)
+        m_minus = m_minus.int_mul(base)
+        dec_point_count -= 1
+        if dec_point_count == 0:
+            builder.append(".")
+    if tc2 and (not tc1 or r.int_mul(2).ge(s)):
+        digit += 1
+    builder.append(DIGITS[digit])
+    if dec_point_count > 0:
+        builder.append("0" * (dec_point_count - 1))
+        builder.append(".0")
+    if not fixed_format:
+        builder.append("e")
+        builder.append(str(base_exp_estimate - 1))
+    return builder.build()
+
+@NumberPlugin.expose_primitive(unwrap_spec=[object, int])
+def primitivePrintString(interp, s_frame, w_rcvr, base):
+    """Integer>>printString: and Float>>printString:"""
+    check_base(base)
+    if isinstance(w_rcvr, model.W_Float):
+        return interp.space.wrap_string(print_float(w_rcvr.value, base))
+    return interp.space.wrap_string(print_integer(unwrap_bigint(interp.space, w_rcvr), base))
+
+# ___________________________________________________________________________
+# Parsing
+
+def digit_value(c):
+    if '0' <= c <= '9':
+        return ord(c) - ord('0')
+    if 'A' <= c <= 'Z':
+        return ord(c) - ord('A') + 10
+    return 36
+
+def scan_digits(string, start, base):
+    """Answer the index after the digits in base starting at start."""
+    i = start
+    while i < len(string) and digit_value(string[i]) < base:
+        i += 1
+    return i
+
+def parse_integer(string, base):
+    start = 0
+    if string.startswith("-"):
+        start = 1
+    if start == len(string) or scan_digits(string, start, base) != len(string):
+        raise PrimitiveFailedError
+    return rbigint.fromstr(string, base)
+
+def parse_float(string):
+    """Only plain decimal literals, -?digits(.digits)?(e-?digits)?"""
+    i = 0
+    if string.startswith("-"):
+        i = 1
+    end = scan_digits(string, i, 10)
+    if end == i:
+        raise PrimitiveFailedError
+    i = end
+    if i < len(string) and string[i] == ".":
+        end = scan_digits(string, i + 1, 10)
+        if end == i + 1:
+            raise PrimitiveFailedError
+        i = end
+    if i < len(string) and string[i] == "e":
+        i += 1
+        if i < len(string) and string[i] == "-":
+            i += 1
+        end = scan_digits(string, i, 10)
+        if end == i:
+            raise PrimitiveFailedError
+        i = end
+    if i != len(string):
+        raise PrimitiveFailedError
+    # correctly rounded, like the exact arithmetic of the image's parser
+    return rfloat.string_to_float(string)
+
+def unwrap_string(w_string):
+    if not isinstance(w_string, model.W_BytesObject):
+        raise PrimitiveFailedError
+    return w_string.as_string()
+
+@NumberPlugin.expose_primitive(unwrap_spec=[object, object, int])
+def primitiveReadInteger(interp, s_frame, w_rcvr, w_string, base):
+    """Number class>>primReadInteger:base:, for a String holding just the
+    number"""
+    check_base(base)
+    return wrap_bigint(interp, parse_integer(unwrap_string(w_string), base))
+
+@NumberPlugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveReadFloat(interp, s_frame, w_rcvr, w_string):
+    """Number class>>primReadFloat:, for a String holding just a plain
+    decimal number"""
+    return interp.space.wrap_float(parse_float(unwrap_string(w_string)))
@@ -0,0 +1,143 @@
+from rpython.rlib.rarithmetic import r_uint, intmask
+from rpython.rlib.rstring import StringBuilder
+
+from spyvm import model, shadow
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError
+
+UTF8Plugin = Plugin()
+
+# Conversion between Squeak strings and UTF-8, for the image's
+# squeakToUtf8/utf8ToSqueak (UTF8TextConverter). ByteStrings hold Latin-1,
+# WideStrings are words objects holding a code point in the low 22 bits of
+# each word (the bits above are the leading char). Malformed input makes the
+# primitives fail, so the image's converter decides what to do with it.
+
+CHARCODE_MASK = 0x3FFFFF
+MAX_CODE_POINT = 0x10FFFF
+
+def is_surrogate(code):
+    return 0xD800 <= code <= 0xDFFF
+
+def encode_code_point(builder, code):
+    if code < 0x80:
+        builder.append(chr(code))
+    elif code < 0x800:
+        builder.append(chr(0xC0 | (code >> 6)))
+        builder.append(chr(0x80 | (code & 0x3F)))
+    elif code < 0x10000:
+        if is_surrogate(code):
+            raise PrimitiveFailedError
+        builder.append(chr(0xE0 | (code >> 12)))
+        builder.append(chr(0x80 | ((code >> 6) & 0x3F)))
+        builder.append(chr(0x80 | (code & 0x3F)))
+    elif code <= MAX_CODE_POINT:
+        builder.append(chr(0xF0 | (code >> 18)))
+        builder.append(chr(0x80 | ((code >> 12) & 0x3F)))
+        builder.append(chr(0x80 | ((code >> 6) & 0x3F)))
+        builder.append(chr(0x80 | (code & 0x3F)))
+    else:
+        raise PrimitiveFailedError
+
+def utf8_encode(w_string):
+    size = w_string.size()
+    if isinstance(w_string, model.W_BytesObject):
+        builder = StringBuilder(size)
+        for i in range(size):
+            encode_code_point(builder, ord(w_string.getchar(i)))
+    elif isinstance(w_string, model.W_WordsObject):
+        builder = StringBuilder(size)
+        for i in range(size):
+            word = w_string.getword(i)
+            encode_code_point(builder, intmask(word & r_uint(CHARCODE_MASK)))
+    else:
+        raise PrimitiveFailedError
+    return builder.build()
+
+def continuation(string, i):
+    if i >= len(string):
+        raise PrimitiveFailedError
+    byte = ord(string[i])
+    if byte & 0xC0 != 0x80:
+        raise PrimitiveFailedError
+    return byte & 0x3F
+
+def utf8_decode(string):
+    """Answer the list of code points, failing on truncated or overlong
+    sequences, surrogates and anything beyond U+10FFFF."""
+    codes = []
+    i = 0
+    length = len(string)
+    while i < length:
+        byte = ord(string[i])
+        if byte < 0x80:
+            code = byte
+            i += 1
+        elif 0xC2 <= byte <= 0xDF:
+            code = ((byte & 0x1F) << 6) | continuation(string, i + 1)
+            i += 2
+        elif 0xE0 <= byte <= 0xEF:
+            code = (((byte & 0x0F) << 12) | (continuation(string, i + 1) << 6) |
+                    continuation(string, i + 2))
+            if code < 0x800 or is_surrogate(code):
+                raise PrimitiveFailedError
+            i += 3
+        elif 0xF0 <= byte <= 0xF4:
+            code = (((byte & 0x07) << 18) | (continuation(string, i + 1) << 12) |
+                    (continuation(string, i + 2) << 6) | continuation(string, i + 3))
+            if code < 0x10000 or code > MAX_CODE_POINT:
+                raise PrimitiveFailedError
+            i += 4
+        else:
+            raise PrimitiveFailedError
+        codes.append(code)
+    return codes
+
+def instantiate(space, w_class, size, instance_kind):
+    if not isinstance(w_class, model.W_PointersObject):
+        raise PrimitiveFailedError
+    s_class = w_class.as_class_get_shadow(space)
+    if s_class.instance_kind != instance_kind:
+        raise PrimitiveFailedError
+    return s_class.new(size)
+
+def byte_contents(w_object):
+    if not isinstance(w_object, model.W_BytesObject):
+        raise PrimitiveFailedError
+    return w_object.as_string()
+
+@UTF8Plugin.expose_primitive(unwrap_spec=[object, object])
+def primitiveUTF8Encode(interp, s_frame, w_rcvr, w_class):
+    """Encode the receiver, a ByteString or WideString, into a new instance of
+    the bytes class w_class (String or ByteArray)."""
+    encoded = utf8_encode(w_rcvr)
+    w_result = instantiate(interp.space, w_class, len(encoded), shadow.BYTES)
+    assert isinstance(w_result, model.W_BytesObject)
+    for i in range(len(encoded)):
+        w_result.setchar(i, encoded[i])
+    return w_result
+
+@UTF8Plugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveUTF8Decode(interp, s_frame, w_rcvr, w_byte_class, w_wide_class):
+    """Decode the UTF-8 bytes of the receiver (a String or ByteArray). Answer
+    an instance of w_byte_class if all characters fit into Latin-1, an
+    instance of w_wide_class otherwise."""
+    space = interp.space
+    codes = utf8_decode(byte_contents(w_rcvr))
+    size = len(codes)
+    wide = False
+    for code in codes:
+        if code > 0xFF:
+            wide = True
+            break
+    if wide:
+        w_result = instantiate(space, w_wide_class, size, shadow.WORDS)
+        assert isinstance(w_result, model.W_WordsObject)
+        for i in range(size):
+            w_result.setword(i, r_uint(codes[i]))
+    else:
+        w_result = instantiate(space, w_byte_class, size, shadow.BYTES)
+        assert isinstance(w_result, model.W_BytesObject)
+        for i in range(size):
+            w_result.setchar(i, chr(codes[i]))
+    return w_result
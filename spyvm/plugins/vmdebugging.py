@@ -66,3 +66,20 @@ def stopUIProcess(interp, s_frame, w_rcvr):
         return interp.space.w_true
     else:
         return interp.space.w_false
+
+@DebuggingPlugin.expose_primitive(unwrap_spec=[object, str])
+def dumpDisplayFrame(interp, s_frame, w_rcvr, filename):
+    try:
+        interp.space.get_display().dump_ppm(filename)
+    except OSError:
+        raise error.PrimitiveFailedError()
+    return w_rcvr
+
+@DebuggingPlugin.expose_primitive(unwrap_spec=[object, list])
+def postDisplayEvent(interp, s_frame, w_rcvr, w_event):
+    from spyvm.display import HeadlessDisplay
+    sdldisplay = interp.space.get_display()
+    if not isinstance(sdldisplay, HeadlessDisplay) or len(w_event) != 8:
+        raise error.PrimitiveFailedError()
+    sdldisplay.post_event([interp.space.unwrap_int(w_field) for w_field in w_event])
+    return w_rcvr
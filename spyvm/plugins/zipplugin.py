@@ -0,0 +1,467 @@
+from rpython.rlib.rarithmetic import r_uint, intmask
+
+from spyvm import model
+from spyvm.plugins.plugin import Plugin
+from spyvm.primitives import PrimitiveFailedError, pos_32bit_int
+
+ZipPlugin = Plugin()
+
+# The primitives of Squeak's ZipPlugin (InflatePlugin and DeflatePlugin) for
+# FastInflateStream, ZipWriteStream, GZipWriteStream and friends. Like the C
+# plugin they read the instance variables of the stream they are sent to,
+# run the inner loop of the Smalltalk method they replace on the raw buffers
+# and store the modified variables back.
+
+# ___________________________________________________________________________
+# Checksums
+
+def make_crc_table():
+    table = []
+    for n in range(256):
+        c = r_uint(n)
+        for k in range(8):
+            if c & 1:
+                c = r_uint(0xEDB88320) ^ (c >> 1)
+            else:
+                c = c >> 1
+        table.append(c)
+    return table
+
+CRC_TABLE = make_crc_table()
+
+ADLER_BASE = 65521
+
+def checked_bytes(w_collection, start, stop):
+    if not (isinstance(w_collection, model.W_BytesObject) and
+            0 < start <= stop <= w_collection.size()):
+        raise PrimitiveFailedError
+    return w_collection
+
+def update_crc32(crc, w_bytes, start, stop):
+    """Without the pre- and post-conditioning, the caller does that."""
+    for i in range(start - 1, stop):
+        byte = ord(w_bytes.getchar(i))
+        crc = CRC_TABLE[intmask((crc ^ byte) & 0xFF)] ^ (crc >> 8)
+    return crc
+
+def update_adler32(adler, w_bytes, start, stop):
+    s1 = intmask(adler & 0xFFFF)
+    s2 = intmask((adler >> 16) & 0xFFFF)
+    for i in range(start - 1, stop):
+        s1 = (s1 + ord(w_bytes.getchar(i))) % ADLER_BASE
+        s2 = (s2 + s1) % ADLER_BASE
+    return (r_uint(s2) << 16) | r_uint(s1)
+
+@ZipPlugin.expose_primitive(unwrap_spec=[object, pos_32bit_int, int, int, object])
+def primitiveUpdateGZipCrc32(interp, s_frame, w_rcvr, crc, start, stop, w_collection):
+    """GZipWriteStream class>>updateCrc:from:to:in:"""
+    w_bytes = checked_bytes(w_collection, start, stop)
+    return interp.space.wrap_uint(update_crc32(crc, w_bytes, start, stop))
+
+@ZipPlugin.expose_primitive(unwrap_spec=[object, pos_32bit_int, int, int, object])
+def primitiveUpdateAdler32(interp, s_frame, w_rcvr, adler, start, stop, w_collection):
+    """ZipWriteStream class>>updateAdler32:from:to:in:"""
+    w_bytes = checked_bytes(w_collection, start, stop)
+    return interp.space.wrap_uint(update_adler32(adler, w_bytes, start, stop))
+
+# ___________________________________________________________________________
+# Stream access
+
+def fetch_int(space, w_rcvr, index):
+    return space.unwrap_int(w_rcvr.fetch(space, index))
+
+def store_int(space, w_rcvr, index, value):
+    w_rcvr.store(space, index, space.wrap_int(value))
+
+def fetch_bytes(space, w_rcvr, index):
+    w_bytes = w_rcvr.fetch(space, index)
+    if not isinstance(w_bytes, model.W_BytesObject):
+        raise PrimitiveFailedError
+    return w_bytes
+
+def fetch_words(space, w_rcvr, index, size=-1):
+    w_words = w_object_words(w_rcvr.fetch(space, index))
+    if size >= 0 and w_words.size() != size:
+        raise PrimitiveFailedError
+    return w_words
+
+def w_object_words(w_object):
+    if not isinstance(w_object, model.W_WordsObject):
+        raise PrimitiveFailedError
+    return w_object
+
+def stream_receiver(space, w_rcvr, size):
+    if not (isinstance(w_rcvr, model.W_PointersObject) and w_rcvr.size() >= size):
+        raise PrimitiveFailedError
+    return w_rcvr
+
+# ___________________________________________________________________________
+# Inflating
+
+# InflateStream instance variables, after those of ReadStream
+INFLATE_COLLECTION = 0
+INFLATE_READLIMIT = 2
+INFLATE_STATE = 3
+INFLATE_BITBUF = 4
+INFLATE_BITPOS = 5
+INFLATE_SOURCE = 6
+INFLATE_SOURCEPOS = 7
+INFLATE_SOURCELIMIT = 8
+INFLATE_INSTSIZE = 9
+
+STATE_NO_MORE_DATA = 1
+MAX_BITS = 16
+
+class Inflater(object):
+    """The state of a FastInflateStream. Positions are one-based like in the
+    image, sourcePos and readLimit are the indices of the last byte read and
+    written."""
+
+    def __init__(self, space, w_rcvr, w_lit_table, w_dist_table):
+        self.lit_table = w_object_words(w_lit_table)
+        self.dist_table = w_object_words(w_dist_table)
+        self.collection = fetch_bytes(space, w_rcvr, INFLATE_COLLECTION)
+        self.source = fetch_bytes(space, w_rcvr, INFLATE_SOURCE)
+        self.read_limit = fetch_int(space, w_rcvr, INFLATE_READLIMIT)
+        self.state = fetch_int(space, w_rcvr, INFLATE_STATE)
+        self.bit_buf = fetch_int(space, w_rcvr, INFLATE_BITBUF)
+        self.bit_pos = fetch_int(space, w_rcvr, INFLATE_BITPOS)
+        self.source_pos = fetch_int(space, w_rcvr, INFLATE_SOURCEPOS)
+        self.source_limit = fetch_int(space, w_rcvr, INFLATE_SOURCELIMIT)
+        if not (0 <= self.read_limit <= self.collection.size() and
+                0 <= self.source_pos and
+                self.source_limit <= self.source.size()):
+            raise PrimitiveFailedError
+
+    def store_back(self, space, w_rcvr):
+        store_int(space, w_rcvr, INFLATE_READLIMIT, self.read_limit)
+        store_int(space, w_rcvr, INFLATE_STATE, self.state)
+        store_int(space, w_rcvr, INFLATE_BITBUF, self.bit_buf)
+        store_int(space, w_rcvr, INFLATE_BITPOS, self.bit_pos)
+        store_int(space, w_rcvr, INFLATE_SOURCEPOS, self.source_pos)
+
+    def next_bits(self, n):
+        while self.bit_pos < n:
+            if self.source_pos >= self.source.size():
+                raise PrimitiveFailedError
+            byte = ord(self.source.getchar(self.source_pos))
+            self.source_pos += 1
+            self.bit_buf += byte << self.bit_pos
+            self.bit_pos += 8
+        bits = self.bit_buf & ((1 << n) - 1)
+        self.bit_buf >>= n
+        self.bit_pos -= n
+        return bits
+
+    def decode_value(self, w_table):
+        """InflateStream>>decodeValueFrom:, the tables hold the codes in
+        reverse bit order so that they can be looked up with nextBits:."""
+        size = w_table.size()
+        if size == 0:
+            raise PrimitiveFailedError
+        bits_needed = intmask(w_table.getword(0) >> 24)
+        table_index = 2
+        while True:
+            if bits_needed > MAX_BITS:
+                raise PrimitiveFailedError
+            index = table_index + self.next_bits(bits_needed) - 1
+            if not 0 <= index < size:
+                raise PrimitiveFailedError
+            value = intmask(w_table.getword(index))
+            if value & 0x3F000000 == 0:
+                return value
+            table_index = value & 0xFFFF
+            bits_needed = (value >> 24) & 0xFF
+
+    def decompress_block(self):
+        """FastInflateStream>>decompressBlock:with:"""
+        collection = self.collection
+        size = collection.size()
+        while self.read_limit < size and self.source_pos <= self.source_limit:
+            old_bits = self.bit_buf
+            old_bit_pos = self.bit_pos
+            old_pos = self.source_pos
+            value = self.decode_value(self.lit_table)
+            if value < 256:
+                collection.setchar(self.read_limit, chr(value))
+                self.read_limit += 1
+                continue
+            if value == 256:
+                self.state &= STATE_NO_MORE_DATA
+                return
+            extra = (value >> 16) - 1
+            length = value & 0xFFFF
+            if extra > 0:
+                length += self.next_bits(extra)
+            value = self.decode_value(self.dist_table)
+            extra = value >> 16
+            distance = value & 0xFFFF
+            if extra > 0:
+                distance += self.next_bits(extra)
+            if self.read_limit + length >= size:
+                self.bit_buf = old_bits
+                self.bit_pos = old_bit_pos
+                self.source_pos = old_pos
+                return
+            src = self.read_limit - distance
+            if src < 0:
+                raise PrimitiveFailedError
+            # byte by byte, the source may overlap what is written
+            for i in range(length):
+                collection.setchar(self.read_limit + i, collection.getchar(src + i))
+            self.read_limit += length
+
+@ZipPlugin.expose_primitive(unwrap_spec=[object, object, object])
+def primitiveInflateDecompressBlock(interp, s_frame, w_rcvr, w_lit_table, w_dist_table):
+    space = interp.space
+    w_rcvr = stream_receiver(space, w_rcvr, INFLATE_INSTSIZE)
+    inflater = Inflater(space, w_rcvr, w_lit_table, w_dist_table)
+    inflater.decompress_block()
+    inflater.store_back(space, w_rcvr)
+    return w_rcvr
+
+# ___________________________________________________________________________
+# Deflating
+
+# ZipWriteStream instance variables, after those of WriteStream
+DEFLATE_COLLECTION = 0
+DEFLATE_POSITION = 1
+DEFLATE_HASHHEAD = 4
+DEFLATE_HASHTAIL = 5
+DEFLATE_HASHVALUE = 6
+DEFLATE_BLOCKPOSITION = 7
+DEFLATE_LITERALS = 9
+DEFLATE_DISTANCES = 10
+DEFLATE_LITERALFREQ = 11
+DEFLATE_DISTANCEFREQ = 12
+DEFLATE_LITCOUNT = 13
+DEFLATE_MATCHCOUNT = 14
+DEFLATE_INSTSIZE = 15
+
+WINDOW_SIZE = 0x8000
+WINDOW_MASK = WINDOW_SIZE - 1
+MAX_DISTANCE = WINDOW_SIZE
+MIN_MATCH = 3
+MAX_MATCH = 258
+HASH_BITS = 15
+HASH_MASK = (1 << HASH_BITS) - 1
+HASH_SHIFT = (HASH_BITS + MIN_MATCH - 1) // MIN_MATCH
+NUM_LITERALS = 256
+LITERAL_FREQ_SIZE = 286
+DISTANCE_FREQ_SIZE = 30
+
+EXTRA_LENGTH_BITS = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2,
+                     3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0]
+EXTRA_DISTANCE_BITS = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6,
+                       7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13]
+
+def make_match_length_codes():
+    """The literal/length code for each match length - MIN_MATCH"""
+    codes = []
+    for code in range(len(EXTRA_LENGTH_BITS) - 1):
+        for n in range(1 << EXTRA_LENGTH_BITS[code]):
+            codes.append(NUM_LITERALS + 1 + code)
+    # a match of MAX_MATCH has a code of its own
+    codes[MAX_MATCH - MIN_MATCH] = NUM_LITERALS + len(EXTRA_LENGTH_BITS)
+    return codes
+
+def make_distance_codes():
+    """The distance code for distance - 1 below 256, for 256 + (distance - 1
+    >> 7) above."""
+    codes = []
+    for code in range(16):
+        for n in range(1 << EXTRA_DISTANCE_BITS[code]):
+            codes.append(code)
+    # distances up to 256 are covered above, (256 - 1) >> 7 is 1
+    codes.extend([0, 0])
+    for code in range(16, len(EXTRA_DISTANCE_BITS)):
+        for n in range(1 << (EXTRA_DISTANCE_BITS[code] - 7)):
+            codes.append(code)
+    return codes
+
+MATCH_LENGTH_CODES = make_match_length_codes()
+DISTANCE_CODES = make_distance_codes()
+
+def increment(w_words, index):
+    w_words.setword(index, w_words.getword(index) + 1)
+
+class Deflater(object):
+    """The state of a ZipWriteStream. Positions into the collection are
+    zero-based like in DeflateStream, the counts index the one-based literals
+    and distances."""
+
+    def __init__(self, space, w_rcvr):
+        self.collection = fetch_bytes(space, w_rcvr, DEFLATE_COLLECTION)
+        self.position = fetch_int(space, w_rcvr, DEFLATE_POSITION)
+        self.hash_head = fetch_words(space, w_rcvr, DEFLATE_HASHHEAD, HASH_MASK + 1)
+        self.hash_tail = fetch_words(space, w_rcvr, DEFLATE_HASHTAIL, WINDOW_SIZE)
+        self.hash_value = fetch_int(space, w_rcvr, DEFLATE_HASHVALUE)
+        self.block_position = fetch_int(space, w_rcvr, DEFLATE_BLOCKPOSITION)
+        self.literals = fetch_bytes(space, w_rcvr, DEFLATE_LITERALS)
+        self.distances = fetch_words(space, w_rcvr, DEFLATE_DISTANCES)
+        self.literal_freq = fetch_words(space, w_rcvr, DEFLATE_LITERALFREQ, LITERAL_FREQ_SIZE)
+        self.distance_freq = fetch_words(space, w_rcvr, DEFLATE_DISTANCEFREQ, DISTANCE_FREQ_SIZE)
+        self.lit_count = fetch_int(space, w_rcvr, DEFLATE_LITCOUNT)
+        self.match_count = fetch_int(space, w_rcvr, DEFLATE_MATCHCOUNT)
+        if not (self.distances.size() >= self.literals.size() and
+                0 <= self.lit_count <= self.literals.size() and
+                0 <= self.position <= self.collection.size()):
+            raise PrimitiveFailedError
+
+    def store_back(self, space, w_rcvr):
+        store_int(space, w_rcvr, DEFLATE_HASHVALUE, self.hash_value)
+        store_int(space, w_rcvr, DEFLATE_BLOCKPOSITION, self.block_position)
+        store_int(space, w_rcvr, DEFLATE_LITCOUNT, self.lit_count)
+        store_int(space, w_rcvr, DEFLATE_MATCHCOUNT, self.match_count)
+
+    def byte_at(self, index0):
+        if not 0 <= index0 < self.collection.size():
+            raise PrimitiveFailedError
+        return self.collection.getchar(index0)
+
+    def updated_hash(self, here):
+        """The running hash value including the byte at the one-based index
+        here, the receiver's hash value is not modified."""
+        byte = ord(self.byte_at(here - 1))
+        return ((self.hash_value << HASH_SHIFT) ^ byte) & HASH_MASK
+
+    def insert_string_at(self, here):
+        self.hash_value = self.updated_hash(here + MIN_MATCH)
+        prev_entry = self.hash_head.getword(self.hash_value)
+        self.hash_head.setword(self.hash_value, r_uint(here))
+        self.hash_tail.setword(here & WINDOW_MASK, prev_entry)
+
+    def compare(self, here, match_pos, min_length):
+        if self.byte_at(here + min_length) != self.byte_at(match_pos + min_length):
+            return 0
+        if self.byte_at(here) != self.byte_at(match_pos):
+            return 0
+        if self.byte_at(here + 1) != self.byte_at(match_pos + 1):
+            return 1
+        length = 3
+        while (length <= MAX_MATCH and
+               self.byte_at(here + length - 1) == self.byte_at(match_pos + length - 1)):
+            length += 1
+        return length - 1
+
+    def find_match(self, here, last_length, last_match, max_chain_length, good_match):
+        """DeflateStream>>findMatch:lastLength:lastMatch:chainLength:goodMatch:,
+        answers length << 16 | match position."""
+        match_result = (last_length << 16) | last_match
+        if last_length >= MAX_MATCH:
+            return match_result
+        match_pos = intmask(self.hash_head.getword(self.updated_hash(here + MIN_MATCH)))
+        distance = here - match_pos
+        if not 0 < distance < MAX_DISTANCE:
+            return match_result
+        chain_length = max_chain_length
+        if here > MAX_DISTANCE:
+            limit = here - MAX_DISTANCE
+        else:
+            limit = 0
+        best_length = last_length
+        while True:
+            length = self.compare(here, match_pos, best_length)
+            if here + length > self.position:
+                length = self.position - here
+            # ignore very small matches if they are too far away
+            if length == MIN_MATCH and here - match_pos > WINDOW_SIZE // 4:
+                length = MIN_MATCH - 1
+            if length > best_length:
+                match_result = (length << 16) | match_pos
+                best_length = length
+                if best_length >= MAX_MATCH:
+                    return match_result
+                if best_length > good_match:
+                    return match_result
+            chain_length -= 1
+            if chain_length <= 0:
+                return match_result
+            match_pos = intmask(self.hash_tail.getword(match_pos & WINDOW_MASK))
+            if match_pos <= limit:
+                return match_result
+
+    def should_flush(self):
+        if self.lit_count == self.literals.size():
+            return True
+        if self.lit_count & 0xFFF != 0:
+            return False
+        if self.match_count * 10 <= self.lit_count:
+            return False
+        n_lits = self.lit_count - self.match_count
+        if n_lits <= self.match_count:
+            return False
+        return n_lits * 4 <= self.match_count
+
+    def encode_literal(self, literal):
+        if self.lit_count >= self.literals.size():
+            raise PrimitiveFailedError
+        self.literals.setchar(self.lit_count, chr(literal))
+        self.distances.setword(self.lit_count, r_uint(0))
+        self.lit_count += 1
+        increment(self.literal_freq, literal)
+        return self.should_flush()
+
+    def encode_match(self, length, distance):
+        if self.lit_count >= self.literals.size():
+            raise PrimitiveFailedError
+        self.literals.setchar(self.lit_count, chr(length - MIN_MATCH))
+        self.distances.setword(self.lit_count, r_uint(distance))
+        self.lit_count += 1
+        self.match_count += 1
+        increment(self.literal_freq, MATCH_LENGTH_CODES[length - MIN_MATCH])
+        if distance < 257:
+            code = DISTANCE_CODES[distance - 1]
+        else:
+            code = DISTANCE_CODES[256 + ((distance - 1) >> 7)]
+        increment(self.distance_freq, code)
+        return self.should_flush()
+
+    def deflate_block(self, last_index, chain_length, good_match):
+        """DeflateStream>>deflateBlock:chainLength:goodMatch:, answers whether
+        the block has to be flushed."""
+        if self.block_position > last_index:
+            return False
+        has_match = False
+        here = self.block_position
+        here_match = here_length = 0
+        while here <= last_index:
+            if not has_match:
+                match_result = self.find_match(here, MIN_MATCH - 1, here,
+                                               chain_length, good_match)
+                self.insert_string_at(here)
+                here_match = match_result & 0xFFFF
+                here_length = match_result >> 16
+            match_result = self.find_match(here + 1, here_length, here_match,
+                                           chain_length, good_match)
+            new_match = match_result & 0xFFFF
+            new_length = match_result >> 16
+            if here_length >= new_length and here_length >= MIN_MATCH:
+                flush_needed = self.encode_match(here_length, here - here_match)
+                for i in range(here_length - 1):
+                    here += 1
+                    self.insert_string_at(here)
+                has_match = False
+                here += 1
+            else:
+                flush_needed = self.encode_literal(ord(self.byte_at(here)))
+                here += 1
+                if here <= last_index and not flush_needed:
+                    self.insert_string_at(here)
+                    has_match = True
+                    here_match = new_match
+                    here_length = new_length
+            if flush_needed:
+                self.block_position = here
+                return True
+        self.block_position = here
+        return False
+
+@ZipPlugin.expose_primitive(unwrap_spec=[object, int, int, int])
+def primitiveDeflateBlock(interp, s_frame, w_rcvr, last_index, chain_length, good_match):
+    space = interp.space
+    w_rcvr = stream_receiver(space, w_rcvr, DEFLATE_INSTSIZE)
+    deflater = Deflater(space, w_rcvr)
+    flush_needed = deflater.deflate_block(last_index, chain_length, good_match)
+    deflater.store_back(space, w_rcvr)
+    return space.wrap_bool(flush_needed)
@@ -3,7 +3,7 @@ import inspect
 import math
 import operator
 from spyvm import model, shadow
-from spyvm import constants, display
+from spyvm import constants, display, clock
 from spyvm.error import PrimitiveFailedError, \
     PrimitiveNotYetWrittenError
 from spyvm import wrapper
@@ -26,20 +26,56 @@ def assert_valid_index(space, n0, w_obj):
 # primitive functions.  Each primitive function takes two
 # arguments, an interp and an argument_count
 # completes, and returns a result, or throws a PrimitiveFailedError.
+#
+# Failing primitives are common (SmallInteger arithmetic overflowing into
+# LargeIntegers, unwrapping arguments of the wrong type, ...), so the
+# interpreter does not call these functions but their counterparts in
+# status_table. Those catch the PrimitiveFailedError and instead report the
+# failure by setting interp.primitive_failed, which the caller checks right
+# after the call. The argument checks of the unwrap_spec and primitives with
+# a result that answer None fail that way without raising at all.
 def make_failing(code):
     def raise_failing_default(interp, s_frame, argument_count, s_method=None):
         raise PrimitiveFailedError
     return raise_failing_default
 
+def fail_default(interp, s_frame, argument_count, s_method=None):
+    interp.primitive_failed = True
+    return None
+
+def status_from_raising(func):
+    """The status_table entry for a primitive function that raises."""
+    def status_func(interp, s_frame, argument_count, s_method=None):
+        try:
+            result = func(interp, s_frame, argument_count, s_method)
+        except PrimitiveFailedError:
+            interp.primitive_failed = True
+            return None
+        interp.primitive_failed = False
+        return result
+    return status_func
+
+def raising_from_status(status_func):
+    """The prim_table entry for a primitive function reporting its status."""
+    def func(interp, s_frame, argument_count, s_method=None):
+        result = status_func(interp, s_frame, argument_count, s_method)
+        if interp.primitive_failed:
+            interp.primitive_failed = False
+            raise PrimitiveFailedError
+        return result
+    return func
+
 # Squeak has primitives all the way up to 575
 # So all optional primitives will default to the bytecode implementation
 prim_table = [make_failing(i) for i in range(576)]
+status_table = [fail_default] * 576
 
 class PrimitiveHolder(object):
-    _immutable_fields_ = ["prim_table[*]"]
+    _immutable_fields_ = ["prim_table[*]", "status_table[*]"]
 
 prim_holder = PrimitiveHolder()
 prim_holder.prim_table = prim_table
+prim_holder.status_table = status_table
 # clean up namespace:
 del i
 prim_table_implemented_only = []
@@ -73,7 +109,9 @@ def expose_primitive(code, unwrap_spec=None, no_result=False,
             clean_stack=clean_stack, compiled_method=compiled_method
         )(func)
         wrapped.func_name = "wrap_prim_" + name
+        wrapped.status_func.func_name = "status_prim_" + name
         prim_table[code] = wrapped
+        status_table[code] = wrapped.status_func
         prim_table_implemented_only.append((code, wrapped))
         return func
     return decorator
@@ -94,15 +132,25 @@ def wrap_primitive(unwrap_spec=None, no_result=False,
     def decorator(func):
         if unwrap_spec is None:
             def wrapped(interp, s_frame, argument_count_m1, s_method=None):
-                if compiled_method:
-                    w_result = func(interp, s_frame, argument_count_m1, s_method)
-                else:
-                    w_result = func(interp, s_frame, argument_count_m1)
+                try:
+                    if compiled_method:
+                        w_result = func(interp, s_frame, argument_count_m1, s_method)
+                    else:
+                        w_result = func(interp, s_frame, argument_count_m1)
+                except PrimitiveFailedError:
+                    interp.primitive_failed = True
+                    return None
+                if not no_result and w_result is None:
+                    interp.primitive_failed = True
+                    return None
                 if result_is_new_frame:
-                    return interp.stack_frame(w_result, may_context_switch)
+                    s_new_frame = interp.stack_frame(w_result, may_context_switch)
+                    interp.primitive_failed = False
+                    return s_new_frame
                 if not no_result:
-                    assert w_result is not None
                     s_frame.push(w_result)
+                interp.primitive_failed = False
+                return None
         else:
             len_unwrap_spec = len(unwrap_spec)
             assert (len_unwrap_spec == len(inspect.getargspec(func)[0]) + 1,
@@ -113,55 +161,81 @@ def wrap_primitive(unwrap_spec=None, no_result=False,
                 assert argument_count == len_unwrap_spec
                 if s_frame.stackdepth() < len_unwrap_spec:
                     # XXX shouldn't this be a crash instead?
-                    raise PrimitiveFailedError()
+                    interp.primitive_failed = True
+                    return None
                 args = ()
-                for i, spec in unrolling_unwrap_spec:
-                    index = len_unwrap_spec - 1 - i
-                    w_arg = s_frame.peek(index)
-                    if spec is int:
-                        args += (interp.space.unwrap_int(w_arg), )
-                    elif spec is pos_32bit_int:
-                        args += (interp.space.unwrap_positive_32bit_int(w_arg),)
-                    elif spec is index1_0:
-                        args += (interp.space.unwrap_int(w_arg)-1, )
-                    elif spec is float:
-                        args += (interp.space.unwrap_float(w_arg), )
-                    elif spec is object:
-                        assert isinstance(w_arg, model.W_Object)
-                        args += (w_arg, )
-                    elif spec is str:
-                        assert isinstance(w_arg, model.W_BytesObject)
-                        args += (w_arg.as_string(), )
-                    elif spec is list:
-                        assert isinstance(w_arg, model.W_PointersObject)
-                        args += (interp.space.unwrap_array(w_arg), )
-                    elif spec is char:
-                        args += (unwrap_char(w_arg), )
-                    elif spec is bool:
-                        args += (interp.space.w_true is w_arg, )
+                try:
+                    for i, spec in unrolling_unwrap_spec:
+                        index = len_unwrap_spec - 1 - i
+                        w_arg = s_frame.peek(index)
+                        if spec is int:
+                            if isinstance(w_arg, model.W_SmallInteger):
+                                args += (w_arg.value, )
+                            elif not isinstance(w_arg, model.W_LargePositiveInteger1Word):
+                                interp.primitive_failed = True
+                                return None
+                            else:
+                                args += (interp.space.unwrap_int(w_arg), )
+                        elif spec is pos_32bit_int:
+                            args += (interp.space.unwrap_positive_32bit_int(w_arg),)
+                        elif spec is index1_0:
+                            if isinstance(w_arg, model.W_SmallInteger):
+                                args += (w_arg.value - 1, )
+                            elif not isinstance(w_arg, model.W_LargePositiveInteger1Word):
+                                interp.primitive_failed = True
+                                return None
+                            else:
+                                args += (interp.space.unwrap_int(w_arg) - 1, )
+                        elif spec is float:
+                            args += (interp.space.unwrap_float(w_arg), )
+                        elif spec is object:
+                            assert isinstance(w_arg, model.W_Object)
+                            args += (w_arg, )
+                        elif spec is str:
+                            assert isinstance(w_arg, model.W_BytesObject)
+                            args += (w_arg.as_string(), )
+                        elif spec is list:
+                            assert isinstance(w_arg, model.W_PointersObject)
+                            args += (interp.space.unwrap_array(w_arg), )
+                        elif spec is char:
+                            args += (unwrap_char(w_arg), )
+                        elif spec is bool:
+                            args += (interp.space.w_true is w_arg, )
+                        else:
+                            raise NotImplementedError(
+                                "unknown unwrap_spec %s" % (spec, ))
+                    if result_is_new_frame:
+                        s_new_frame = func(interp, s_frame, *args)
                     else:
-                        raise NotImplementedError(
-                            "unknown unwrap_spec %s" % (spec, ))
+                        w_result = func(interp, s_frame, *args)
+                except PrimitiveFailedError:
+                    interp.primitive_failed = True
+                    return None
                 if result_is_new_frame:
-                    s_new_frame = func(interp, s_frame, *args)
                     # After calling primitive, reload context-shadow in case it
                     # needs to be updated
                     if clean_stack:
                         # happens only if no exception occurs!
                         s_frame.pop_n(len_unwrap_spec)
-                    return interp.stack_frame(s_new_frame, may_context_switch)
-                else:
-                    w_result = func(interp, s_frame, *args)
-                    # After calling primitive, reload context-shadow in case it
-                    # needs to be updated
-                    if clean_stack:
-                        # happens only if no exception occurs!
-                        s_frame.pop_n(len_unwrap_spec)
-                    if not no_result:
-                        assert w_result is not None
-                        assert isinstance(w_result, model.W_Object)
-                        s_frame.push(w_result)
-        return wrapped
+                    s_new_frame = interp.stack_frame(s_new_frame, may_context_switch)
+                    interp.primitive_failed = False
+                    return s_new_frame
+                if not no_result and w_result is None:
+                    interp.primitive_failed = True
+                    return None
+                # After calling primitive, reload context-shadow in case it
+                # needs to be updated
+                if clean_stack:
+                    # happens only if no exception occurs!
+                    s_frame.pop_n(len_unwrap_spec)
+                if not no_result:
+                    assert isinstance(w_result, model.W_Object)
+                    s_frame.push(w_result)
+                interp.primitive_failed = False
+                return None
+        compat = raising_from_status(wrapped)
+        compat.status_func = wrapped
+        return compat
     return decorator
 
 # ___________________________________________________________________________
@@ -192,7 +266,7 @@ for (code,op) in math_ops.items():
             try:
                 res = rarithmetic.ovfcheck(op(receiver, argument))
             except OverflowError:
-                raise PrimitiveFailedError()
+                return None # fails, the image continues with LargeIntegers
             return interp.space.wrap_int(res)
     make_func(op)
 
@@ -213,30 +287,30 @@ for (code,op) in bitwise_binary_ops.items():
 @expose_primitive(DIVIDE, unwrap_spec=[int, int])
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
-        raise PrimitiveFailedError()
+        return None
     if receiver % argument != 0:
-        raise PrimitiveFailedError()
+        return None
     return interp.space.wrap_int(receiver // argument)
 
 # #\\ -- return the remainder of a division
 @expose_primitive(MOD, unwrap_spec=[int, int])
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
-        raise PrimitiveFailedError()
+        return None
     return interp.space.wrap_int(receiver % argument)
 
 # #// -- return the result of a division, rounded towards negative infinity
 @expose_primitive(DIV, unwrap_spec=[int, int])
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
-        raise PrimitiveFailedError()
+        return None
     return interp.space.wrap_int(receiver // argument)
 
 # #// -- return the result of a division, rounded towards negative infinite
 @expose_primitive(QUO, unwrap_spec=[int, int])
 def func(interp, s_frame, receiver, argument):
     if argument == 0:
-        raise PrimitiveFailedError()
+        return None
     res = receiver // argument
     # see http://python-history.blogspot.de/2010/08/why-pythons-integer-division-floors.html
     if res < 0 and not abs(receiver) == abs(argument):
@@ -628,6 +702,13 @@ def func(interp, s_frame, w_rcvr):
     w_point.store(interp.space, 1, interp.space.wrap_int(y))
     return w_point
 
+@expose_primitive(INPUT_SEMAPHORE, unwrap_spec=[object, int])
+def func(interp, s_frame, w_rcvr, index):
+    # the index of a Semaphore in the ExternalObjectsArray, signaled when input
+    # arrives so the image does not need to poll for events
+    interp.input_semaphore_index = index
+    return w_rcvr
+
 @jit.unroll_safe
 @jit.look_inside
 @expose_primitive(GET_NEXT_EVENT, unwrap_spec=[object, object])
@@ -654,11 +735,34 @@ def func(interp, s_frame, argcount, s_method):
         if w_dest_form.is_same_object(interp.space.objtable['w_display']):
             w_bitmap = w_dest_form.fetch(interp.space, 0)
             assert isinstance(w_bitmap, model.W_DisplayBitmap)
-            w_bitmap.flush_to_screen()
+            w_bitmap.display.invalidate_all()
     except shadow.MethodNotFound:
         from spyvm.plugins.bitblt import BitBltPlugin
         BitBltPlugin.call("primitiveCopyBits", interp, s_frame, argcount, s_method)
 
+@expose_primitive(SNAPSHOT, unwrap_spec=[object])
+def func(interp, s_frame, w_rcvr):
+    from spyvm import squeakimage
+    space = interp.space
+    # The written image resumes in the active process right after this send
+    # and answers true, the running image continues and answers false.
+    process = wrapper.ProcessWrapper(space, wrapper.scheduler(space).active_process())
+    s_frame.pop()
+    s_frame.push(space.w_true)
+    process.store_suspended_context(s_frame.w_self())
+    path = squeakimage.snapshot_path(interp.image_name)
+    try:
+        writer = squeakimage.ImageWriter(space, interp.image)
+        writer.write(path)
+        interp.image_name = path
+    except (OSError, squeakimage.UnsupportedImageError):
+        raise PrimitiveFailedError
+    finally:
+        process.store_suspended_context(space.w_nil)
+        s_frame.pop()
+        s_frame.push(w_rcvr)
+    return space.w_false
+
 @expose_primitive(BE_CURSOR)
 def func(interp, s_frame, argcount):
     if not (0 <= argcount <= 1):
@@ -729,6 +833,7 @@ def func(interp, s_frame, w_rcvr):
         sdldisplay = w_bitmap.display
         sdldisplay.set_video_mode(width, height, depth)
         w_display_bitmap = w_bitmap
+        w_display_bitmap.attach()
     else:
         assert isinstance(w_bitmap, model.W_WordsObject)
         w_display_bitmap = w_bitmap.as_display_bitmap(
@@ -755,7 +860,9 @@ def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
     repOff := repStart - start.
     index := start - 1.
     [(index := index + 1) <= stop]
-        whileTrue: [self at: index put: (replacement at: repOff + index)]"""
+        whileTrue: [self at: index put: (replacement at: repOff + index)]
+    Overlapping ranges within the same object are copied forward like the
+    Smalltalk code above, not like memmove."""
     if (start < 0 or start - 1 > stop or repStart < 0):
         raise PrimitiveFailedError()
     # This test deliberately test for equal W_Object class. The Smalltalk classes
@@ -765,6 +872,8 @@ def func(interp, s_frame, w_rcvr, start, stop, w_replacement, repStart):
     if (w_rcvr.size() - w_rcvr.instsize(interp.space) <= stop
             or w_replacement.size() - w_replacement.instsize(interp.space) <= repStart + (stop - start)):
         raise PrimitiveFailedError()
+    if w_rcvr.replace_from_to(interp.space, start, stop, w_replacement, repStart):
+        return w_rcvr
     repOff = repStart - start
     for i0 in range(start, stop + 1):
         w_rcvr.atput0(interp.space, i0, w_replacement.at0(interp.space, repOff + i0))
@@ -869,41 +978,95 @@ def func(interp, s_frame, w_arg, w_rcvr):
 
     w_rcvr.s_class = w_arg.s_class
 
-@expose_primitive(EXTERNAL_CALL, clean_stack=False, no_result=True, compiled_method=True)
-def func(interp, s_frame, argcount, s_method):
-    space = interp.space
+class ExternalPrimitive(object):
+    """A named primitive, resolved once and cached on the CompiledMethodShadow.
+    Either func is a plugin primitive, or signature names a function in an
+    external module, or neither is set and the primitive always fails."""
+    _immutable_fields_ = ["func", "signature"]
+
+    def __init__(self, func=None, signature=None):
+        self.func = func
+        self.signature = signature
+
+    def call(self, interp, s_frame, argcount, s_method):
+        if self.func is not None:
+            return self.func(interp, s_frame, argcount, s_method)
+        if self.signature is not None:
+            from spyvm.interpreter_proxy import IProxy
+            return IProxy.call(self.signature, interp, s_frame, argcount, s_method)
+        raise PrimitiveFailedError
+
+failing_external_primitive = ExternalPrimitive()
+
+def resolve_external_primitive(space, s_method):
     w_description = s_method.w_self().literalat0(space, 1)
     if not isinstance(w_description, model.W_PointersObject) or w_description.size() < 2:
-        raise PrimitiveFailedError
+        return failing_external_primitive
     w_modulename = w_description.at0(space, 0)
     w_functionname = w_description.at0(space, 1)
     if not (isinstance(w_modulename, model.W_BytesObject) and
             isinstance(w_functionname, model.W_BytesObject)):
-        raise PrimitiveFailedError
+        return failing_external_primitive
     signature = (w_modulename.as_string(), w_functionname.as_string())
 
     if signature[0] == 'BitBltPlugin':
         from spyvm.plugins.bitblt import BitBltPlugin
-        return BitBltPlugin.call(signature[1], interp, s_frame, argcount, s_method)
+        func = BitBltPlugin._find_prim(signature[1])
+    elif signature[0] == "B2DPlugin":
+        from spyvm.plugins.b2dplugin import B2DPlugin
+        func = B2DPlugin._find_prim(signature[1])
     elif signature[0] == "SocketPlugin":
         from spyvm.plugins.socket import SocketPlugin
-        return SocketPlugin.call(signature[1], interp, s_frame, argcount, s_method)
+        func = SocketPlugin._find_prim(signature[1])
     elif signature[0] == "FilePlugin":
         from spyvm.plugins.fileplugin import FilePlugin
-        return FilePlugin.call(signature[1], interp, s_frame, argcount, s_method)
+        func = FilePlugin._find_prim(signature[1])
+    elif signature[0] == "FloatArrayPlugin":
+        from spyvm.plugins.floatarrayplugin import FloatArrayPlugin
+        func = FloatArrayPlugin._find_prim(signature[1])
+    elif signature[0] == "HashedCollectionPlugin":
+        from spyvm.plugins.hashedcollection import HashedCollectionPlugin
+        func = HashedCollectionPlugin._find_prim(signature[1])
+    elif signature[0] == "LargeIntegers":
+        from spyvm.plugins.largeintegers import LargeIntegersPlugin
+        func = LargeIntegersPlugin._find_prim(signature[1])
+    elif signature[0] == "MiscPrimitivePlugin":
+        from spyvm.plugins.miscprimitiveplugin import MiscPrimitivePlugin
+        func = MiscPrimitivePlugin._find_prim(signature[1])
+    elif signature[0] == "NumberPlugin":
+        from spyvm.plugins.numberplugin import NumberPlugin
+        func = NumberPlugin._find_prim(signature[1])
+    elif signature[0] == "UTF8Plugin":
+        from spyvm.plugins.utf8plugin import UTF8Plugin
+        func = UTF8Plugin._find_prim(signature[1])
+    elif signature[0] == "ZipPlugin":
+        from spyvm.plugins.zipplugin import ZipPlugin
+        func = ZipPlugin._find_prim(signature[1])
     elif signature[0] == "VMDebugging":
         from spyvm.plugins.vmdebugging import DebuggingPlugin
-        return DebuggingPlugin.call(signature[1], interp, s_frame, argcount, s_method)
+        func = DebuggingPlugin._find_prim(signature[1])
     else:
-        from spyvm.interpreter_proxy import IProxy
-        return IProxy.call(signature, interp, s_frame, argcount, s_method)
-    raise PrimitiveFailedError
+        return ExternalPrimitive(signature=signature)
+    if func is None:
+        return failing_external_primitive
+    return ExternalPrimitive(func=func)
+
+@expose_primitive(EXTERNAL_CALL, clean_stack=False, no_result=True, compiled_method=True)
+def func(interp, s_frame, argcount, s_method):
+    # Like Squeak's external primitive table, the lookup (or its failure) is
+    # remembered until the method is changed or flushed.
+    external = s_method.external_primitive
+    if external is None:
+        external = resolve_external_primitive(interp.space, s_method)
+        s_method.external_primitive = external
+    return external.call(interp, s_frame, argcount, s_method)
 
 @expose_primitive(COMPILED_METHOD_FLUSH_CACHE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
     if not isinstance(w_rcvr, model.W_CompiledMethod):
         raise PrimitiveFailedError()
     s_cm = w_rcvr.as_compiledmethod_get_shadow(interp.space)
+    s_cm.external_primitive = None
     w_class = s_cm.w_compiledin
     if w_class:
         assert isinstance(w_class, model.W_PointersObject)
@@ -953,7 +1116,12 @@ def func(interp, s_frame, w_receiver, flag):
 
 @expose_primitive(DRAW_RECTANGLE, unwrap_spec=[object, int, int, int, int])
 def func(interp, s_frame, w_rcvr, left, right, top, bottom):
-    raise PrimitiveNotYetWrittenError()
+    if not w_rcvr.is_same_object(interp.space.objtable['w_display']):
+        raise PrimitiveFailedError
+    sdldisplay = interp.space.get_display()
+    sdldisplay.invalidate(left, top, right, bottom)
+    sdldisplay.flush_damage(force=True)
+    return w_rcvr
 
 
 # ___________________________________________________________________________
@@ -1045,6 +1213,19 @@ def func(interp, s_frame, w_arg):
     sec_since_1901 = sec_since_epoch + secs_between_1901_and_1970
     return interp.space.wrap_uint(sec_since_1901)
 
+#____________________________________________________________________________
+# Microsecond Clock Primitives (240 - 241)
+UTC_MICROSECOND_CLOCK = 240
+LOCAL_MICROSECOND_CLOCK = 241
+
+@expose_primitive(UTC_MICROSECOND_CLOCK, unwrap_spec=[object])
+def func(interp, s_frame, w_arg):
+    return interp.space.wrap_positive_64bit_int(clock.utc_microseconds())
+
+@expose_primitive(LOCAL_MICROSECOND_CLOCK, unwrap_spec=[object])
+def func(interp, s_frame, w_arg):
+    return interp.space.wrap_positive_64bit_int(clock.local_microseconds())
+
 
 #____________________________________________________________________________
 # Misc Primitives (138 - 149)
@@ -1083,9 +1264,10 @@ def func(interp, s_frame, w_arg, new_value):
     if isinstance(w_arg, model.W_BytesObject):
         if new_value > 255:
             raise PrimitiveFailedError
-        for i in xrange(w_arg.size()):
-            w_arg.setchar(i, chr(new_value))
-    elif isinstance(w_arg, model.W_WordsObject) or isinstance(w_arg, model.W_DisplayBitmap):
+        w_arg.fill(chr(new_value))
+    elif isinstance(w_arg, model.W_WordsObject):
+        w_arg.fill(rarithmetic.r_uint(new_value))
+    elif isinstance(w_arg, model.W_DisplayBitmap):
         for i in xrange(w_arg.size()):
             w_arg.setword(i, new_value)
     else:
@@ -1346,10 +1528,10 @@ def func(interp, s_frame, w_rcvr, w_selector, args_w):
     code = s_method.primitive()
     if code:
         s_frame.push_all(args_w)
-        try:
-            return s_frame._call_primitive(code, interp, argcount, s_method, w_selector)
-        except PrimitiveFailedError:
-            pass # ignore this error and fall back to the Smalltalk version
+        s_new_frame = s_frame._call_primitive(code, interp, argcount, s_method, w_selector)
+        if not interp.primitive_failed:
+            return s_new_frame
+        # fall back to the Smalltalk version
     s_new_frame = s_method.create_frame(interp.space, w_rcvr, args_w, s_frame)
     s_frame.pop()
     return interp.stack_frame(s_new_frame)
@@ -1496,6 +1678,9 @@ CTXT_SIZE = 212
 prim_table[CTXT_AT] = prim_table[AT]
 prim_table[CTXT_AT_PUT] = prim_table[AT_PUT]
 prim_table[CTXT_SIZE] = prim_table[SIZE]
+status_table[CTXT_AT] = status_table[AT]
+status_table[CTXT_AT_PUT] = status_table[AT_PUT]
+status_table[CTXT_SIZE] = status_table[SIZE]
 # ___________________________________________________________________________
 # Drawing
 
@@ -1504,18 +1689,16 @@ FORCE_DISPLAY_UPDATE = 231
 
 @expose_primitive(IDLE_FOR_MICROSECONDS, unwrap_spec=[object, int], no_result=True, clean_stack=False)
 def func(interp, s_frame, w_rcvr, time_mu_s):
-    import time
     s_frame.pop()
-    time_s = time_mu_s / 1000000.0
     interp.interrupt_check_counter = 0
     interp.quick_check_for_interrupt(s_frame, dec=0)
-    time.sleep(time_s)
+    interp.idle(time_mu_s)
     interp.interrupt_check_counter = 0
     interp.quick_check_for_interrupt(s_frame, dec=0)
 
 @expose_primitive(FORCE_DISPLAY_UPDATE, unwrap_spec=[object])
 def func(interp, s_frame, w_rcvr):
-    interp.space.get_display().flip(force=True)
+    interp.space.get_display().flush_damage(force=True)
     return w_rcvr
 
 # ___________________________________________________________________________
@@ -1031,7 +1031,7 @@ class CompiledMethodShadow(object):
               "literals", "bytecodeoffset",
               "literalsize", "_tempsize", "_primitive",
               "argsize", "islarge",
-              "w_compiledin", "version"]
+              "w_compiledin", "version", "external_primitive"]
     _immutable_fields_ = ["version?", "_w_self"]
 
     def __init__(self, w_compiledmethod):
@@ -1067,6 +1067,8 @@ class CompiledMethodShadow(object):
         self.argsize = w_compiledmethod.argsize
         self.islarge = w_compiledmethod.islarge
         self.literals = w_compiledmethod.literals
+        # resolved lazily by the EXTERNAL_CALL primitive
+        self.external_primitive = None
 
         self.w_compiledin = None
         if self.literals:
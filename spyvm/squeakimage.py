@@ -2,11 +2,13 @@ import py
 import os
 import sys
 import time
-from spyvm import constants
+from spyvm import constants, clock
 from spyvm import model
 from spyvm.tool.bitmanipulation import splitter
 
 from rpython.rlib import objectmodel
+from rpython.rlib.rarithmetic import intmask, r_uint
+from rpython.rtyper.lltypesystem import rffi
 
 def chrs2int(b):
     assert len(b) == 4
@@ -59,9 +61,11 @@ class Stream(object):
         self.reset()
 
     def peek(self):
-        if self.pos >= len(self.data):
+        if self.pos + self.word_size > len(self.data):
             raise IndexError
-        data_peek = self.data[self.pos:self.pos + self.word_size]
+        return self.decode_word(self.data[self.pos:self.pos + self.word_size])
+
+    def decode_word(self, data_peek):
         if self.use_long_read:
             if self.swap:
                 return swapped_chrs2long(data_peek)
@@ -123,16 +127,113 @@ class CorruptImageError(Exception):
 class UnsupportedImageError(Exception):
     pass
 
+GZIP_MAGIC = "\x1f\x8b"
+XZ_MAGIC = "\xfd7zXZ\x00"
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+
+class GzipStream(Stream):
+    """ Input stream over a gzip-compressed image file. The file is
+    inflated chunk by chunk as the reader asks for more words, and consumed
+    data is dropped, so neither the compressed nor the inflated image is
+    ever held in memory as a whole. """
+
+    def __init__(self, inputfile, chunk_size=64 * 1024):
+        from rpython.rlib import rzlib
+        self.inputfile = inputfile
+        self.chunk_size = chunk_size
+        # +16 makes zlib expect and skip the gzip header
+        self.zstream = rzlib.inflateInit(rzlib.MAX_WBITS | 16)
+        self.finished = False
+        self.closed = False
+        # gzip stores the inflated size (modulo 2**32) in the last 4 bytes
+        inputfile.seek(-4, 2)
+        self.size = swapped_chrs2int(inputfile.read(4))
+        inputfile.seek(0, 0)
+        self.data = ""
+        # position of data[0] in the inflated image
+        self.offset = 0
+        self.reset()
+
+    def peek(self):
+        start = self.pos - self.offset
+        if start + self.word_size > len(self.data):
+            self.fill(start + self.word_size)
+            start = self.pos - self.offset
+        return self.decode_word(self.data[start:start + self.word_size])
+
+    def fill(self, end):
+        """ Inflate until data holds at least end bytes, dropping what was
+        consumed if that is more than a chunk. """
+        from rpython.rlib import rzlib
+        start = self.pos - self.offset
+        assert 0 <= start <= len(self.data)
+        if start >= self.chunk_size:
+            self.data = self.data[start:]
+            self.offset = self.pos
+            end -= start
+        parts = [self.data]
+        available = len(self.data)
+        while available < end:
+            if self.finished:
+                raise IndexError
+            compressed = self.inputfile.read(self.chunk_size)
+            if not compressed:
+                raise CorruptImageError("Truncated gzip image")
+            inflated, self.finished, _ = rzlib.decompress(self.zstream, compressed)
+            parts.append(inflated)
+            available += len(inflated)
+        self.data = "".join(parts)
+
+    def reset(self):
+        # only the beginning of the image is ever re-read, see
+        # version_from_stream
+        assert self.offset == 0
+        Stream.reset(self)
+
+    def skipbytes(self, jump):
+        assert jump > 0
+        self.fill(self.pos - self.offset + jump)
+        self.pos += jump
+        self.count += jump
+
+    def length(self):
+        return self.size
+
+    def close(self):
+        from rpython.rlib import rzlib
+        if not self.closed:
+            self.closed = True
+            rzlib.inflateEnd(self.zstream)
+            self.inputfile.close()
+
+def stream_for_file(inputfile):
+    """ Answer a Stream over the image in inputfile, a streamio stream,
+    inflating it while reading if it is gzip-compressed. """
+    magic = inputfile.read(len(XZ_MAGIC))
+    inputfile.seek(0, 0)
+    if magic.startswith(GZIP_MAGIC):
+        return GzipStream(inputfile)
+    if magic == XZ_MAGIC or magic.startswith(ZSTD_MAGIC):
+        inputfile.close()
+        raise UnsupportedImageError("xz and zstd compressed images are not "
+                                    "supported, decompress the image first")
+    try:
+        return Stream(data=inputfile.readall())
+    finally:
+        inputfile.close()
+
 # ____________________________________________________________
 
 class ImageVersion(object):
 
-    def __init__(self, magic, is_big_endian, is_64bit, has_closures, has_floats_reversed):
+    def __init__(self, magic, is_big_endian, is_64bit, has_closures,
+                 has_floats_reversed, is_spur=False):
         self.magic = magic
         self.is_big_endian = is_big_endian
         self.is_64bit = is_64bit
         self.has_closures = has_closures
         self.has_floats_reversed = has_floats_reversed
+        self.is_spur = is_spur
 
 image_versions = {
     0x00001966:         ImageVersion(6502,  True,  False, False, False),
@@ -142,6 +243,13 @@ image_versions = {
     0x00001969:         ImageVersion(6505,  True,  False, True,  True ),
     0x69190000:         ImageVersion(6505,  False, False, True,  True ),
     0x00000000000109A0: ImageVersion(68000, True,  True,  False, False),
+    # Spur object memory, recognized only to be rejected
+    0x00001979:         ImageVersion(6521,  True,  False, True,  True,  True),
+    0x79190000:         ImageVersion(6521,  False, False, True,  True,  True),
+    0x0000197B:         ImageVersion(6523,  True,  False, True,  True,  True),
+    0x7B190000:         ImageVersion(6523,  False, False, True,  True,  True),
+    0x00000000000109B3: ImageVersion(68019, True,  True,  True,  True,  True),
+    0x00000000000109B5: ImageVersion(68021, True,  True,  True,  True,  True),
 }
 
 if sys.maxint == 2 ** 63 - 1:
@@ -157,6 +265,12 @@ if sys.maxint == 2 ** 63 - 1:
    -0x5cf6ff0000000000:
     # signed version of 0xA309010000000000:
                         ImageVersion(68003, False, True,  True,  True ),
+   -0x4cf6ff0000000000:
+    # signed version of 0xB309010000000000:
+                        ImageVersion(68019, False, True,  True,  True,  True),
+   -0x4af6ff0000000000:
+    # signed version of 0xB509010000000000:
+                        ImageVersion(68021, False, True,  True,  True,  True),
 })
 
 
@@ -164,6 +278,8 @@ def version(magic):
     ver = image_versions.get(magic, None)
     if ver is None:
         raise CorruptImageError
+    if ver.is_spur:
+        raise UnsupportedImageError("Spur images are not supported")
     # if ver.is_64bit or ver.has_floats_reversed:
     #     raise UnsupportedImageError
     return ver
@@ -213,24 +329,46 @@ class ImageReader(object):
         self.space = space
         self.stream = stream
         self.version = version
-        # dictionary mapping old address to chunk object
-        self.chunks = {}
+        # 4 or 8, see version_from_stream
+        self.word_size = stream.word_size
+        # old addresses of all chunks, in the order they were read. Objects
+        # are laid out in ascending address order in the image, so this
+        # list is sorted and parallel to chunklist.
+        self.addresses = []
         self.chunklist = []
         # cache wrapper integers
         self.intcache = {}
+        # (phase name, seconds) for each loading phase
+        self.timings = []
 
         self.lastWindowSize = 0
 
     def initialize(self):
         # XXX should be called something like read_full_image
+        t0 = time.time()
         self.read_header()
         self.read_body()
         self.init_compactclassesarray()
+        t1 = time.time()
         # until here, the chunks are generated
-        self.init_g_objects()
         self.init_w_objects()
+        t2 = time.time()
         self.fillin_w_objects()
+        t3 = time.time()
         self.synchronize_shadows()
+        t4 = time.time()
+        self.timings = [("read", t1 - t0), ("allocate", t2 - t1),
+                        ("fillin", t3 - t2), ("shadows", t4 - t3)]
+        self.report_timings()
+
+    def report_timings(self):
+        total = 0.0
+        parts = []
+        for name, seconds in self.timings:
+            total += seconds
+            parts.append("%s %dms" % (name, int(seconds * 1000)))
+        os.write(2, "\nLoaded %d objects in %dms (%s)\n" % (
+            len(self.chunklist), int(total * 1000), ", ".join(parts)))
 
     def read_version(self):
         # 1 word version
@@ -257,26 +395,57 @@ class ImageReader(object):
         self.stream.skipbytes(headersize - self.stream.pos)
 
     def read_body(self):
-        import sys
         self.stream.reset_count()
         while self.stream.count < self.endofmemory:
             chunk, pos = self.read_object()
             if len(self.chunklist) % 1000 == 0: os.write(2,'#')
             self.chunklist.append(chunk)
-            self.chunks[pos + self.oldbaseaddress] = chunk
+            self.addresses.append(pos + self.oldbaseaddress)
         self.stream.close()
         self.swap = self.stream.swap #save for later
         self.stream = None
         return self.chunklist # return for testing
 
-    def init_g_objects(self):
-        for chunk in self.chunks.itervalues():
-            chunk.as_g_object(self) # initialized g_object
+    def chunk_index(self, address):
+        """ Bisect the sorted address table for the chunk at address.
+        Returns -1 if there is no object starting at that address. """
+        addresses = self.addresses
+        lo = 0
+        hi = len(addresses)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if addresses[mid] < address:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(addresses) and addresses[lo] == address:
+            return lo
+        return -1
+
+    def chunk_at(self, address):
+        index = self.chunk_index(address)
+        if index < 0:
+            raise CorruptImageError("No object at address %d" % address)
+        return self.chunklist[index]
+
+    def decode_pointer(self, pointer):
+        if (pointer & 1) == 1:
+            value = pointer >> 1
+            if value in self.intcache:
+                return self.intcache[value]
+            w_int = self.space.wrap_int(value)
+            self.intcache[value] = w_int
+            return w_int
+        w_object = self.chunk_at(pointer).w_object
+        assert w_object is not None
+        return w_object
 
     def init_w_objects(self):
         self.assign_prebuilt_constants()
-        for chunk in self.chunks.itervalues():
-            chunk.g_object.init_w_object()
+        for chunk in self.chunklist:
+            chunk.init_class(self)
+        for chunk in self.chunklist:
+            chunk.init_w_object()
 
     def assign_prebuilt_constants(self):
         # assign w_objects for objects that are already in objtable
@@ -297,29 +466,29 @@ class ImageReader(object):
                    raise Warning('Object found in multiple places in the special objects array')
 
     def special_object(self, index):
-        special = self.chunks[self.specialobjectspointer].g_object.pointers
-        return special[index]
+        special = self.chunk_at(self.specialobjectspointer)
+        return self.chunk_at(special.data[index])
 
     def fillin_w_objects(self):
-        for chunk in self.chunks.itervalues():
-            chunk.g_object.w_object.fillin(self.space, chunk.g_object)
+        for chunk in self.chunklist:
+            chunk.w_object.fillin(self.space, chunk)
 
     def synchronize_shadows(self):
-        for chunk in self.chunks.itervalues():
-            casted = chunk.g_object.w_object
+        for chunk in self.chunklist:
+            casted = chunk.w_object
             if isinstance(casted, model.W_PointersObject) and casted.has_shadow():
                 casted._shadow.update()
 
     def init_compactclassesarray(self):
         """ from the blue book (CompiledMethod Symbol Array PseudoContext LargePositiveInteger nil MethodDictionary Association Point Rectangle nil TranslatedMethod BlockContext MethodContext nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil nil ) """
-        special = self.chunks[self.specialobjectspointer]
+        special = self.chunk_at(self.specialobjectspointer)
         assert special.size > 24 #at least
         assert special.format == 2
         # squeak-specific: compact classes array
-        chunk = self.chunks[special.data[COMPACT_CLASSES_ARRAY]]
+        chunk = self.chunk_at(special.data[COMPACT_CLASSES_ARRAY])
         assert len(chunk.data) == 31
         assert chunk.format == 2
-        self.compactclasses = [self.chunks[pointer] for pointer in chunk.data]
+        self.compactclasses = [self.chunk_at(pointer) for pointer in chunk.data]
 
     def read_object(self):
         kind = self.stream.peek() & 3 # 2 bits
@@ -332,6 +501,7 @@ class ImageReader(object):
         else: # 10 bits
             raise CorruptImageError("Unused block not allowed in image")
         size = chunk.size
+        chunk.reader = self
         chunk.data = [self.stream.next()
                      for _ in range(size - 1)] #size-1, excluding header
         return chunk, pos
@@ -340,23 +510,36 @@ class ImageReader(object):
         kind, size, format, classid, idhash = (
             splitter[2,6,4,5,12](self.stream.next()))
         assert kind == 3
-        return ImageChunk(self.space, size, format, classid, idhash), self.stream.count - 4
+        return self.make_chunk(size, size, format, classid, idhash)
 
     def read_2wordobjectheader(self):
         assert self.stream.peek() & 3 == 1 #kind
         classid = self.stream.next() - 01 # remove headertype to get pointer
         kind, size, format, _, idhash = splitter[2,6,4,5,12](self.stream.next())
         assert kind == 1
-        return ImageChunk(self.space, size, format, classid, idhash), self.stream.count - 4
+        return self.make_chunk(size, size, format, classid, idhash)
 
     def read_3wordobjectheader(self):
         kind, size = splitter[2,30](self.stream.next())
         assert kind == 0
         assert splitter[2](self.stream.peek())[0] == 0 #kind
         classid = self.stream.next() - 00 # remove headertype to get pointer
-        kind, _, format, _, idhash = splitter[2,6,4,5,12](self.stream.next())
+        kind, sizebits, format, _, idhash = splitter[2,6,4,5,12](self.stream.next())
         assert kind == 0
-        return ImageChunk(self.space, size, format, classid, idhash), self.stream.count - 4
+        return self.make_chunk(size, sizebits, format, classid, idhash)
+
+    def make_chunk(self, size, sizebits, format, classid, idhash):
+        """ size is the object size in units of 4 bytes, sizebits the size
+        field of the base header. Answer the chunk and the position of its
+        base header. """
+        if self.word_size == 4:
+            chunk = ImageChunk(self.space, size, format, classid, idhash)
+        else:
+            # 64-bit images flag objects whose last 4 bytes are unused with
+            # the lowest size bit (Size4Bit), objects are 8 byte aligned
+            chunk = ImageChunk(self.space, size >> 1, format, classid, idhash)
+            chunk.odd_half = (sizebits & 1) == 1
+        return chunk, self.stream.count - self.word_size
 
 
 # ____________________________________________________________
@@ -365,9 +548,9 @@ class SqueakImage(object):
 
     def from_reader(self, space, reader):
         from spyvm import constants
-        self.special_objects = [g_object.w_object for g_object in
-                                reader.chunks[reader.specialobjectspointer]
-                                .g_object.pointers]
+        special = reader.chunk_at(reader.specialobjectspointer)
+        self.w_special_objects = special.w_object
+        self.special_objects = special.get_pointers()
 
         for name, idx in constants.objects_in_special_object_table.items():
             space.objtable["w_" + name] = self.special_objects[idx]
@@ -375,10 +558,11 @@ class SqueakImage(object):
         self.w_asSymbol = self.find_symbol(space, reader, "asSymbol")
         self.w_simulateCopyBits = self.find_symbol(space, reader, "simulateCopyBits")
         self.lastWindowSize = reader.lastWindowSize
+        self.oldbaseaddress = reader.oldbaseaddress
         self.version = reader.version
         self.is_modern = reader.version.magic > 6502
         self.run_spy_hacks(space)
-        self.startup_time = int(time.time() * 1000)
+        self.startup_time = clock.monotonic_microseconds()
 
     def run_spy_hacks(self, space):
         pass
@@ -396,7 +580,7 @@ class SqueakImage(object):
         w_obj = None
         # bit annoying that we have to hunt through the image :-(
         for chunk in reader.chunklist:
-            w_obj = chunk.g_object.w_object
+            w_obj = chunk.w_object
             if not isinstance(w_obj, model.W_BytesObject):
                 continue
             if not w_obj.getclass(space).is_same_object(w_Symbol):
@@ -416,84 +600,62 @@ COMPACT_CLASSES_ARRAY = 28
 
 # ____________________________________________________________
 
-class GenericObject(object):
-    """ Intermediate representation of squeak objects. To establish all
-        pointers as object references, ImageReader creates instances of
-        GenericObject from the image chunks, and uses them as starting
-        point for the actual create of spyvm.model classes.
-        """
+class ImageChunk(object):
+    """ A chunk knows the information from the header and the raw body
+    words of one object in the image. The reader allocates the matching
+    W_Object for every chunk in one pass, then fills the objects in from
+    their chunks in a second pass, resolving pointers through the
+    reader's sorted address table. """
 
-    def __init__(self, space):
+    def __init__(self, space, size, format, classid, hash12):
         self.space = space
+        self.size = size
+        self.format = format
+        self.classid = classid
+        self.hash12 = hash12
+        # list of integers forming the body of the object
+        self.data = None
         self.reader = None
+        self.class_chunk = None
+        self.w_object = None
+        # only in 64-bit images: the last 4 bytes of the body are unused
+        self.odd_half = False
+
+    def __eq__(self, other):
+        "(for testing)"
+        return (self.__class__ is other.__class__ and
+                self.format == other.format and
+                self.classid == other.classid and
+                self.hash12 == other.hash12 and
+                self.data == other.data)
 
-    def isinitialized(self):
-        return self.reader is not None
+    def __ne__(self, other):
+        "(for testing)"
+        return not self == other
 
-    def initialize_int(self, value, reader):
-        self.reader = reader
-        self.value = value
-        self.size = -1
-        if value in reader.intcache:
-            w_int = reader.intcache[value]
-        else:
-            w_int = self.space.wrap_int(value)
-            reader.intcache[value] = w_int
-        self.w_object = w_int
-
-    def initialize(self, chunk, reader):
-        self.reader = reader
-        self.size = chunk.size
-        self.hash12 = chunk.hash12
-        self.format = chunk.format
-        self.chunk = chunk # for bytes, words and compiledmethod
-        self.init_class()
-        self.init_data() # for pointers
-        self.w_object = None
+    def iscompact(self):
+        return 0 < self.classid < 32
 
-    def init_class(self):
-        if self.chunk.iscompact():
-            self.g_class = self.reader.compactclasses[self.chunk.classid
-                - 1].g_object # Smalltalk is 1-based indexed
+    def init_class(self, reader):
+        if self.iscompact():
+            # Smalltalk is 1-based indexed
+            self.class_chunk = reader.compactclasses[self.classid - 1]
         else:
-            self.g_class = self.reader.chunks[self.chunk.classid].g_object
-
-    def init_data(self):
-        if self.ispointers():
-            self.pointers = self.decode_pointers()
-            assert None not in self.pointers
-        elif self.iscompiledmethod():
-            header = self.chunk.data[0] >> 1 # untag tagged int
-            _, literalsize, _, _, _ = constants.decode_compiled_method_header(header)
-            self.pointers = self.decode_pointers(literalsize + 1) # adjust +1 for the header
-
-    def decode_pointers(self, end=-1):
-        if end == -1:
-            end = len(self.chunk.data)
-        pointers = []
-        for i in range(end):
-            pointer = self.chunk.data[i]
-            if (pointer & 1) == 1:
-                small_int = GenericObject(self.space)
-                small_int.initialize_int(pointer >> 1, self.reader)
-                pointers.append(small_int)
-            else:
-                pointers.append(self.reader.chunks[pointer].g_object)
-        return pointers
+            self.class_chunk = reader.chunk_at(self.classid)
 
     def isbytes(self):
         return 8 <= self.format <= 11
 
     def is32bitlargepositiveinteger(self):
         return (self.format == 8 and
-                self.space.w_LargePositiveInteger.is_same_object(self.g_class.w_object) and
+                self.space.w_LargePositiveInteger.is_same_object(self.class_chunk.w_object) and
                 len(self.get_bytes()) <= 4)
 
     def iswords(self):
         return self.format == 6
 
     def isfloat(self):
-        return self.iswords() and self.space.w_Float.is_same_object(self.g_class.w_object)
+        return self.iswords() and self.space.w_Float.is_same_object(self.class_chunk.w_object)
 
     def ispointers(self):
         return self.format < 5 #TODO, what about compiled methods?
@@ -543,70 +705,528 @@ class GenericObject(object):
 
     def get_bytes(self):
         bytes = []
-        if self.reader.swap:
-            for each in self.chunk.data:
+        if self.reader.word_size == 8:
+            self.append_bytes64(bytes)
+        elif self.reader.swap:
+            for each in self.data:
                 bytes.append(chr((each >> 0) & 0xff))
                 bytes.append(chr((each >> 8) & 0xff))
                 bytes.append(chr((each >> 16) & 0xff))
                 bytes.append(chr((each >> 24) & 0xff))
         else:
-            for each in self.chunk.data:
+            for each in self.data:
                 bytes.append(chr((each >> 24) & 0xff))
                 bytes.append(chr((each >> 16) & 0xff))
                 bytes.append(chr((each >> 8) & 0xff))
                 bytes.append(chr((each >> 0) & 0xff))
         stop = len(bytes) - (self.format & 3)
+        if self.odd_half:
+            stop -= 4
         assert stop >= 0
         return bytes[:stop] # omit odd bytes
 
+    def append_bytes64(self, bytes):
+        if self.reader.swap:
+            for each in self.data:
+                for shift in range(0, 64, 8):
+                    bytes.append(chr((each >> shift) & 0xff))
+        else:
+            for each in self.data:
+                for shift in range(56, -8, -8):
+                    bytes.append(chr((each >> shift) & 0xff))
+
     def get_ruints(self, required_len=-1):
         from rpython.rlib.rarithmetic import r_uint
-        words = [r_uint(x) for x in self.chunk.data]
+        if self.reader.word_size == 8:
+            words = self.get_ruints64()
+        else:
+            words = [r_uint(x) for x in self.data]
         if required_len != -1 and len(words) != required_len:
             raise CorruptImageError("Expected %d words, got %d" % (required_len, len(words)))
         return words
 
+    def get_ruints64(self):
+        """ Split the 64-bit words into 32-bit words in memory order. """
+        from rpython.rlib.rarithmetic import r_uint
+        words = []
+        for each in self.data:
+            high = r_uint(each) >> 32
+            low = r_uint(each) & r_uint(0xffffffff)
+            if self.reader.swap:
+                words.append(low)
+                words.append(high)
+            else:
+                words.append(high)
+                words.append(low)
+        if self.odd_half:
+            words.pop()
+        return words
+
     def get_pointers(self):
-        assert self.pointers is not None
-        return [g_object.w_object for g_object in self.pointers]
+        if self.iscompiledmethod():
+            header = self.data[0] >> 1 # untag tagged int
+            _, literalsize, _, _, _ = constants.decode_compiled_method_header(header)
+            end = literalsize + 1 # adjust +1 for the header
+        else:
+            assert self.ispointers()
+            end = len(self.data)
+        reader = self.reader
+        return [reader.decode_pointer(self.data[i]) for i in range(end)]
 
     def get_class(self):
-        w_class = self.g_class.w_object
+        w_class = self.class_chunk.w_object
         assert isinstance(w_class, model.W_PointersObject)
         return w_class
 
     def get_hash(self):
-        return self.chunk.hash12
+        return self.hash12
 
 
-class ImageChunk(object):
-    """ A chunk knows the information from the header, but the body of the
-    object is not decoded yet."""
-    def __init__(self, space, size, format, classid, hash12):
-        self.size = size
-        self.format = format
-        self.classid = classid
-        self.hash12 = hash12
-        # list of integers forming the body of the object
-        self.data = None
-        self.g_object = GenericObject(space)
+# ____________________________________________________________
+#
+# Writes all model objects reachable from the special objects array
+# back into an image file
 
-    def __eq__(self, other):
-        "(for testing)"
-        return (self.__class__ is other.__class__ and
-                self.format == other.format and
-                self.classid == other.classid and
-                self.hash12 == other.hash12 and
-                self.data == other.data)
+def _identity_eq(w_a, w_b):
+    return w_a is w_b
 
-    def __ne__(self, other):
-        "(for testing)"
-        return not self == other
+def _identity_hash(w_obj):
+    return objectmodel.compute_identity_hash(w_obj)
 
-    def as_g_object(self, reader):
-        if not self.g_object.isinitialized():
-            self.g_object.initialize(self, reader)
-        return self.g_object
+def _header_word(kind, size, format, classid, hash12):
+    # inverse of splitter[2,6,4,5,12]
+    return kind | (size << 2) | (format << 8) | (classid << 12) | (hash12 << 17)
 
-    def iscompact(self):
-        return 0 < self.classid < 32
+IMAGE_HEADER_SIZE = 64
+
+def snapshot_path(image_name):
+    """ The file a snapshot of the image loaded from image_name is written
+    to. Snapshots are never compressed, so the snapshot of a gzip-compressed
+    image is written next to it without the .gz suffix. """
+    if image_name.endswith(".gz"):
+        stop = len(image_name) - len(".gz")
+        assert stop >= 0
+        return image_name[:stop]
+    return image_name
+
+class ImageWriter(object):
+    """ Writes the objects reachable from the special objects array as a
+    32-bit big endian image. Objects are laid out in the order they are
+    traced; each gets a one-word header if its class is compact and its
+    body is small, a two-word header if only the body is small, and a
+    three-word header otherwise. """
+
+    def __init__(self, space, image):
+        self.space = space
+        self.image = image
+        if image.version.is_64bit:
+            if image.version.has_closures:
+                magic = 6504
+            else:
+                magic = 6502
+        else:
+            magic = image.version.magic
+        # the magic numbers of the 32-bit formats are their big endian keys
+        self.version = version(magic)
+        self.oldbaseaddress = image.oldbaseaddress
+        self.objects_w = []
+        # parallel to objects_w
+        self.formats = []
+        self.bodysizes = []
+        self.addresses = objectmodel.r_dict(_identity_eq, _identity_hash)
+        self.compactclasses = objectmodel.r_dict(_identity_eq, _identity_hash)
+        # SmallIntegers of the VM that do not fit 31 bits, by value, and the
+        # LargeIntegers they are written as
+        self.largeintegers = {}
+        self.w_specialobjects = None
+        self.endofmemory = 0
+
+    def write(self, filename):
+        """ Write to a temporary file next to filename and rename it over
+        filename, so a failed write never leaves a truncated file behind.
+        Raises OSError. """
+        from rpython.rlib.streamio import open_file_as_stream
+        data = self.write_to_string()
+        tmpname = filename + ".tmp"
+        try:
+            f = open_file_as_stream(tmpname, mode="wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmpname, filename)
+        except OSError:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise
+
+    def write_to_string(self):
+        from rpython.rlib.rstring import StringBuilder
+        self.trace(self.special_objects_array())
+        self.layout()
+        builder = StringBuilder(IMAGE_HEADER_SIZE + self.endofmemory)
+        self.write_header(builder)
+        for i in range(len(self.objects_w)):
+            self.write_object(builder, i)
+        return builder.build()
+
+    def special_objects_array(self):
+        space = self.space
+        w_specialobjects = self.image.w_special_objects
+        # the VM keeps some special objects up to date only in the objtable
+        for name, so_index in constants.objects_in_special_object_table.items():
+            w_object = space.objtable["w_" + name]
+            if w_object is not None:
+                w_specialobjects.atput0(space, so_index, w_object)
+        self.w_specialobjects = w_specialobjects
+        w_compactclasses = w_specialobjects.at0(space, COMPACT_CLASSES_ARRAY)
+        for i in range(w_compactclasses.size()):
+            w_class = w_compactclasses.fetch(space, i)
+            if not w_class.is_same_object(space.w_nil):
+                # Smalltalk is 1-based indexed
+                self.compactclasses[w_class] = i + 1
+        return self.w_specialobjects
+
+    def trace(self, w_root):
+        self.enqueue(w_root)
+        i = 0
+        while i < len(self.objects_w):
+            w_object = self.objects_w[i]
+            self.enqueue(w_object.getclass(self.space))
+            for w_pointer in self.pointers_of(w_object):
+                self.enqueue(w_pointer)
+            i += 1
+
+    def enqueue(self, w_object):
+        if isinstance(w_object, model.W_SmallInteger):
+            if not _fits_tagged(w_object.value):
+                self.enqueue(self.large_integer(w_object.value))
+            return
+        if w_object in self.addresses:
+            return
+        self.addresses[w_object] = 0 # assigned by layout()
+        format, bodysize = self.describe(w_object)
+        self.objects_w.append(w_object)
+        self.formats.append(format)
+        self.bodysizes.append(bodysize)
+
+    def large_integer(self, value):
+        """ The LargePositiveInteger or LargeNegativeInteger a SmallInteger
+        of the VM is written as, the same object for the same value. """
+        w_large = self.largeintegers.get(value, None)
+        if w_large is not None:
+            return w_large
+        if value < 0:
+            # old images like mini.image do not have the class in the
+            # special objects array
+            w_specialobjects = self.image.w_special_objects
+            if w_specialobjects.size() <= constants.SO_LARGENEGATIVEINTEGER_CLASS:
+                raise UnsupportedImageError("No LargeNegativeInteger class for %d" % value)
+            w_class = w_specialobjects.at0(self.space, constants.SO_LARGENEGATIVEINTEGER_CLASS)
+            magnitude = r_uint(0) - r_uint(value)
+        else:
+            w_class = self.space.w_LargePositiveInteger
+            magnitude = r_uint(value)
+        bytes = []
+        while magnitude != 0:
+            bytes.append(chr(intmask(magnitude & 0xff)))
+            magnitude >>= 8
+        w_large = model.W_BytesObject(self.space, w_class, len(bytes))
+        for i in range(len(bytes)):
+            w_large.setchar(i, bytes[i])
+        self.largeintegers[value] = w_large
+        return w_large
+
+    def pointers_of(self, w_object):
+        space = self.space
+        if isinstance(w_object, model.W_AbstractPointersObject):
+            return [w_object.fetch(space, i) for i in range(w_object.size())]
+        elif isinstance(w_object, model.W_CompiledMethod):
+            return w_object.literals
+        return []
+
+    def describe(self, w_object):
+        """ Answer the format and the number of body words (excluding the
+        header) that w_object is written with. See
+        ImageChunk.init_w_object for the formats. """
+        from spyvm import shadow
+        if isinstance(w_object, model.W_AbstractPointersObject):
+            size = w_object.size()
+            s_class = w_object.shadow_of_my_class(self.space)
+            if s_class.instance_kind == shadow.WEAK_POINTERS:
+                format = 4
+            elif s_class.isvariable():
+                if s_class.instsize() > 0:
+                    format = 3
+                else:
+                    format = 2
+            elif size > 0:
+                format = 1
+            else:
+                format = 0
+            return format, size
+        elif isinstance(w_object, model.W_Float):
+            return 6, 2
+        elif isinstance(w_object, model.W_MappingDisplayBitmap):
+            # the buffer is widened to the native depth, the words are not
+            size = w_object.size() * w_object._depth / model.NATIVE_DEPTH
+            return 6, size
+        elif (isinstance(w_object, model.W_WordsObject) or
+                isinstance(w_object, model.W_DisplayBitmap)):
+            return 6, w_object.size()
+        elif (isinstance(w_object, model.W_BytesObject) or
+                isinstance(w_object, model.W_LargePositiveInteger1Word)):
+            size = w_object.size()
+            return 8 | ((4 - size % 4) % 4), (size + 3) / 4
+        elif isinstance(w_object, model.W_CompiledMethod):
+            size = (w_object.literalsize + 1) * 4 + len(w_object.bytes)
+            return 12 | ((4 - size % 4) % 4), (size + 3) / 4
+        raise UnsupportedImageError("Cannot write %s" % w_object)
+
+    def header_size(self, i):
+        if self.bodysizes[i] + 1 >= 64:
+            return 3
+        if self.compact_index(self.objects_w[i]) > 0:
+            return 1
+        return 2
+
+    def compact_index(self, w_object):
+        return self.compactclasses.get(w_object.getclass(self.space), 0)
+
+    def layout(self):
+        pos = 0
+        for i in range(len(self.objects_w)):
+            # the address of an object is that of its base header word
+            pos += (self.header_size(i) - 1) * 4
+            self.addresses[self.objects_w[i]] = self.oldbaseaddress + pos
+            pos += (self.bodysizes[i] + 1) * 4
+        self.endofmemory = pos
+
+    def encode_pointer(self, w_object):
+        if isinstance(w_object, model.W_SmallInteger):
+            value = w_object.value
+            if not _fits_tagged(value):
+                return self.addresses[self.largeintegers[value]]
+            return (value << 1) | 1
+        return self.addresses[w_object]
+
+    def write_header(self, builder):
+        _put_word(builder, self.version.magic)
+        _put_word(builder, IMAGE_HEADER_SIZE)
+        _put_word(builder, self.endofmemory)
+        _put_word(builder, self.oldbaseaddress)
+        _put_word(builder, self.addresses[self.w_specialobjects])
+        _put_word(builder, 0) # last hash
+        _put_word(builder, self.image.lastWindowSize)
+        _put_word(builder, 0) # full screen flag
+        _put_word(builder, 0) # extra VM memory
+        for _ in range(9 * 4, IMAGE_HEADER_SIZE):
+            builder.append("\x00")
+
+    def write_object(self, builder, i):
+        w_object = self.objects_w[i]
+        format = self.formats[i]
+        size = self.bodysizes[i] + 1 # including the base header
+        hash12 = w_object.gethash() & 0xfff
+        classid = self.compact_index(w_object)
+        headersize = self.header_size(i)
+        if headersize == 1:
+            _put_word(builder, _header_word(3, size, format, classid, hash12))
+        else:
+            w_class = w_object.getclass(self.space)
+            if headersize == 2:
+                _put_word(builder, self.addresses[w_class] | 1)
+                _put_word(builder, _header_word(1, size, format, 0, hash12))
+            else:
+                _put_word(builder, size << 2)
+                _put_word(builder, self.addresses[w_class])
+                _put_word(builder, _header_word(0, 0, format, classid, hash12))
+        self.write_body(builder, w_object, size - 1)
+
+    def write_body(self, builder, w_object, bodysize):
+        if isinstance(w_object, model.W_AbstractPointersObject):
+            for w_pointer in self.pointers_of(w_object):
+                _put_word(builder, self.encode_pointer(w_pointer))
+        elif isinstance(w_object, model.W_Float):
+            from rpython.rlib.rstruct.ieee import float_pack
+            bits = float_pack(w_object.value, 8)
+            high = intmask(bits >> 32)
+            low = intmask(bits & 0xffffffff)
+            if self.version.has_floats_reversed:
+                low, high = high, low
+            _put_word(builder, high)
+            _put_word(builder, low)
+        elif (isinstance(w_object, model.W_WordsObject) or
+                isinstance(w_object, model.W_DisplayBitmap)):
+            for n in range(bodysize):
+                _put_word(builder, intmask(w_object.getword(n)))
+        elif isinstance(w_object, model.W_BytesObject):
+            _put_bytes(builder, [w_object.getchar(n)
+                                 for n in range(w_object.size())])
+        elif isinstance(w_object, model.W_LargePositiveInteger1Word):
+            value = r_uint(w_object.value)
+            _put_bytes(builder, [chr(intmask((value >> (n * 8)) & 0xff))
+                                 for n in range(w_object.size())])
+        elif isinstance(w_object, model.W_CompiledMethod):
+            _put_word(builder, (w_object.getheader() << 1) | 1)
+            for w_literal in w_object.literals:
+                _put_word(builder, self.encode_pointer(w_literal))
+            _put_bytes(builder, w_object.bytes)
+        else:
+            assert 0, "not reachable"
+
+def _fits_tagged(value):
+    return constants.TAGGED_MININT <= value <= constants.TAGGED_MAXINT
+
+def _put_word(builder, word):
+    # big endian
+    word = r_uint(word)
+    builder.append(chr(intmask((word >> 24) & 0xff)))
+    builder.append(chr(intmask((word >> 16) & 0xff)))
+    builder.append(chr(intmask((word >> 8) & 0xff)))
+    builder.append(chr(intmask(word & 0xff)))
+
+def _put_bytes(builder, bytes):
+    for byte in bytes:
+        builder.append(byte)
+    for _ in range((4 - len(bytes) % 4) % 4):
+        builder.append("\x00")
+
+# ____________________________________________________________
+#
+# Fast-start cache: the object graph of an image, already traced and with
+# classes and pointers resolved to object indices, written next to the
+# image after it was loaded once
+
+CACHE_MAGIC = 0x53505943 # "SPYC"
+CACHE_FORMAT_VERSION = 2
+# the image is read in chunks of this many bytes for its stamp
+STAMP_CHUNK_SIZE = 64 * 1024
+
+def image_cache_path(path):
+    return path + ".spycache"
+
+def _signed32(value):
+    # as read back by Stream.next()
+    return intmask(rffi.cast(rffi.INT, value))
+
+def image_stamp(path):
+    """ Answer the size, modification time and a hash over the contents of
+    the image at path, as read back from a cache file. The whole image is
+    hashed, so an image rewritten with the same size within the same second
+    is told apart too. Raises OSError. """
+    from rpython.rlib.streamio import open_file_as_stream
+    st = os.stat(path)
+    # FNV-1a
+    hash = r_uint(0x811c9dc5)
+    f = open_file_as_stream(path, mode="rb", buffering=0)
+    try:
+        while True:
+            data = f.read(STAMP_CHUNK_SIZE)
+            if not data:
+                break
+            for c in data:
+                hash = (hash ^ r_uint(ord(c))) * r_uint(0x01000193)
+    finally:
+        f.close()
+    return [_signed32(st.st_size), _signed32(int(st.st_mtime)), _signed32(hash)]
+
+def reader_for_cache(space, stream, stamp):
+    """ Answer a reader for the cache in stream, or None if it is not a
+    cache of the image with the given stamp. """
+    if stream.length() < 5 * 4:
+        return None
+    if stream.next() != CACHE_MAGIC or stream.next() != CACHE_FORMAT_VERSION:
+        return None
+    for expected in stamp:
+        if stream.next() != expected:
+            return None
+    try:
+        ver = version(stream.next())
+    except CorruptImageError:
+        return None
+    return ImageCacheReader(space, stream, ver)
+
+class ImageCacheReader(ImageReader):
+    """ Reads a cache file written by ImageCacheWriter. Every object has a
+    fixed header of its class index, format, hash and body size, and
+    pointers are tagged SmallIntegers or object indices shifted by one, so
+    neither header decoding, compact classes nor address lookups are
+    needed. """
+
+    def read_header(self):
+        # magic, format version, stamp and image version were checked by
+        # reader_for_cache
+        self.objectcount = self.stream.next()
+        self.specialobjectspointer = self.stream.next()
+        self.lastWindowSize = self.stream.next()
+        self.oldbaseaddress = self.stream.next()
+
+    def read_body(self):
+        stream = self.stream
+        for _ in range(self.objectcount):
+            classindex = stream.next()
+            format = stream.next()
+            hash = stream.next()
+            bodysize = stream.next()
+            chunk = ImageChunk(self.space, bodysize + 1, format, classindex, hash)
+            chunk.reader = self
+            chunk.data = [stream.next() for _ in range(bodysize)]
+            self.chunklist.append(chunk)
+        self.stream.close()
+        self.swap = self.stream.swap
+        self.stream = None
+        return self.chunklist
+
+    def chunk_index(self, pointer):
+        index = pointer >> 1
+        if pointer & 1 == 0 and 0 <= index < len(self.chunklist):
+            return index
+        return -1
+
+    def init_compactclassesarray(self):
+        # classes are stored as object indices
+        self.compactclasses = []
+
+    def init_w_objects(self):
+        self.assign_prebuilt_constants()
+        for chunk in self.chunklist:
+            chunk.class_chunk = self.chunklist[chunk.classid]
+        for chunk in self.chunklist:
+            chunk.init_w_object()
+
+class ImageCacheWriter(ImageWriter):
+    """ Writes the same objects as ImageWriter in the layout read by
+    ImageCacheReader, stamped with the image it was loaded from. """
+
+    def __init__(self, space, image, stamp):
+        ImageWriter.__init__(self, space, image)
+        self.stamp = stamp
+
+    def layout(self):
+        pos = 0
+        for i in range(len(self.objects_w)):
+            self.addresses[self.objects_w[i]] = i << 1
+            pos += (4 + self.bodysizes[i]) * 4
+        self.endofmemory = pos
+
+    def write_header(self, builder):
+        _put_word(builder, CACHE_MAGIC)
+        _put_word(builder, CACHE_FORMAT_VERSION)
+        for word in self.stamp:
+            _put_word(builder, word)
+        _put_word(builder, self.version.magic)
+        _put_word(builder, len(self.objects_w))
+        _put_word(builder, self.addresses[self.w_specialobjects])
+        _put_word(builder, self.image.lastWindowSize)
+        _put_word(builder, self.oldbaseaddress)
+
+    def write_object(self, builder, i):
+        w_object = self.objects_w[i]
+        _put_word(builder, self.addresses[w_object.getclass(self.space)] >> 1)
+        _put_word(builder, self.formats[i])
+        _put_word(builder, w_object.gethash())
+        _put_word(builder, self.bodysizes[i])
+        self.write_body(builder, w_object, self.bodysizes[i])
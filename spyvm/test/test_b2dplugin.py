@@ -0,0 +1,272 @@
+from functools import partial
+
+from rpython.rlib.rarithmetic import r_uint
+
+from spyvm import model
+from spyvm.plugins import b2dplugin
+from spyvm.plugins.b2dplugin import B2DPlugin
+from spyvm.plugins.floatarrayplugin import float_to_word
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+RED = 0xFFFF0000
+BLUE = 0xFF0000FF
+
+call = partial(plugin_call, B2DPlugin)
+call_fails = partial(plugin_call_fails, B2DPlugin)
+
+def words(values):
+    w_words = model.W_WordsObject(space, space.w_Bitmap, len(values))
+    for i in range(len(values)):
+        w_words.setword(i, r_uint(values[i]))
+    return w_words
+
+def point(x, y):
+    w_point = model.W_PointersObject(space, space.w_Point, 2)
+    w_point.store(space, 0, space.wrap_int(x))
+    w_point.store(space, 1, space.wrap_int(y))
+    return w_point
+
+def form(width, height, depth=32, bits=None):
+    w_form = model.W_PointersObject(space, space.w_Array, 5)
+    w_form.store(space, 0, words(bits or [0] * (width * height)))
+    w_form.store(space, 1, space.wrap_int(width))
+    w_form.store(space, 2, space.wrap_int(height))
+    w_form.store(space, 3, space.wrap_int(depth))
+    w_form.store(space, 4, point(0, 0))
+    return w_form
+
+def engine(width=8, height=8, aa_level=1):
+    w_dest = form(width, height)
+    w_bitblt = model.W_PointersObject(space, space.w_Array, 15)
+    w_bitblt.store(space, 0, w_dest)
+    w_engine = model.W_PointersObject(space, space.w_Array, 4)
+    w_engine.store(space, b2dplugin.BE_WORKBUFFER, words([0] * 16))
+    w_engine.store(space, b2dplugin.BE_BITBLT, w_bitblt)
+    call("primitiveInitializeBuffer", [w_engine, w_engine.fetch(space, 0)])
+    call("primitiveSetAALevel", [w_engine, aa_level])
+    return w_engine, w_dest
+
+def fill(value):
+    return space.wrap_uint(r_uint(value))
+
+def flush(w_engine):
+    assert call("primitiveFinishedProcessing", [w_engine]) is space.w_false
+    assert call("primitiveRenderImage", [w_engine, space.w_nil, space.w_nil]).value == 0
+    assert call("primitiveFinishedProcessing", [w_engine]) is space.w_true
+
+def pixels(w_form):
+    width = space.unwrap_int(w_form.fetch(space, 1))
+    w_bits = w_form.fetch(space, 0)
+    rows = []
+    for y in range(space.unwrap_int(w_form.fetch(space, 2))):
+        rows.append([int(w_bits.getword(y * width + x)) for x in range(width)])
+    return rows
+
+def test_initialize_buffer():
+    w_engine, w_dest = engine()
+    w_buffer = w_engine.fetch(space, 0)
+    assert w_buffer.getword(0) == b2dplugin.WB_MAGIC
+    handle = w_buffer.getword(1)
+    call("primitiveInitializeBuffer", [w_engine, w_buffer])
+    assert w_buffer.getword(1) == handle
+    assert call("primitiveGetAALevel", [w_engine]).value == 1
+    assert call("primitiveFinishedProcessing", [w_engine]) is space.w_true
+    w_other = model.W_PointersObject(space, space.w_Array, 4)
+    w_other.store(space, 0, words([0] * 16))
+    call_fails("primitiveFinishedProcessing", [w_other])
+    call_fails("primitiveInitializeBuffer", [w_other, words([0])])
+
+def test_buffer_of_another_session():
+    w_engine, w_dest = engine()
+    w_buffer = w_engine.fetch(space, 0)
+    handle = w_buffer.getword(b2dplugin.WB_HANDLE)
+    # as saved in an image by an earlier session
+    w_buffer.setword(b2dplugin.WB_SESSION, w_buffer.getword(b2dplugin.WB_SESSION) ^ 2)
+    call_fails("primitiveFinishedProcessing", [w_engine])
+    call("primitiveInitializeBuffer", [w_engine, w_buffer])
+    assert w_buffer.getword(b2dplugin.WB_HANDLE) != handle
+    assert w_buffer.getword(b2dplugin.WB_SESSION) == b2dplugin.engines.session_id()
+    assert call("primitiveFinishedProcessing", [w_engine]) is space.w_true
+
+def test_states_of_collected_buffers_are_dropped():
+    import gc
+    w_engine, w_dest = engine()
+    w_old = w_engine.fetch(space, 0)
+    w_new = words([0] * 32)
+    call("primitiveCopyBuffer", [w_engine, w_old, w_new])
+    w_engine.store(space, 0, w_new)
+    del w_old
+    for i in range(10):
+        engine()
+    gc.collect()
+    engine()
+    # only states of buffers still alive are left
+    states = b2dplugin.engines.states.values()
+    assert len(states) < 10
+    assert None not in [state.buffer_ref() for state in states]
+    assert [state.buffer_ref() for state in states].count(w_new) == 1
+    assert call("primitiveFinishedProcessing", [w_engine]) is space.w_true
+
+def test_rect():
+    w_engine, w_dest = engine()
+    call("primitiveAddRect", [w_engine, point(2, 1), point(5, 3), fill(RED), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    for y in range(8):
+        for x in range(8):
+            expected = RED if 2 <= x < 5 and 1 <= y < 3 else 0
+            assert rows[y][x] == expected
+
+def test_rect_with_border_and_clip():
+    w_engine, w_dest = engine()
+    w_clip = model.W_PointersObject(space, space.w_Array, 2)
+    w_clip.store(space, 0, point(0, 0))
+    w_clip.store(space, 1, point(8, 6))
+    call("primitiveSetClipRect", [w_engine, w_clip])
+    call("primitiveAddRect", [w_engine, point(1, 1), point(7, 7), fill(RED), 2, fill(BLUE)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[3][3] == RED
+    assert rows[1][1] == BLUE
+    assert rows[3][0] == BLUE
+    assert rows[0][4] == BLUE
+    assert rows[6] == [0] * 8
+    w_result = call("primitiveGetClipRect", [w_engine, model.W_PointersObject(space, space.w_Array, 2)])
+    assert w_result.fetch(space, 1).fetch(space, 1).value == 6
+
+def test_antialiased_polygon():
+    w_engine, w_dest = engine(aa_level=4)
+    # a triangle covering the lower left half of the square 0@0 to 4@4
+    w_points = words([0, 0, 4, 4, 0, 4])
+    call("primitiveAddPolygon", [w_engine, w_points, 3, fill(0xFFFFFFFF), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[2][0] == 0xFFFFFFFF
+    assert rows[0][3] == 0
+    diagonal = rows[1][1]
+    assert 0 < diagonal >> 24 < 255
+    assert diagonal >> 24 == diagonal & 0xFF
+
+def test_short_point_array_and_offset():
+    w_engine, w_dest = engine()
+    call("primitiveSetOffset", [w_engine, point(4, 0)])
+    w_points = words([0 | 0 << 16, 2 | 0 << 16, 2 | 2 << 16, 0 | 2 << 16])
+    call("primitiveAddPolygon", [w_engine, w_points, 4, fill(RED), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[0] == [0, 0, 0, 0, RED, RED, 0, 0]
+    assert rows[2] == [0] * 8
+    assert call("primitiveGetOffset", [w_engine]).fetch(space, 0).value == 4
+
+def test_edge_transform():
+    w_engine, w_dest = engine()
+    w_transform = words([float_to_word(v) for v in [2.0, 0.0, 1.0, 0.0, 2.0, 0.0]])
+    call("primitiveSetEdgeTransform", [w_engine, w_transform])
+    call("primitiveAddRect", [w_engine, point(0, 0), point(2, 1), fill(RED), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[1] == [0, RED, RED, RED, RED, 0, 0, 0]
+    assert rows[2] == [0] * 8
+    call_fails("primitiveSetEdgeTransform", [w_engine, words([0, 0])])
+
+def test_depth_orders_shapes():
+    w_engine, w_dest = engine()
+    call("primitiveSetDepth", [w_engine, 2])
+    call("primitiveAddRect", [w_engine, point(0, 0), point(4, 4), fill(RED), 0, fill(0)])
+    call("primitiveSetDepth", [w_engine, 1])
+    call("primitiveAddRect", [w_engine, point(2, 2), point(6, 6), fill(BLUE), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[3][3] == RED
+    assert rows[5][5] == BLUE
+
+def test_translucent_fill_blends():
+    w_engine, w_dest = engine()
+    w_dest.fetch(space, 0).setword(0, r_uint(0xFF0000FF))
+    # 50% white, premultiplied
+    call("primitiveAddRect", [w_engine, point(0, 0), point(1, 1), fill(0x80808080), 0, fill(0)])
+    flush(w_engine)
+    # BitBlt's blendAlphaScaled rounds down
+    assert pixels(w_dest)[0][0] == 0xFE8080FE
+
+def test_gradient_fill():
+    w_engine, w_dest = engine()
+    w_ramp = words([0xFF000000, 0xFF555555, 0xFFAAAAAA, 0xFFFFFFFF])
+    w_fill = call("primitiveAddGradientFill",
+                  [w_engine, w_ramp, point(0, 0), point(8, 0), point(0, 8), space.w_false])
+    assert 0 < w_fill.value < 1 << 24
+    call("primitiveAddRect", [w_engine, point(0, 0), point(8, 1), w_fill, 0, fill(0)])
+    flush(w_engine)
+    assert pixels(w_dest)[0] == [0xFF000000] * 2 + [0xFF555555] * 2 + [0xFFAAAAAA] * 2 + [0xFFFFFFFF] * 2
+    w_radial = call("primitiveAddGradientFill",
+                    [w_engine, w_ramp, point(4, 4), point(4, 0), point(0, 4), space.w_true])
+    call("primitiveAddRect", [w_engine, point(0, 0), point(8, 8), w_radial, 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[4][4] == 0xFF000000
+    assert rows[0][0] == 0xFFFFFFFF
+    call_fails("primitiveAddGradientFill",
+               [w_engine, w_ramp, point(0, 0), point(0, 0), point(0, 8), space.w_false])
+
+def test_bitmap_fill():
+    w_engine, w_dest = engine()
+    w_texture = form(2, 2, bits=[RED, BLUE, BLUE, RED])
+    w_fill = call("primitiveAddBitmapFill",
+                  [w_engine, w_texture, space.w_nil, space.w_true, point(0, 0),
+                   point(2, 0), point(0, 2), 0])
+    call("primitiveAddRect", [w_engine, point(0, 0), point(4, 2), w_fill, 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[0][:5] == [RED, BLUE, RED, BLUE, 0]
+    assert rows[1][:4] == [BLUE, RED, BLUE, RED]
+    call_fails("primitiveAddBitmapFill",
+               [w_engine, form(8, 1, depth=8, bits=[0, 0]), space.w_nil, space.w_true,
+                point(0, 0), point(8, 0), point(0, 1), 0])
+    call_fails("primitiveAddRect", [w_engine, point(0, 0), point(1, 1), fill(7), 0, fill(0)])
+
+def test_compressed_shape():
+    w_engine, w_dest = engine()
+    # a square of straight bezier segments, the inside being the second fill
+    corners = [(1, 1), (5, 1), (5, 5), (1, 5)]
+    point_words = []
+    for i in range(4):
+        (x0, y0), (x1, y1) = corners[i], corners[(i + 1) % 4]
+        for x, y in [(x0, y0), ((x0 + x1) / 2, (y0 + y1) / 2), (x1, y1)]:
+            point_words.append(x | y << 16)
+    runs = lambda value: words([4 << 16 | value])
+    call("primitiveAddCompressedShape",
+         [w_engine, words(point_words), 4, runs(0), runs(2), runs(0), runs(0),
+          words([RED, BLUE])])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[1][1:5] == [BLUE] * 4
+    assert rows[0] == [0] * 8
+    assert rows[5] == [0] * 8
+    call_fails("primitiveAddCompressedShape",
+               [w_engine, words(point_words), 4, runs(0), runs(3), runs(0), runs(0),
+                words([RED, BLUE])])
+
+def test_loose_edges():
+    w_engine, w_dest = engine()
+    for start, end in [((0, 0), (3, 0)), ((3, 0), (3, 3)), ((3, 3), (0, 3)), ((0, 3), (0, 0))]:
+        call("primitiveAddLine", [w_engine, point(*start), point(*end), fill(0), fill(RED)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[2] == [RED] * 3 + [0] * 5
+    assert rows[3] == [0] * 8
+
+def test_bezier_shape_and_oval():
+    w_engine, w_dest = engine(16, 16, aa_level=2)
+    call("primitiveAddOval", [w_engine, point(0, 0), point(16, 16), fill(RED), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[8][8] == RED
+    assert rows[0][0] == 0
+    w_points = model.W_PointersObject(space, space.w_Array, 6)
+    for i, (x, y) in enumerate([(0, 0), (8, 16), (16, 0), (16, 0), (8, 0), (0, 0)]):
+        w_points.store(space, i, point(x, y))
+    call("primitiveAddBezierShape", [w_engine, w_points, 2, fill(BLUE), 0, fill(0)])
+    flush(w_engine)
+    rows = pixels(w_dest)
+    assert rows[2][8] == BLUE
+    assert rows[12][8] == RED
@@ -1,4 +1,6 @@
+import py
 from spyvm import model, shadow, constants, interpreter, objspace
+from rpython.rlib.rarithmetic import r_uint
 from spyvm.plugins import bitblt
 
 space = objspace.ObjSpace()
@@ -78,3 +80,178 @@ def test_bitBlt_values():
     assert s_bb.skew == 31
     assert s_bb.sourceIndex == 38
     assert s_bb.destIndex == 38
+
+def make_bitblt(w_dest, w_source, rule, dest_x, dest_y, width, height,
+                source_x=0, source_y=0, w_halftone=None):
+    w_bb = model.W_PointersObject(space, space.w_Array, 15)
+    w_bb.store(space, 0, w_dest)
+    w_bb.store(space, 1, w_source or space.w_nil)
+    w_bb.store(space, 2, w_halftone or space.w_nil)
+    w_bb.store(space, 3, w(rule))
+    for index, value in [(4, dest_x), (5, dest_y), (6, width), (7, height),
+                         (8, source_x), (9, source_y), (10, 0), (11, 0)]:
+        w_bb.store(space, index, w(value))
+    w_bb.store(space, 12, w(1000))
+    w_bb.store(space, 13, w(1000))
+    w_bb.store(space, 14, space.w_nil)
+    return w_bb
+
+def generic_copy_bits(s_bb):
+    # BitBltShadow.copyBits without the specialized kernels
+    s_bb.bitCount = 0
+    s_bb.clipRange()
+    if s_bb.bbW <= 0 or s_bb.bbH <= 0:
+        return
+    s_bb.destMaskAndPointerInit()
+    if not s_bb.source:
+        s_bb.copyLoopNoSource()
+    else:
+        s_bb.checkSourceOverlap()
+        s_bb.sourceSkewAndPointerInit()
+        s_bb.copyLoop()
+
+def pattern(size, seed):
+    return [r_uint((i * 2654435761 + seed) & 0xFFFFFFFF) for i in range(size)]
+
+def blit_both_ways(depth, rule, dest_x, dest_y, width, height, source_x=0,
+                   source_y=0, with_source=True, same_form=False, halftone=None):
+    results = []
+    for copy_bits in [lambda s_bb: s_bb.copyBits(), generic_copy_bits]:
+        w_dest = make_form(pattern(40 * 40, 7), 40 * 32 / depth, 40, depth)
+        if same_form:
+            w_source = w_dest
+        elif with_source:
+            w_source = make_form(pattern(40 * 40, 11), 40 * 32 / depth, 40, depth)
+        else:
+            w_source = None
+        w_halftone = None
+        if halftone is not None:
+            w_halftone = model.W_WordsObject(space, space.w_Array, len(halftone))
+            w_halftone.words = [r_uint(word) for word in halftone]
+        w_bb = make_bitblt(w_dest, w_source, rule, dest_x, dest_y, width, height,
+                           source_x, source_y, w_halftone)
+        s_bb = bitblt.BitBltShadow(space, w_bb)
+        s_bb.loadBitBlt()
+        copy_bits(s_bb)
+        results.append(w_dest.fetch(space, 0).words)
+    assert results[0] == results[1]
+
+def test_aligned_kernels_match_generic_loop():
+    for depth in [1, 8, 16, 32]:
+        pixels = 32 / depth
+        for rule in [0, 3, 6, 24, 34]:
+            blit_both_ways(depth, rule, 3 * pixels, 2, 17 * pixels + 1, 9,
+                           source_x=5 * pixels, source_y=4)
+            blit_both_ways(depth, rule, 1, 1, 3, 3, source_x=1, source_y=7)
+            blit_both_ways(depth, rule, 0, 5, 30 * pixels, 20, source_y=6,
+                           same_form=True)
+            blit_both_ways(depth, rule, 0, 8, 30 * pixels, 20, source_y=3,
+                           same_form=True)
+
+def test_unaligned_blits_match_generic_loop():
+    for depth in [1, 8]:
+        blit_both_ways(depth, 3, 3, 2, 100, 9, source_x=5, source_y=4)
+        blit_both_ways(depth, 3, 7, 2, 100, 9, source_x=2, source_y=4, same_form=True)
+        blit_both_ways(depth, 3, 0, 2, 100, 9, halftone=[0x12345678])
+
+def test_fill_kernel_matches_generic_loop():
+    for depth in [1, 16, 32]:
+        for rule in [0, 3]:
+            blit_both_ways(depth, rule, 5, 3, 200 / depth + 3, 11, with_source=False)
+            blit_both_ways(depth, rule, 5, 3, 200 / depth + 3, 11, with_source=False,
+                           halftone=[0x0F0F0F0F, 0xF0F0F0F0, 0x12345678])
+            blit_both_ways(depth, rule, 2, 1, 1, 1, with_source=False)
+
+def test_alpha_blend_scaled_rule():
+    # clipRange keeps the last source column and row out of the blit
+    w_dest = make_form([r_uint(0x80402010)] + [r_uint(0x11111111)] * 3, 2, 2, 32)
+    w_source = make_form([r_uint(0x80100804)] + [r_uint(0xFF000000)] * 3, 2, 2, 32)
+    s_bb = bitblt.BitBltShadow(space, make_bitblt(w_dest, w_source, 34, 0, 0, 1, 1))
+    s_bb.loadBitBlt()
+    s_bb.copyBits()
+    # dest * (255 - alpha) / 256 + source, per component
+    assert w_dest.fetch(space, 0).words == [r_uint(0xBF2F170B)] + [r_uint(0x11111111)] * 3
+
+def make_warpblt(w_dest, w_source, rule, dest_rect, quad, w_color_map=None):
+    left, top, width, height = dest_rect
+    w_bb = model.W_PointersObject(space, space.w_Array, 29)
+    w_bitblt = make_bitblt(w_dest, w_source, rule, left, top, width, height)
+    for i in range(15):
+        w_bb.store(space, i, w_bitblt.fetch(space, i))
+    if w_color_map is not None:
+        w_bb.store(space, 14, w_color_map)
+    for i in range(15, 29):
+        w_bb.store(space, i, w(0))
+    # the corners topLeft, bottomLeft, bottomRight, topRight of the source
+    for i, (x, y) in enumerate(quad):
+        w_bb.store(space, bitblt.WARP_BASE + i * 3, w(x * bitblt.FIXED_PT1))
+        w_bb.store(space, bitblt.WARP_BASE + i * 3 + 1, w(y * bitblt.FIXED_PT1))
+    return w_bb
+
+def inner_corners(width, height):
+    return [(0, 0), (0, height - 1), (width - 1, height - 1), (width - 1, 0)]
+
+def warp(w_bb, smoothing=1, w_source_map=None):
+    from spyvm.test.test_primitives import mock
+    interp, w_frame, argument_count = mock([w_bb, smoothing, w_source_map or space.w_nil])
+    s_frame = w_frame.as_context_get_shadow(space)
+    bitblt.BitBltPlugin.call("primitiveWarpBits", interp, s_frame, argument_count - 1, None)
+    assert s_frame.pop() is w_bb
+
+def test_warp_scales_up():
+    source = [r_uint(0xFF000000 + i) for i in range(16)]
+    w_source = make_form(source, 4, 4, 32)
+    w_dest = make_form([r_uint(0)] * 64, 8, 8, 32)
+    warp(make_warpblt(w_dest, w_source, 3, (0, 0, 8, 8), inner_corners(4, 4)))
+    words = w_dest.fetch(space, 0).words
+    for y in range(8):
+        for x in range(8):
+            assert words[y * 8 + x] == source[(y / 2) * 4 + x / 2]
+
+def test_warp_clips_destination():
+    source = [r_uint(0xFF000000 + i) for i in range(16)]
+    w_source = make_form(source, 4, 4, 32)
+    w_dest = make_form([r_uint(0)] * 64, 8, 8, 32)
+    w_bb = make_warpblt(w_dest, w_source, 3, (0, 0, 8, 8), inner_corners(4, 4))
+    w_bb.store(space, 10, w(4)) # clip x
+    w_bb.store(space, 11, w(2)) # clip y
+    warp(w_bb)
+    words = w_dest.fetch(space, 0).words
+    for y in range(8):
+        for x in range(8):
+            if x < 4 or y < 2:
+                assert words[y * 8 + x] == 0
+            else:
+                assert words[y * 8 + x] == source[(y / 2) * 4 + x / 2]
+
+def test_warp_smoothing_averages():
+    source = []
+    for y in range(8):
+        for x in range(8):
+            source.append(r_uint(0xFF000000 | (x * 16) << 16 | (y * 16) << 8 | 0x40))
+    w_source = make_form(source, 8, 8, 32)
+    w_dest = make_form([r_uint(0)] * 16, 4, 4, 32)
+    warp(make_warpblt(w_dest, w_source, 3, (0, 0, 4, 4), inner_corners(8, 8)), 2)
+    words = w_dest.fetch(space, 0).words
+    for y in range(4):
+        for x in range(4):
+            assert words[y * 4 + x] == (0xFF000000 | (x * 32 + 8) << 16 |
+                                        (y * 32 + 8) << 8 | 0x40)
+
+def test_warp_maps_colors():
+    # an 8 bit source through its colormap into a 32 bit destination
+    w_source = make_form([r_uint(0x00010203), r_uint(0x04050607)] * 2, 8, 2, 8)
+    w_map = model.W_WordsObject(space, space.w_Array, 256)
+    w_map.words = [r_uint(0xFF000000 | i) for i in range(256)]
+    w_dest = make_form([r_uint(0)] * 8, 4, 2, 32)
+    warp(make_warpblt(w_dest, w_source, 3, (0, 0, 4, 2), inner_corners(4, 2), w_map))
+    assert w_dest.fetch(space, 0).words[:4] == [r_uint(0xFF000000 | i) for i in range(4)]
+
+def test_warp_smoothing_needs_source_map():
+    from spyvm.primitives import PrimitiveFailedError
+    w_source = make_form([r_uint(0)] * 4, 8, 2, 8)
+    w_dest = make_form([r_uint(0)] * 8, 4, 2, 32)
+    w_bb = make_warpblt(w_dest, w_source, 3, (0, 0, 4, 2), inner_corners(4, 2))
+    py.test.raises(PrimitiveFailedError, warp, w_bb, 2)
+    w_map = model.W_WordsObject(space, space.w_Array, 256)
+    warp(w_bb, 2, w_map)
@@ -0,0 +1,305 @@
+from spyvm.display import DamageRects
+
+def rects(damage):
+    return [tuple(damage.rects[i:i + 4]) for i in range(0, len(damage.rects), 4)]
+
+def test_damage_separate_rects():
+    damage = DamageRects()
+    assert damage.is_empty()
+    damage.add(0, 0, 10, 10)
+    damage.add(20, 20, 30, 30)
+    assert rects(damage) == [(0, 0, 10, 10), (20, 20, 30, 30)]
+    damage.clear()
+    assert damage.is_empty()
+
+def test_damage_ignores_empty_rects():
+    damage = DamageRects()
+    damage.add(5, 5, 5, 10)
+    damage.add(5, 10, 8, 3)
+    assert damage.is_empty()
+
+def test_damage_merges_overlapping_rects():
+    damage = DamageRects()
+    damage.add(0, 0, 10, 10)
+    damage.add(20, 0, 30, 10)
+    damage.add(5, 5, 25, 8)
+    assert rects(damage) == [(0, 0, 30, 10)]
+    damage.add(2, 2, 4, 4)
+    assert rects(damage) == [(0, 0, 30, 10)]
+
+def test_damage_collapses_into_union():
+    damage = DamageRects(max_rects=4)
+    for i in range(4):
+        damage.add(i * 10, i * 10, i * 10 + 5, i * 10 + 5)
+    assert damage.count() == 4
+    damage.add(100, 50, 110, 60)
+    assert rects(damage) == [(0, 0, 110, 60)]
+
+# ___________________________________________________________________________
+# Headless display
+
+import py
+
+from rpython.rlib.rarithmetic import r_uint
+from rpython.rtyper.lltypesystem import lltype
+
+from spyvm import model, interpreter, display
+from spyvm.display import HeadlessDisplay
+from spyvm.plugins.vmdebugging import DebuggingPlugin
+from spyvm.test.test_primitives import mock, space
+
+def headless_bitmap(width, height, depth):
+    sdldisplay = HeadlessDisplay()
+    sdldisplay.set_video_mode(width, height, depth)
+    size = (width * depth + 31) / 32 * height
+    return model.W_DisplayBitmap.create(space, space.w_Bitmap, size, depth, sdldisplay)
+
+def read_ppm(path):
+    data = path.read("rb")
+    header, pixels = data[:data.index("255\n") + 4], data[data.index("255\n") + 4:]
+    return header, [tuple(ord(c) for c in pixels[i:i + 3]) for i in range(0, len(pixels), 3)]
+
+def test_headless_dump_32_bit(tmpdir):
+    w_bitmap = headless_bitmap(3, 2, 32)
+    for i, pixel in enumerate([0xFFFF0000, 0xFF00FF00, 0xFF0000FF, 0, 0xFFFFFFFF, 0xFF808080]):
+        w_bitmap.setword(i, r_uint(pixel))
+    path = tmpdir.join("frame.ppm")
+    w_bitmap.display.dump_ppm(str(path))
+    header, pixels = read_ppm(path)
+    assert header == "P6\n3 2\n255\n"
+    assert pixels == [(255, 0, 0), (0, 255, 0), (0, 0, 255),
+                      (0, 0, 0), (255, 255, 255), (128, 128, 128)]
+
+def test_headless_dump_16_and_8_bit(tmpdir):
+    w_bitmap = headless_bitmap(2, 1, 16)
+    w_bitmap.setword(0, r_uint(0x7C00 << 16 | 0x001F))
+    path = tmpdir.join("frame16.ppm")
+    w_bitmap.display.dump_ppm(str(path))
+    assert read_ppm(path)[1] == [(255, 0, 0), (0, 0, 255)]
+    # black, white, red and the color cube's green
+    w_bitmap = headless_bitmap(5, 1, 8)
+    w_bitmap.setword(0, r_uint(0x01020400))
+    w_bitmap.setword(1, r_uint(40 + 5) << 24)
+    path = tmpdir.join("frame8.ppm")
+    w_bitmap.display.dump_ppm(str(path))
+    assert read_ppm(path)[1] == [(0, 0, 0), (255, 255, 255), (255, 0, 0),
+                                 (255, 255, 255), (0, 255, 0)]
+
+def test_headless_dump_1_bit(tmpdir):
+    w_bitmap = headless_bitmap(4, 1, 1)
+    w_bitmap.setword(0, r_uint(0xA0000000))
+    path = tmpdir.join("frame1.ppm")
+    w_bitmap.display.dump_ppm(str(path))
+    assert read_ppm(path)[1] == [(0, 0, 0), (255, 255, 255)] * 2
+
+def test_headless_events():
+    sdldisplay = HeadlessDisplay()
+    sdldisplay.set_video_mode(10, 10, 32)
+    assert sdldisplay.get_next_event(time=5)[0] == display.EventTypeNone
+    sdldisplay.post_event([display.EventTypeMouse, 0, 3, 4, display.RedButtonBit, 0, 0, 0])
+    sdldisplay.post_event([display.EventTypeKeyboard, 7, ord("a"), display.EventKeyChar,
+                           display.ShiftKeyBit, ord("a"), 0, 0])
+    assert sdldisplay.get_next_event(time=5) == [display.EventTypeMouse, 5, 3, 4,
+                                                 display.RedButtonBit, 0, 0, 0]
+    assert sdldisplay.mouse_point() == [3, 4]
+    assert sdldisplay.mouse_button() == display.RedButtonBit | display.ShiftKeyBit << 3
+    assert sdldisplay.next_keycode() == ord("a") | display.ShiftKeyBit << 8
+    assert sdldisplay.get_next_event()[0] == display.EventTypeNone
+
+def test_headless_interpreter_creates_headless_display():
+    interp = interpreter.Interpreter(space, headless=True)
+    w_form = model.W_PointersObject(space, space.w_Array, 4)
+    w_words = model.W_WordsObject(space, space.w_Bitmap, 20)
+    w_words.setword(3, r_uint(0xFFFF0000))
+    w_form.store(space, 0, w_words)
+    w_form.store(space, 1, space.wrap_int(4))
+    w_form.store(space, 2, space.wrap_int(5))
+    w_form.store(space, 3, space.wrap_int(32))
+    w_bitmap = w_words.as_display_bitmap(w_form, interp)
+    assert isinstance(w_bitmap.display, HeadlessDisplay)
+    w_bitmap.display.sync_pixels()
+    assert w_bitmap.display.rgb_at(w_bitmap.display.get_pixelbuffer(), 3, 0) == 0xFF0000
+
+def test_debugging_primitives(tmpdir):
+    w_bitmap = headless_bitmap(2, 2, 32)
+    w_display = model.W_PointersObject(space, space.w_Array, 4)
+    w_display.store(space, 0, w_bitmap)
+    old_display = space.objtable["w_display"]
+    space.objtable["w_display"] = w_display
+    try:
+        path = str(tmpdir.join("prim.ppm"))
+        interp, w_frame, argument_count = mock([space.w_nil, space.wrap_string(path)])
+        DebuggingPlugin.call("dumpDisplayFrame", interp,
+                             w_frame.as_context_get_shadow(space), argument_count - 1, None)
+        assert tmpdir.join("prim.ppm").read("rb").startswith("P6\n2 2\n")
+        w_event = space.wrap_list([space.wrap_int(i) for i in [1, 0, 1, 1, 0, 0, 0, 0]])
+        interp, w_frame, argument_count = mock([space.w_nil, w_event])
+        DebuggingPlugin.call("postDisplayEvent", interp,
+                             w_frame.as_context_get_shadow(space), argument_count - 1, None)
+        assert w_bitmap.display.mouse_point() == [1, 1]
+    finally:
+        space.objtable["w_display"] = old_display
+
+class InputArrivingDisplay(display.Display):
+    def __init__(self, polls_before_input):
+        display.Display.__init__(self)
+        self.polls = 0
+        self.polls_before_input = polls_before_input
+
+    def has_pending_events(self):
+        self.polls += 1
+        return self.polls > self.polls_before_input
+
+def test_wait_for_event_returns_on_input():
+    import time
+    sdldisplay = InputArrivingDisplay(2)
+    start = time.time()
+    assert sdldisplay.wait_for_event(5.0)
+    assert time.time() - start < 1.0
+
+def test_wait_for_event_ignores_pending_input():
+    import time
+    sdldisplay = InputArrivingDisplay(0)
+    start = time.time()
+    assert not sdldisplay.wait_for_event(0.05)
+    assert sdldisplay.polls == 1
+    assert time.time() - start >= 0.04
+
+def test_idle_until_next_wakeup():
+    import time
+    interp = interpreter.Interpreter(space)
+    old_display = space.objtable["w_display"]
+    space.objtable["w_display"] = None
+    try:
+        interp.next_wakeup_tick = interp.time_now() + 50
+        start = time.time()
+        interp.idle(10 * 1000000)
+        assert 0.04 <= time.time() - start < 1.0
+        interp.next_wakeup_tick = 0
+        start = time.time()
+        interp.idle(20000)
+        assert 0.015 <= time.time() - start < 1.0
+    finally:
+        space.objtable["w_display"] = old_display
+
+def test_display_bitmap_converts_on_update():
+    w_bitmap = headless_bitmap(2, 2, 32)
+    w_bitmap.setword(1, r_uint(0xFF123456))
+    w_bitmap.setword(3, r_uint(0xFF654321))
+    assert w_bitmap.pixelbuffer[1] == 0
+    assert w_bitmap.display.rgb_at(w_bitmap.pixelbuffer, 1, 0) == 0
+    w_bitmap.display.invalidate_all()
+    w_bitmap.display.flush_damage()
+    assert w_bitmap.display.rgb_at(w_bitmap.pixelbuffer, 1, 0) == 0x123456
+    assert w_bitmap.display.rgb_at(w_bitmap.pixelbuffer, 1, 1) == 0x654321
+
+def test_display_bitmap_converts_depths():
+    word = r_uint(0x9C5AE12F)
+    for depth in [1, 2, 4]:
+        w_bitmap = headless_bitmap(32 / depth, 1, depth)
+        w_bitmap.setword(0, word)
+        w_bitmap.display.sync_pixels()
+        for x in range(32 / depth):
+            pixel = (word >> (32 - depth * (x + 1))) & ((1 << depth) - 1)
+            assert (w_bitmap.pixelbuffer[x / 4] >> (8 * (x % 4))) & 0xFF == pixel
+    w_bitmap = headless_bitmap(4, 1, 8)
+    w_bitmap.setword(0, word)
+    w_bitmap.display.sync_pixels()
+    assert w_bitmap.pixelbuffer[0] == 0x2FE15A9C
+    w_bitmap = headless_bitmap(2, 1, 16)
+    w_bitmap.setword(0, r_uint(0x7C00 << 16 | 0x03E0 | 0x8000))
+    w_bitmap.display.sync_pixels()
+    assert w_bitmap.pixelbuffer[0] == 0x1F | (0x1F << 6) << 16
+
+def test_event_queue_coalesces_mouse_motion():
+    queue = display.EventQueue()
+    assert queue.pop() == [display.EventTypeNone, 0, 0, 0, 0, 0, 0, 0]
+    queue.push_motion(1, 10, 10, 0, 0)
+    queue.push_motion(2, 11, 12, 0, 0)
+    queue.push_motion(3, 13, 14, 0, 0)
+    assert queue.count() == 1
+    queue.push_motion(4, 15, 16, display.RedButtonBit, 0)
+    queue.push(display.EventTypeKeyboard, 5, ord("a"), display.EventKeyDown, 0, ord("a"), 0, 0)
+    queue.push_motion(6, 17, 18, display.RedButtonBit, 0)
+    assert queue.count() == 4
+    event = queue.pop()
+    assert event == [display.EventTypeMouse, 3, 13, 14, 0, 0, 0, 0]
+    assert queue.pop() is event
+    assert event == [display.EventTypeMouse, 4, 15, 16, display.RedButtonBit, 0, 0, 0]
+    assert queue.pop()[0] == display.EventTypeKeyboard
+    queue.push_motion(7, 19, 20, display.RedButtonBit, 0)
+    assert queue.count() == 1
+    assert queue.pop()[1:4] == [7, 19, 20]
+    # a motion that was already fetched is not updated
+    queue.push_motion(8, 21, 22, display.RedButtonBit, 0)
+    assert queue.pop()[1:4] == [8, 21, 22]
+    assert queue.is_empty()
+
+def test_input_semaphore_signaled_on_input():
+    from spyvm import constants, primitives, wrapper
+    w_bitmap = headless_bitmap(2, 2, 32)
+    w_display = model.W_PointersObject(space, space.w_Array, 4)
+    w_display.store(space, 0, w_bitmap)
+    w_semaphore = model.W_PointersObject(space, space.w_Semaphore, 3)
+    semaphore = wrapper.SemaphoreWrapper(space, w_semaphore)
+    semaphore.store_excess_signals(0)
+    class Image(object):
+        w_special_objects = model.W_PointersObject(
+            space, space.w_Array, constants.SO_EXTERNAL_OBJECTS_ARRAY + 1)
+    Image.w_special_objects.store(space, constants.SO_EXTERNAL_OBJECTS_ARRAY,
+                                  space.wrap_list([space.w_nil, w_semaphore]))
+    old_display = space.objtable["w_display"]
+    space.objtable["w_display"] = w_display
+    try:
+        interp, w_frame, argument_count = mock([space.w_nil, 2])
+        interp.image = Image()
+        s_frame = w_frame.as_context_get_shadow(space)
+        primitives.prim_table[primitives.INPUT_SEMAPHORE](interp, s_frame, argument_count - 1)
+        assert interp.input_semaphore_index == 2
+        interp.check_for_interrupts(s_frame)
+        assert semaphore.excess_signals() == 0
+        w_bitmap.display.post_event([display.EventTypeMouse, 0, 1, 1, 0, 0, 0, 0])
+        interp.check_for_interrupts(s_frame)
+        assert semaphore.excess_signals() == 1
+        interp.check_for_interrupts(s_frame)
+        assert semaphore.excess_signals() == 1
+        # without primitiveGetNextEvent the events stay with the old style
+        # input primitives
+        interp.evented = False
+        w_bitmap.display.post_event([display.EventTypeMouse, 0, 3, 4, 0, 0, 0, 0])
+        interp.check_for_interrupts(s_frame)
+        assert semaphore.excess_signals() == 1
+        assert w_bitmap.display.mouse_point() == [3, 4]
+    finally:
+        space.objtable["w_display"] = old_display
+
+def test_cursor_cache(monkeypatch):
+    calls = []
+    def create_cursor(data, mask, w, h, x, y):
+        calls.append("create")
+        return lltype.malloc(display.RSDL.CursorPtr.TO, flavor="raw")
+    monkeypatch.setattr(display.RSDL, "CreateCursor", create_cursor)
+    monkeypatch.setattr(display.RSDL, "SetCursor", lambda cursor: calls.append("set"))
+    monkeypatch.setattr(display.RSDL, "FreeCursor", lambda cursor: calls.append("free"))
+    monkeypatch.setattr(display, "CURSOR_CACHE_SIZE", 2)
+    cursor = display.SDLCursorClass()
+    cursor.has_display = True
+    normal, wait, crosshair = [r_uint(0xFFFF0000)] * 16, [r_uint(0xF0F0F0F0)] * 16, [r_uint(0x01800180)] * 16
+    cursor.set(normal, 16, 16, 0, 0)
+    cursor.set(wait, 16, 16, 0, 0, mask_words=wait)
+    assert calls == ["create", "set", "create", "set"]
+    del calls[:]
+    cursor.set(list(normal), 16, 16, 0, 0)
+    cursor.set(normal, 16, 16, 0, 0)
+    assert calls == ["set"]
+    # the same bits with another mask or hot spot are another cursor
+    del calls[:]
+    cursor.set(wait, 16, 16, 0, 0)
+    assert calls == ["create", "set", "free"]
+    # the least recently used cursor was evicted
+    del calls[:]
+    cursor.set(normal, 16, 16, 0, 0)
+    assert calls == ["set"]
+    cursor.set(crosshair, 16, 16, 7, 7)
+    cursor.set(wait, 16, 16, 0, 0, mask_words=wait)
+    assert calls.count("create") == 2
@@ -0,0 +1,68 @@
+import math
+from functools import partial
+
+from spyvm.plugins.floatarrayplugin import FloatArrayPlugin, float_to_word, word_to_float
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, FloatArrayPlugin)
+call_fails = partial(plugin_call_fails, FloatArrayPlugin)
+
+def float_array(values):
+    w_array = space.w_Bitmap.as_class_get_shadow(space).new(len(values))
+    for i in range(len(values)):
+        w_array.setword(i, float_to_word(values[i]))
+    return w_array
+
+def floats(w_array):
+    return [word_to_float(w_array.getword(i)) for i in range(w_array.size())]
+
+def test_float32_conversion():
+    assert float_to_word(1.0) == 0x3F800000
+    assert float_to_word(-2.0) == 0xC0000000
+    assert word_to_float(float_to_word(0.1)) != 0.1
+    assert abs(word_to_float(float_to_word(0.1)) - 0.1) < 1e-8
+    assert math.isinf(word_to_float(float_to_word(1e300)))
+
+def test_elementwise_arrays():
+    w_a = float_array([1.0, 2.0, 3.0])
+    w_b = float_array([0.5, 4.0, -1.0])
+    assert call("primitiveAddFloatArray", [w_a, w_b]) is w_a
+    assert floats(w_a) == [1.5, 6.0, 2.0]
+    call("primitiveSubFloatArray", [w_a, w_b])
+    assert floats(w_a) == [1.0, 2.0, 3.0]
+    call("primitiveMulFloatArray", [w_a, w_b])
+    assert floats(w_a) == [0.5, 8.0, -3.0]
+    call("primitiveDivFloatArray", [w_a, w_b])
+    assert floats(w_a) == [1.0, 2.0, 3.0]
+    call_fails("primitiveDivFloatArray", [w_a, float_array([1.0, 0.0, 1.0])])
+    call_fails("primitiveAddFloatArray", [w_a, float_array([1.0])])
+
+def test_elementwise_scalars():
+    w_a = float_array([1.0, 2.0, 4.0])
+    call("primitiveAddScalar", [w_a, 1.0])
+    assert floats(w_a) == [2.0, 3.0, 5.0]
+    call("primitiveSubScalar", [w_a, 2])
+    assert floats(w_a) == [0.0, 1.0, 3.0]
+    call("primitiveMulScalar", [w_a, 4.0])
+    assert floats(w_a) == [0.0, 4.0, 12.0]
+    call("primitiveDivScalar", [w_a, 2.0])
+    assert floats(w_a) == [0.0, 2.0, 6.0]
+    call_fails("primitiveDivScalar", [w_a, 0.0])
+
+def test_reductions():
+    w_a = float_array([3.0, 4.0])
+    assert call("primitiveSum", [w_a]).value == 7.0
+    assert call("primitiveLength", [w_a]).value == 5.0
+    assert call("primitiveDotProduct", [w_a, float_array([2.0, 0.5])]).value == 8.0
+    call("primitiveNormalize", [w_a])
+    assert floats(w_a) == [word_to_float(float_to_word(0.6)),
+                           word_to_float(float_to_word(0.8))]
+    call_fails("primitiveNormalize", [float_array([0.0, 0.0])])
+
+def test_at_put():
+    w_a = float_array([0.0, 0.0])
+    call("primitiveAtPut", [w_a, 2, 1.5])
+    assert call("primitiveAt", [w_a, 2]).value == 1.5
+    call_fails("primitiveAt", [w_a, 3])
+    assert call("primitiveEqual", [w_a, float_array([0.0, 1.5])]) is space.w_true
+    assert call("primitiveEqual", [w_a, float_array([0.0])]) is space.w_false
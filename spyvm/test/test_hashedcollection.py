@@ -0,0 +1,40 @@
+from functools import partial
+
+from spyvm import model
+from spyvm.plugins.hashedcollection import HashedCollectionPlugin
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, HashedCollectionPlugin)
+call_fails = partial(plugin_call_fails, HashedCollectionPlugin)
+
+def association(w_key, w_value):
+    w_assoc = model.W_PointersObject(space, space.w_Array, 2)
+    w_assoc.store(space, 0, w_key)
+    w_assoc.store(space, 1, w_value)
+    return w_assoc
+
+def array(elements_w):
+    return space.wrap_list([space.w_nil if w is None else w for w in elements_w])
+
+w_a = space.wrap_string("a")
+w_b = space.wrap_string("bb")
+w_c = space.wrap_string("ccc")
+
+def test_scan_for_element():
+    w_array = array([w_a, None, w_b, w_c])
+    assert call("primitiveScanForElement", [space.w_nil, w_array, w_b, 3]).value == 3
+    # wraps around to the free slot
+    assert call("primitiveScanForElement", [space.w_nil, w_array, w_b, 4]).value == 2
+    assert call("primitiveScanForElement", [space.w_nil, w_array, w_a, 1]).value == 1
+    w_full = array([w_a, w_b])
+    assert call("primitiveScanForElement", [space.w_nil, w_full, w_c, 2]).value == 0
+    call_fails("primitiveScanForElement", [space.w_nil, w_full, w_c, 3])
+    call_fails("primitiveScanForElement", [space.w_nil, w_a, w_c, 1])
+
+def test_scan_for_key():
+    w_array = array([association(w_a, space.wrap_int(1)), None,
+                     association(w_b, space.wrap_int(2))])
+    assert call("primitiveScanForKey", [space.w_nil, w_array, w_b, 3]).value == 3
+    assert call("primitiveScanForKey", [space.w_nil, w_array, w_a, 3]).value == 1
+    assert call("primitiveScanForKey", [space.w_nil, w_array, w_c, 3]).value == 2
+    call_fails("primitiveScanForKey", [space.w_nil, array([space.wrap_int(1)]), w_c, 1])
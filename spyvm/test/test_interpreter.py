@@ -1049,3 +1049,17 @@ def test_c_stack_reset_on_sender_chain_manipulation():
     s_frame.store_w_receiver(w_frame)
     s_frame.push(w_frame)
     py.test.raises(interpreter.StackOverflow, step_in_interp, s_frame)
+
+def test_interrupt_check_interval_adapts():
+    interp = interpreter.Interpreter(space)
+    interp.interrupt_check_interval = 10000
+    interp.last_interrupt_check = interp.microseconds_now()
+    interp.adjust_interrupt_check_interval()
+    assert interp.interrupt_check_interval > 10000
+    interp.interrupt_check_interval = 10000
+    interp.last_interrupt_check = interp.microseconds_now() - 10 * constants.INTERRUPT_CHECK_MICROSECONDS
+    interp.adjust_interrupt_check_interval()
+    assert interp.interrupt_check_interval == 5000
+    interp.interrupt_check_interval = constants.MIN_INTERRUPT_COUNTER_SIZE
+    interp.adjust_interrupt_check_interval()
+    assert interp.interrupt_check_interval == constants.MIN_INTERRUPT_COUNTER_SIZE
@@ -0,0 +1,121 @@
+from functools import partial
+
+from spyvm import model, shadow, constants
+from spyvm.objspace import bootstrap_class
+from spyvm.plugins.largeintegers import LargeIntegersPlugin, unwrap_bigint
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+w_LargeNegativeInteger = bootstrap_class(space, 0, space.w_LargePositiveInteger,
+                                         name='LargeNegativeInteger',
+                                         format=shadow.BYTES)
+
+class MockImage(object):
+    special_objects = [None] * (constants.SO_LARGENEGATIVEINTEGER_CLASS + 1)
+    special_objects[constants.SO_LARGENEGATIVEINTEGER_CLASS] = w_LargeNegativeInteger
+
+    def special(self, index):
+        return self.special_objects[index]
+
+call = partial(plugin_call, LargeIntegersPlugin, image=MockImage())
+call_fails = partial(plugin_call_fails, LargeIntegersPlugin, image=MockImage())
+
+def large(value, size=0):
+    if value < 0:
+        w_class = w_LargeNegativeInteger
+        value = -value
+    else:
+        w_class = space.w_LargePositiveInteger
+    data = []
+    while value:
+        data.append(chr(value & 0xFF))
+        value >>= 8
+    data += ["\x00"] * (size - len(data))
+    w_large = model.W_BytesObject(space, w_class, len(data))
+    w_large.bytes = data
+    return w_large
+
+def value(w_integer):
+    return int(unwrap_bigint(space, w_integer).format("0123456789"))
+
+A = 2 ** 100 + 12345
+B = 3 ** 50
+
+def test_add_subtract():
+    assert value(call("primDigitAdd", [large(A), large(B)])) == A + B
+    assert value(call("primDigitAdd", [large(-A), large(B)])) == -(A + B)
+    assert value(call("primDigitAdd", [large(A), 5])) == A + 5
+    assert value(call("primDigitSubtract", [large(A), large(B)])) == A - B
+    assert value(call("primDigitSubtract", [large(B), large(-A)])) == B - A
+    assert value(call("primDigitSubtract", [large(-A), large(B)])) == -(A - B)
+    assert call("primDigitSubtract", [large(A), large(A)]).value == 0
+    call_fails("primDigitAdd", [large(A), space.wrap_float(1.0)])
+
+def test_multiply_divide():
+    assert value(call("primDigitMultiplyNegative", [large(A), large(-B), space.w_false])) == A * B
+    assert value(call("primDigitMultiplyNegative", [large(A), large(B), space.w_true])) == -A * B
+    w_result = call("primDigitDivNegative", [large(-A), large(B), space.w_false])
+    quotient, remainder = [value(w) for w in space.unwrap_array(w_result)]
+    assert quotient == A // B
+    assert remainder == -(A % B)
+    call_fails("primDigitDivNegative", [large(A), 0, space.w_false])
+
+def test_compare():
+    assert call("primDigitCompare", [large(A), large(B)]).value == 1
+    assert call("primDigitCompare", [large(-B), large(A)]).value == -1
+    assert call("primDigitCompare", [large(-A), large(A)]).value == 0
+
+def test_normalize():
+    w_large = large(A)
+    assert call("primNormalizePositive", [w_large]) is w_large
+    w_padded = large(A, 20)
+    w_result = call("primNormalizePositive", [w_padded])
+    assert w_result.size() == 13
+    assert value(w_result) == A
+    assert call("primNormalizeNegative", [large(-5, 8)]).value == -5
+
+def test_bit_operations():
+    assert value(call("primDigitBitAnd", [large(A), large(B)])) == A & B
+    assert value(call("primDigitBitOr", [large(A), large(B)])) == A | B
+    assert value(call("primDigitBitXor", [large(A), 7])) == A ^ 7
+    call_fails("primDigitBitAnd", [large(-A), large(B)])
+    assert value(call("primDigitBitShiftMagnitude", [large(-A), 3])) == -(A << 3)
+    assert value(call("primDigitBitShiftMagnitude", [large(A), -90])) == A >> 90
+    assert call("primAnyBitFromTo", [large(A), 101, 200]) is space.w_true
+    assert call("primAnyBitFromTo", [large(A), 20, 100]) is space.w_false
+    assert call("primAnyBitFromTo", [large(A), 1, 1]) is space.w_true
+    call_fails("primAnyBitFromTo", [large(A), 0, 3])
+
+def test_montgomery():
+    m = 2 ** 127 - 1
+    b = 2 ** 32
+    m_inv = (-pow(m, b // 2 - 1, b)) % b # -m^-1 mod 2^32, as m is odd
+    assert m * m_inv % b == b - 1
+    r = 2 ** (32 * 4)
+    x, y = 3 ** 70, 5 ** 50
+    w_result = call("primMontgomeryTimesModulo",
+                    [large(x), large(y), large(m), space.wrap_uint(m_inv)])
+    assert value(w_result) * r % m == x * y % m
+    assert value(w_result) < m
+    call_fails("primMontgomeryTimesModulo",
+               [large(x), large(y), large(m + 1), space.wrap_uint(m_inv)])
+    call_fails("primMontgomeryTimesModulo",
+               [large(2 ** 200), large(y), large(m), space.wrap_uint(m_inv)])
+
+def test_montgomery_image_contract():
+    # LargePositiveInteger>>montgomeryTimes:modulo: in the image
+    digit_length = value(call("primMontgomeryDigitLength", [large(2 ** 40)]))
+    assert digit_length == 32
+    base = 1 << digit_length
+    for m in [2 ** 39 + 11, 2 ** 55 + 3, 2 ** 71 - 25, 3 ** 61]:
+        number_of_digits = ((m.bit_length() + 7) // 8 * 8 + digit_length - 1) // digit_length
+        assert (m.bit_length() + 7) // 8 % 4 != 0
+        m_inv = base - pow(m % base, base // 2 - 1, base)
+        r = 2 ** (digit_length * number_of_digits)
+        x, y = (m - 2) // 3, m - 5
+        w_result = call("primMontgomeryTimesModulo",
+                        [large(x), large(y), large(m), space.wrap_uint(m_inv)])
+        assert value(w_result) * r % m == x * y % m
+        assert value(w_result) < m
+        # an mInvModB for 8 bit digits does not fit our digit length
+        call_fails("primMontgomeryTimesModulo",
+                   [large(x), large(y), large(m), space.wrap_uint(m_inv % 256)])
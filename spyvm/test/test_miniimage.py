@@ -61,11 +61,11 @@ def test_read_all_header():
 
 def test_all_pointers_are_valid():
     reader = get_reader()
-    for each in reader.chunks.itervalues():
+    for each in reader.chunklist:
         if each.format < 5:
             for pointer in each.data:
                 if (pointer & 1) != 1:
-                    assert pointer in reader.chunks
+                    assert reader.chunk_index(pointer) >= 0
 
 
 def test_there_are_31_compact_classes():
@@ -400,6 +400,184 @@ def test_step_run_something():
     interp.step(s_ctx)
     assert s_ctx.top().value == 3
 
+def nil_state():
+    # nil is shared by all spaces, loading into a second space refills it
+    w_nil = space.w_nil
+    return w_nil.space, w_nil.s_class, w_nil.fieldtypes, w_nil.hash, w_nil._vars
+
+def restore_nil_state(saved):
+    w_nil = space.w_nil
+    w_nil.space, w_nil.s_class, w_nil.fieldtypes, w_nil.hash, w_nil._vars = saved
+
+def load_other_image(other_space, other_reader):
+    other_reader.initialize()
+    other_image = squeakimage.SqueakImage()
+    other_image.from_reader(other_space, other_reader)
+    return other_image
+
+def test_snapshot_roundtrip():
+    writer = squeakimage.ImageWriter(space, image)
+    data = writer.write_to_string()
+    saved = nil_state()
+    try:
+        other_space = objspace.ObjSpace()
+        other_reader = squeakimage.reader_for_image(
+            other_space, squeakimage.Stream(data=data))
+        other_image = load_other_image(other_space, other_reader)
+        assert len(other_reader.chunklist) == len(writer.objects_w)
+        assert other_reader.oldbaseaddress == reader.oldbaseaddress
+        w = other_image.special(constants.SO_FLOAT_CLASS)
+        assert str(w) == "Float class"
+        assert other_image.w_asSymbol.as_string() == "asSymbol"
+        # writing the reloaded image again yields the very same bytes
+        other_writer = squeakimage.ImageWriter(other_space, other_image)
+        assert other_writer.write_to_string() == data
+    finally:
+        restore_nil_state(saved)
+
+def test_snapshot_large_small_integers():
+    # SmallIntegers of the VM beyond 31 bits are written as LargeIntegers
+    values = [2 ** 30 + 5, 2 ** 31 - 1, 2 ** 40, 2 ** 30 - 1]
+    # held by the external objects array, which the writer does not refresh
+    index = constants.SO_EXTERNAL_OBJECTS_ARRAY
+    w_external = image.w_special_objects.at0(space, index)
+    w_array = space.wrap_list([space.wrap_int(v) for v in values] +
+                              [space.wrap_int(2 ** 40)])
+    image.w_special_objects.atput0(space, index, w_array)
+    try:
+        writer = squeakimage.ImageWriter(space, image)
+        data = writer.write_to_string()
+    finally:
+        image.w_special_objects.atput0(space, index, w_external)
+    saved = nil_state()
+    try:
+        other_space = objspace.ObjSpace()
+        other_reader = squeakimage.reader_for_image(
+            other_space, squeakimage.Stream(data=data))
+        other_image = load_other_image(other_space, other_reader)
+        w_other = other_image.special(index)
+        elements_w = [w_other.at0(other_space, i) for i in range(len(values) + 1)]
+        assert isinstance(elements_w[3], model.W_SmallInteger)
+        for w_large in elements_w[:3]:
+            assert w_large.getclass(other_space) is other_space.w_LargePositiveInteger
+        assert other_space.unwrap_positive_32bit_int(elements_w[0]) == 2 ** 30 + 5
+        assert other_space.unwrap_positive_32bit_int(elements_w[1]) == 2 ** 31 - 1
+        # a little endian magnitude, one object per value
+        assert [ord(c) for c in elements_w[2].bytes] == [0, 0, 0, 0, 0, 1]
+        assert elements_w[2] is elements_w[4]
+        assert elements_w[3].value == 2 ** 30 - 1
+    finally:
+        restore_nil_state(saved)
+    # mini.image has no LargeNegativeInteger class to write negative ones as
+    image.w_special_objects.atput0(space, index,
+                                   space.wrap_list([space.wrap_int(-2 ** 40)]))
+    try:
+        writer = squeakimage.ImageWriter(space, image)
+        py.test.raises(squeakimage.UnsupportedImageError, writer.write_to_string)
+    finally:
+        image.w_special_objects.atput0(space, index, w_external)
+
+def test_image_cache_roundtrip():
+    stamp = squeakimage.image_stamp(str(mini_image))
+    writer = squeakimage.ImageCacheWriter(space, image, stamp)
+    data = writer.write_to_string()
+    snapshot = squeakimage.ImageWriter(space, image).write_to_string()
+    stale_stamp = [stamp[0], stamp[1] + 1, stamp[2]]
+    assert squeakimage.reader_for_cache(
+        space, squeakimage.Stream(data=data), stale_stamp) is None
+    saved = nil_state()
+    try:
+        other_space = objspace.ObjSpace()
+        other_reader = squeakimage.reader_for_cache(
+            other_space, squeakimage.Stream(data=data), stamp)
+        other_image = load_other_image(other_space, other_reader)
+        assert len(other_reader.chunklist) == len(writer.objects_w)
+        w = other_image.special(constants.SO_FLOAT_CLASS)
+        assert str(w) == "Float class"
+        assert other_image.w_asSymbol.as_string() == "asSymbol"
+        # the cache holds the same objects as a snapshot of the image
+        other_writer = squeakimage.ImageWriter(other_space, other_image)
+        assert other_writer.write_to_string() == snapshot
+    finally:
+        restore_nil_state(saved)
+
+def test_image_stamp_covers_the_body(tmpdir):
+    data = mini_image.read(mode="rb")
+    one, other = tmpdir.join("one.image"), tmpdir.join("other.image")
+    one.write(data, mode="wb")
+    # the same size and header, rewritten within the same second
+    other.write(data[:-100] + chr(ord(data[-100]) ^ 1) + data[-99:], mode="wb")
+    mtime = int(one.mtime())
+    one.setmtime(mtime)
+    other.setmtime(mtime)
+    stamp = squeakimage.image_stamp(str(one))
+    other_stamp = squeakimage.image_stamp(str(other))
+    assert stamp[:2] == other_stamp[:2]
+    assert stamp != other_stamp
+    assert squeakimage.image_stamp(str(one)) == stamp
+
+def test_image_cache_file(tmpdir):
+    import targetimageloadingsmalltalk
+    path = str(tmpdir.join("mini.image"))
+    mini_image.copy(tmpdir.join("mini.image"))
+    cache_path = squeakimage.image_cache_path(path)
+    stamp = squeakimage.image_stamp(path)
+    squeakimage.ImageCacheWriter(space, image, stamp).write(cache_path)
+    assert sorted(tmpdir.listdir()) == [tmpdir.join("mini.image"),
+                                        tmpdir.join("mini.image.spycache")]
+    data = tmpdir.join("mini.image.spycache").read(mode="rb")
+    saved = nil_state()
+    try:
+        assert targetimageloadingsmalltalk._load_image_cache(path) is not None
+        # a cache cut short, e.g. by a crash of an older VM while writing it,
+        # is ignored in favour of the image
+        tmpdir.join("mini.image.spycache").write(data[:len(data) // 2], mode="wb")
+        assert targetimageloadingsmalltalk._load_image_cache(path) is None
+    finally:
+        restore_nil_state(saved)
+
+def test_primitive_snapshot(tmpdir):
+    from spyvm import primitives, wrapper
+    process = wrapper.ProcessWrapper(space, wrapper.scheduler(space).active_process())
+    w_ctx = process.suspended_context()
+    process.store_suspended_context(space.w_nil)
+    w_method = model.W_CompiledMethod(header=512)
+    w_method.setbytes([chr(124)]) # returnTopFromMethod
+    s_ctx = shadow.MethodContextShadow.make_context(
+        space, w_method.as_compiledmethod_get_shadow(space), space.w_nil, [], None)
+    s_ctx.push(space.w_nil)
+    depth = s_ctx.stackdepth()
+    snapshot_interp = interpreter.Interpreter(
+        space, image, image_name=str(tmpdir.join("snapshot.image.gz")))
+    try:
+        primitives.prim_table[primitives.SNAPSHOT](snapshot_interp, s_ctx, 0)
+        # the running image continues with false
+        assert s_ctx.top() is space.w_false
+        assert s_ctx.stackdepth() == depth
+        assert process.suspended_context() is space.w_nil
+    finally:
+        process.store_suspended_context(w_ctx)
+    # compressed images are snapshotted uncompressed next to them
+    assert tmpdir.listdir() == [tmpdir.join("snapshot.image")]
+    assert snapshot_interp.image_name == str(tmpdir.join("snapshot.image"))
+    data = tmpdir.join("snapshot.image").read(mode="rb")
+    saved = nil_state()
+    try:
+        other_space = objspace.ObjSpace()
+        other_reader = squeakimage.reader_for_image(
+            other_space, squeakimage.Stream(data=data))
+        load_other_image(other_space, other_reader)
+        # the snapshot resumes in the same context with true
+        other_process = wrapper.ProcessWrapper(
+            other_space, wrapper.scheduler(other_space).active_process())
+        s_other = other_process.suspended_context().as_context_get_shadow(other_space)
+        assert s_other.stackdepth() == depth
+        assert s_other.top() is other_space.w_true
+        assert s_other.s_method().bytecode == chr(124)
+        assert s_other.pc() == s_ctx.pc()
+    finally:
+        restore_nil_state(saved)
+
 def test_primitive_perform_with_args():
     # this test should be last, because importing test_primitives has some (unknown) side-effects
     from spyvm.test.test_primitives import prim
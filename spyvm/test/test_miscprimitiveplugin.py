@@ -0,0 +1,117 @@
+from functools import partial
+
+from rpython.rlib.rarithmetic import r_uint
+
+from spyvm.plugins.miscprimitiveplugin import MiscPrimitivePlugin
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, MiscPrimitivePlugin)
+call_fails = partial(plugin_call_fails, MiscPrimitivePlugin)
+
+def byte_array(string):
+    w_bytes = space.w_ByteArray.as_class_get_shadow(space).new(len(string))
+    for i in range(len(string)):
+        w_bytes.setchar(i, string[i])
+    return w_bytes
+
+def bitmap(words):
+    w_words = space.w_Bitmap.as_class_get_shadow(space).new(len(words))
+    for i in range(len(words)):
+        w_words.setword(i, r_uint(words[i]))
+    return w_words
+
+ascii_order = byte_array("".join([chr(i) for i in range(256)]))
+case_insensitive = byte_array("".join([chr(i).lower() for i in range(256)]))
+
+def test_compare_string():
+    for a, b, expected in [("abc", "abd", 1), ("abc", "abc", 2),
+                           ("abd", "abc", 3), ("ab", "abc", 1),
+                           ("abc", "ab", 3), ("", "", 2)]:
+        w_result = call("primitiveCompareString",
+                        [space.w_String, a, b, ascii_order])
+        assert w_result.value == expected
+    w_result = call("primitiveCompareString",
+                    [space.w_String, "ABC", "abc", case_insensitive])
+    assert w_result.value == 2
+    call_fails("primitiveCompareString",
+               [space.w_String, "abc", 1, ascii_order])
+
+def test_string_hash():
+    def hash(string, initial):
+        hash = initial & 0xFFFFFFF
+        for c in string:
+            hash = hash + ord(c)
+            low = hash & 16383
+            hash = (0x260D * low + ((0x260D * (hash >> 14) + 0x65 * low & 16383) * 16384)) & 0xFFFFFFF
+        return hash
+    for string in ["hello", "a longer string with some more characters"]:
+        w_result = call("primitiveStringHash", [space.w_String, string, 1234567])
+        assert w_result.value == hash(string, 1234567)
+    assert call("primitiveStringHash", [space.w_String, "", 42]).value == 42
+
+def test_index_of_ascii():
+    stack = [space.w_String, ord("l"), "hello", 1]
+    assert call("primitiveIndexOfAsciiInString", stack).value == 3
+    stack = [space.w_String, ord("l"), "hello", 4]
+    assert call("primitiveIndexOfAsciiInString", stack).value == 4
+    stack = [space.w_String, ord("x"), "hello", 1]
+    assert call("primitiveIndexOfAsciiInString", stack).value == 0
+
+def test_translate_string():
+    w_string = space.wrap_string("Hello World")
+    w_table = space.wrap_string("".join([chr(i).upper() for i in range(256)]))
+    call("primitiveTranslateStringWithTable",
+         [space.w_String, w_string, 2, 7, w_table])
+    assert w_string.as_string() == "HELLO World"
+    call_fails("primitiveTranslateStringWithTable",
+               [space.w_String, w_string, 2, 12, w_table])
+
+def test_find_substring():
+    stack = ["x", "lo", "hello hello", 1, ascii_order]
+    assert call("primitiveFindSubstring", stack).value == 4
+    stack = ["x", "lo", "hello hello", 5, ascii_order]
+    assert call("primitiveFindSubstring", stack).value == 10
+    stack = ["x", "LO", "hello", 1, ascii_order]
+    assert call("primitiveFindSubstring", stack).value == 0
+    stack = ["x", "LO", "hello", 1, case_insensitive]
+    assert call("primitiveFindSubstring", stack).value == 4
+    stack = ["x", "", "hello", 1, ascii_order]
+    assert call("primitiveFindSubstring", stack).value == 0
+
+def test_find_first_in_string():
+    inclusion = byte_array("".join([chr(c in " ,") for c in map(chr, range(256))]))
+    stack = [space.w_String, "hello, world", inclusion, 1]
+    assert call("primitiveFindFirstInString", stack).value == 6
+    stack = [space.w_String, "hello, world", inclusion, 8]
+    assert call("primitiveFindFirstInString", stack).value == 0
+    stack = [space.w_String, "hello", byte_array("ab"), 1]
+    assert call("primitiveFindFirstInString", stack).value == 0
+
+def test_bitmap_compress_roundtrip():
+    words = ([0] * 10 + [0x12345678] * 3 + [0xFFFFFFFF] +
+             [1, 2, 3, 4] + [0x7F7F7F7F] * 300 + [0xDEADBEEF])
+    w_source = bitmap(words)
+    w_bytes = byte_array("\x00" * (len(words) * 4 + 20))
+    w_size = call("primitiveCompressToByteArray",
+                  [w_source, w_source, w_bytes])
+    size = w_size.value
+    assert 0 < size < len(words) * 4
+    # the image decodes the leading word count itself
+    assert ord(w_bytes.getchar(0)) == 224 + len(words) // 256
+    assert ord(w_bytes.getchar(1)) == len(words) % 256
+    w_compressed = byte_array(w_bytes.as_string()[:size])
+    w_target = bitmap([0] * len(words))
+    call("primitiveDecompressFromByteArray",
+         [w_target, w_target, w_compressed, 3])
+    assert [int(w_target.getword(i)) for i in range(len(words))] == words
+
+def test_bitmap_decompress_fails_on_overflow():
+    w_source = bitmap([5] * 8)
+    w_bytes = byte_array("\x00" * 40)
+    size = call("primitiveCompressToByteArray",
+                [w_source, w_source, w_bytes]).value
+    w_target = bitmap([0] * 4)
+    call_fails("primitiveDecompressFromByteArray",
+               [w_target, w_target, byte_array(w_bytes.as_string()[:size]), 2])
+    call_fails("primitiveCompressToByteArray",
+               [w_source, w_source, byte_array("\x00")])
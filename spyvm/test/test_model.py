@@ -370,6 +370,7 @@ def test_display_bitmap():
     assert bin(target.getword(0)) == bin(0x00FF00FF)
     target.setword(0, r_uint(0xFF00FF00))
     assert bin(target.getword(0)) == bin(0xFF00FF00)
+    target.convert_dirty()
     for i in xrange(2):
         assert target.pixelbuffer[i] == 0x01010101
     for i in xrange(2, 4):
@@ -0,0 +1,69 @@
+from functools import partial
+
+from spyvm import model
+from spyvm.plugins.numberplugin import NumberPlugin, print_float
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, NumberPlugin)
+call_fails = partial(plugin_call_fails, NumberPlugin)
+
+def large_positive(value):
+    data = []
+    while value:
+        data.append(chr(value & 0xFF))
+        value >>= 8
+    w_large = model.W_BytesObject(space, space.w_LargePositiveInteger, len(data))
+    w_large.bytes = data
+    return w_large
+
+def print_string(w_number, base=10):
+    return call("primitivePrintString", [w_number, base]).as_string()
+
+def test_print_integers():
+    assert print_string(space.wrap_int(0)) == "0"
+    assert print_string(space.wrap_int(-1234)) == "-1234"
+    assert print_string(space.wrap_int(255), 16) == "FF"
+    assert print_string(space.wrap_int(-5), 2) == "-101"
+    assert print_string(model.W_LargePositiveInteger1Word(0xFFFFFFFF)) == "4294967295"
+    assert print_string(large_positive(2 ** 100)) == str(2 ** 100)
+    assert print_string(large_positive(2 ** 70 + 1), 36) == "6X5KXTVUWILUKH"
+    call_fails("primitivePrintString", [space.wrap_int(1), 37])
+    call_fails("primitivePrintString", [space.wrap_string("abc"), 10])
+
+def test_print_floats():
+    # the same digits as Float>>absPrintExactlyOn:base: in the image
+    for value, expected in [(1.0, "1.0"), (100.0, "100.0"), (0.1, "0.1"),
+                            (-2.5, "-2.5"), (1e15, "1000000000000000.0"),
+                            (1e16, "1.0e16"), (0.0001, "0.0001"),
+                            (0.00001, "1.0e-5"), (2.0 / 3, "0.6666666666666666"),
+                            (5e-324, "5.0e-324"),
+                            (1.7976931348623157e308, "1.7976931348623157e308"),
+                            (-0.0, "-0.0"), (float("inf"), "Infinity"),
+                            (float("-inf"), "-Infinity"), (float("nan"), "NaN")]:
+        assert print_float(value, 10) == expected
+    assert print_string(space.wrap_float(255.5), 16) == "FF.8"
+    assert print_string(space.wrap_float(0.5), 2) == "0.1"
+
+def test_read_integer():
+    def read(string, base=10):
+        return call("primitiveReadInteger", [space.w_nil, string, base])
+    assert read("12345").value == 12345
+    assert read("-7F", 16).value == -127
+    w_large = read(str(2 ** 80))
+    assert w_large.getclass(space).is_same_object(space.w_LargePositiveInteger)
+    assert print_string(w_large) == str(2 ** 80)
+    for string in ["", "-", "12a", "1 2", "+1", "ff"]:
+        call_fails("primitiveReadInteger", [space.w_nil, string, 16])
+    # without an image there is no LargeNegativeInteger class
+    call_fails("primitiveReadInteger", [space.w_nil, "-" + str(2 ** 80), 10])
+
+def test_read_float():
+    def read(string):
+        return call("primitiveReadFloat", [space.w_nil, string]).value
+    assert read("1.5") == 1.5
+    assert read("-0.1") == -0.1
+    assert read("2e3") == 2000.0
+    assert read("1.25e-2") == 0.0125
+    assert read("0.30000000000000004") == 0.30000000000000004
+    for string in ["", "1.", ".5", "1e", "1.5E3", "1e+3", "NaN", "1.5x"]:
+        call_fails("primitiveReadFloat", [space.w_nil, string])
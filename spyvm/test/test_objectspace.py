@@ -61,3 +61,10 @@ def test_wrap_int():
     for num in [2L, -5L]:
         with py.test.raises(AssertionError):
             space.wrap_int(num)
+
+def test_wrap_positive_64bit_int():
+    from rpython.rlib.rarithmetic import r_ulonglong
+    assert space.wrap_positive_64bit_int(r_ulonglong(42)).value == 42
+    w_large = space.wrap_positive_64bit_int(r_ulonglong(0x8000000000000201))
+    assert w_large.getclass(space).is_same_object(space.w_LargePositiveInteger)
+    assert w_large.bytes == list("\x01\x02\x00\x00\x00\x00\x00\x80")
@@ -63,6 +63,22 @@ def prim_fails(code, stack):
         prim_table[code](interp, w_frame.as_context_get_shadow(space), argument_count - 1)
     assert w_frame.as_context_get_shadow(space).stack() == orig_stack
 
+def plugin_call(plugin, name, stack, image=None):
+    interp, w_frame, argument_count = mock(stack)
+    interp.image = image
+    s_frame = w_frame.as_context_get_shadow(space)
+    plugin.call(name, interp, s_frame, argument_count - 1, None)
+    w_result = s_frame.pop()
+    assert not s_frame.stackdepth() - s_frame.tempsize()
+    return w_result
+
+def plugin_call_fails(plugin, name, stack, image=None):
+    interp, w_frame, argument_count = mock(stack)
+    interp.image = image
+    s_frame = w_frame.as_context_get_shadow(space)
+    with py.test.raises(PrimitiveFailedError):
+        plugin.call(name, interp, s_frame, argument_count - 1, None)
+
 # smallinteger tests
 def test_small_int_add():
     assert prim(primitives.ADD, [1,2]).value == 3
@@ -94,6 +110,35 @@ def test_small_int_multiply_overflow():
     prim_fails(primitives.MULTIPLY, [constants.MININT, constants.MAXINT])
     prim_fails(primitives.MULTIPLY, [constants.MININT, 2])
 
+def test_status_table_reports_failure():
+    interp, w_frame, argument_count = mock([constants.MAXINT, 2])
+    s_frame = w_frame.as_context_get_shadow(space)
+    orig_stack = list(s_frame.stack())
+    primitives.status_table[primitives.ADD](interp, s_frame, argument_count - 1)
+    assert interp.primitive_failed
+    assert s_frame.stack() == orig_stack
+    primitives.status_table[primitives.ADD](interp, s_frame, argument_count - 1)
+    assert interp.primitive_failed
+    s_frame.pop_n(2)
+    s_frame.push(space.wrap_int(3))
+    s_frame.push(space.wrap_float(2.0))
+    primitives.status_table[primitives.ADD](interp, s_frame, argument_count - 1)
+    assert interp.primitive_failed
+    s_frame.pop()
+    s_frame.push(space.wrap_int(4))
+    primitives.status_table[primitives.ADD](interp, s_frame, argument_count - 1)
+    assert not interp.primitive_failed
+    assert s_frame.pop().value == 7
+
+def test_status_table_of_unimplemented_primitive():
+    interp, w_frame, argument_count = mock([1])
+    s_frame = w_frame.as_context_get_shadow(space)
+    primitives.status_table[575](interp, s_frame, argument_count - 1)
+    assert interp.primitive_failed
+    interp.primitive_failed = False
+    py.test.raises(PrimitiveFailedError, prim_table[575], interp, s_frame, argument_count - 1)
+    assert not interp.primitive_failed
+
 def test_small_int_divide():
     assert prim(primitives.DIVIDE, [6,3]).value == 2
 
@@ -439,6 +484,20 @@ def test_signal_at_milliseconds():
     prim(primitives.SIGNAL_AT_MILLISECONDS, [space.w_nil, sema, future])
     assert space.objtable["w_timerSemaphore"] is sema
 
+def large_positive_value(w_large):
+    if isinstance(w_large, model.W_SmallInteger):
+        return w_large.value
+    return sum(ord(c) << (8 * i) for i, c in enumerate(w_large.bytes))
+
+def test_primitive_microsecond_clocks():
+    import time
+    from spyvm import clock
+    now = int(time.time() * 1000000) + (69 * 365 + 17) * 24 * 3600 * 1000000
+    utc = large_positive_value(prim(primitives.UTC_MICROSECOND_CLOCK, [0]))
+    assert abs(utc - now) < 1000000
+    local = large_positive_value(prim(primitives.LOCAL_MICROSECOND_CLOCK, [0]))
+    assert abs(local - utc - clock.local_offset_seconds() * 1000000) < 1000000
+
 def test_inc_gc():
     # Should not fail :-)
     prim(primitives.INC_GC, [42]) # Dummy arg
@@ -499,6 +558,38 @@ def test_clone():
     w_obj.atput0(space, 0, space.wrap_int(2))
     assert space.unwrap_int(w_v.at0(space, 0)) == 1
 
+def test_external_call_is_resolved_once():
+    from spyvm.plugins.miscprimitiveplugin import MiscPrimitivePlugin
+    w_cm = model.W_CompiledMethod(0, 0)
+    w_description = space.wrap_list([space.wrap_string("MiscPrimitivePlugin"),
+                                     space.wrap_string("primitiveStringHash")])
+    w_cm.setliterals([w_description, space.w_nil])
+    s_cm = w_cm.as_compiledmethod_get_shadow(space)
+    assert s_cm.external_primitive is None
+
+    def call_external(s_method):
+        interp, w_frame, argument_count = mock([space.w_String, "", 42])
+        s_frame = w_frame.as_context_get_shadow(space)
+        prim_table[primitives.EXTERNAL_CALL](interp, s_frame, argument_count - 1, s_method)
+        return s_frame.pop()
+
+    assert call_external(s_cm).value == 42
+    external = s_cm.external_primitive
+    assert external.func is MiscPrimitivePlugin.prims["primitiveStringHash"]
+    assert call_external(s_cm).value == 42
+    assert s_cm.external_primitive is external
+
+    prim(primitives.COMPILED_METHOD_FLUSH_CACHE, [w_cm])
+    assert s_cm.external_primitive is None
+
+    w_description.atput0(space, 1, space.wrap_string("primitiveMissing"))
+    with py.test.raises(PrimitiveFailedError):
+        call_external(s_cm)
+    assert s_cm.external_primitive is primitives.failing_external_primitive
+    # changing the literals invalidates the cached failure
+    w_cm.literalatput0(space, 1, w_description)
+    assert s_cm.external_primitive is None
+
 def test_file_open_write(monkeypatch):
     def open_write(filename, mode, perm):
         assert filename == "nonexistant"
@@ -591,6 +682,57 @@ def test_primitive_string_copy():
     prim_fails(primitives.STRING_REPLACE, ["aaaaa", 2, 6, "ccccc", 1])
     prim_fails(primitives.STRING_REPLACE, [['a', 'b'], 1, 4, "ccccc", 1])
 
+def test_primitive_string_copy_overlapping():
+    # copied forward element by element, like the Smalltalk fallback code
+    w_s = space.wrap_string("abcdef")
+    prim(primitives.STRING_REPLACE, [w_s, 2, 5, w_s, 1])
+    assert w_s.as_string() == "aaaaaf"
+    w_s = space.wrap_string("abcdef")
+    prim(primitives.STRING_REPLACE, [w_s, 1, 4, w_s, 3])
+    assert w_s.as_string() == "cdefef"
+
+def test_primitive_string_copy_repeats_back_reference():
+    # InflateStream>>decompressBlock:with: expands a back-reference with a
+    # distance shorter than its length by copying the collection into itself
+    w_s = space.wrap_string("abc......")
+    prim(primitives.STRING_REPLACE, [w_s, 4, 9, w_s, 2])
+    assert w_s.as_string() == "abcbcbcbc"
+    w_words = model.W_WordsObject(space, space.w_Array, 6)
+    w_words.setword(0, 7)
+    w_words.setword(1, 8)
+    prim(primitives.STRING_REPLACE, [w_words, 3, 6, w_words, 1])
+    assert [w_words.getword(i) for i in range(6)] == [7, 8, 7, 8, 7, 8]
+
+def test_primitive_replace_words_and_pointers():
+    w_cls = mockclass(space, 0, varsized=True, format=shadow.WORDS)
+    w_words = w_cls.as_class_get_shadow(space).new(4)
+    w_other = w_cls.as_class_get_shadow(space).new(4)
+    for i in range(4):
+        w_other.setword(i, i + 10)
+    prim(primitives.STRING_REPLACE, [w_words, 2, 4, w_other, 1])
+    assert [w_words.getword(i) for i in range(4)] == [0, 10, 11, 12]
+    prim(primitives.STRING_REPLACE, [w_words, 2, 4, w_words, 1])
+    assert [w_words.getword(i) for i in range(4)] == [0, 0, 0, 0]
+
+    w_array = space.wrap_list([wrap(i) for i in range(5)])
+    prim(primitives.STRING_REPLACE, [w_array, 2, 5, w_array, 1])
+    assert [space.unwrap_int(w_array.at0(space, i)) for i in range(5)] == [0, 0, 0, 0, 0]
+    w_array = space.wrap_list([wrap(i) for i in range(5)])
+    prim(primitives.STRING_REPLACE, [w_array, 1, 4, w_array, 2])
+    assert [space.unwrap_int(w_array.at0(space, i)) for i in range(5)] == [1, 2, 3, 4, 4]
+    w_copy = prim(primitives.CLONE, [w_array])
+    w_array.atput0(space, 0, wrap(7))
+    assert [space.unwrap_int(w_copy.at0(space, i)) for i in range(5)] == [1, 2, 3, 4, 4]
+
+def test_primitive_fill():
+    w_s = space.wrap_string("abc")
+    assert prim(primitives.FILL, [w_s, ord("x")]) is w_s
+    assert w_s.as_string() == "xxx"
+    prim_fails(primitives.FILL, [w_s, 256])
+    w_words = model.W_WordsObject(space, space.w_Array, 3)
+    prim(primitives.FILL, [w_words, 0xFFFFFFFF])
+    assert [w_words.getword(i) for i in range(3)] == [0xFFFFFFFF] * 3
+
 def build_up_closure_environment(args, copiedValues=[]):
     from test_interpreter import new_frame
     w_frame, s_initial_context = new_frame("<never called, but used for method generation>",
@@ -777,7 +919,7 @@ def test_primitive_force_display_update(monkeypatch):
         raise DisplayFlush
 
     try:
-        monkeypatch.setattr(space.get_display().__class__, "flip", flush_to_screen_mock)
+        monkeypatch.setattr(space.get_display().__class__, "flush_damage", flush_to_screen_mock)
         with py.test.raises(DisplayFlush):
             prim(primitives.FORCE_DISPLAY_UPDATE, [mock_display])
     finally:
@@ -223,3 +223,106 @@ def test_simple_image64():
     # does not raise
     r.read_header()
     assert r.stream.pos == len(image_2)
+
+def test_simple_image64_objects():
+    import sys
+    if not sys.maxint == 2 ** 63 - 1:
+      py.test.skip("on 32 bit platforms, we can't need to check for 64 bit images")
+    word_size = 8
+    header_size = 16 * word_size
+    for e in ">", "<":
+        def header(size, format, classid, hash):
+            return pack(e + "q", joinbits([3, size, format, classid, hash],
+                                          [2, 6, 4, 5, 12]))
+        # three 32-bit words in two 64-bit words, Size4Bit set
+        words = header(6 | 1, 6, 2, 1) + pack(e + "III", 1, 2, 3) + "\x00" * 4
+        # three bytes in one 64-bit word, 4 + 1 bytes unused
+        bytes = header(4 | 1, 8 | 1, 3, 2) + "abc" + "\x00" * 5
+        # a 63-bit SmallInteger and a pointer to the words object
+        pointers = (header(6, 2, 4, 3) + pack(e + "q", (2 ** 40 << 1) | 1)
+                    + pack(e + "q", 1000))
+        body = words + bytes + pointers
+        image = (pack(e + "Q", 68002)        # 1 version
+                 + pack(e + "q", header_size) # 2 128 byte header
+                 + pack(e + "q", len(body))   # 3 body size
+                 + pack(e + "q", 1000)        # 4 old base address
+                 + pack(e + "q", 0)           # 5 no spl objs array
+                 + ("\x00" * (header_size - (5 * word_size)))
+                 + body)
+        r = imagereader_mock(image)
+        r.read_header()
+        chunks = r.read_body()
+        assert r.addresses == [1000, 1024, 1040]
+        assert [chunk.size for chunk in chunks] == [3, 2, 3]
+        assert chunks[0].get_ruints() == [1, 2, 3]
+        assert chunks[1].get_bytes() == list("abc")
+        w_int = r.decode_pointer(chunks[2].data[0])
+        assert w_int.value == 2 ** 40
+        assert r.chunk_at(chunks[2].data[1]) is chunks[0]
+
+def test_spur_image_unsupported():
+    for magic in 6521, 6523:
+        image = pack(">i", magic) + "\x00" * 60
+        py.test.raises(squeakimage.UnsupportedImageError,
+                       imagereader_mock, image)
+
+def test_chunk_address_table():
+    word_size = 4
+    header_size = 16 * word_size
+    obj = ints2str(joinbits([3, 1, 2, 3, 4], [2,6,4,5,12]))
+    image = (SIMPLE_VERSION_HEADER     # 1
+             + pack(">i", header_size) # 2 64 byte header
+             + pack(">i", 3 * 4)       # 3 three one-word objects
+             + pack(">i", 1000)        # 4 old base addresss
+             + pack(">i", 0)           # 5 no spl objs array
+             + ("\x00" * (header_size - (5 * word_size)))
+             + obj * 3)
+    r = imagereader_mock(image)
+    r.read_header()
+    chunks = r.read_body()
+    assert r.addresses == [1000, 1004, 1008]
+    for i, address in enumerate(r.addresses):
+        assert r.chunk_index(address) == i
+        assert r.chunk_at(address) is chunks[i]
+    assert r.chunk_index(999) == -1
+    assert r.chunk_index(1002) == -1
+    assert r.chunk_index(1012) == -1
+    py.test.raises(squeakimage.CorruptImageError, lambda: r.chunk_at(1012))
+
+def test_gzip_stream(tmpdir):
+    import gzip
+    from rpython.rlib.streamio import open_file_as_stream
+    word_size = 4
+    header_size = 16 * word_size
+    obj = ints2str(joinbits([3, 1, 2, 3, 4], [2,6,4,5,12]))
+    image = (SIMPLE_VERSION_HEADER     # 1
+             + pack(">i", header_size) # 2 64 byte header
+             + pack(">i", 100 * 4)     # 3 a hundred one-word objects
+             + pack(">i", 1000)        # 4 old base addresss
+             + pack(">i", 0)           # 5 no spl objs array
+             + ("\x00" * (header_size - (5 * word_size)))
+             + obj * 100)
+    path = str(tmpdir.join("test.image.gz"))
+    f = gzip.open(path, "wb")
+    f.write(image)
+    f.close()
+    stream = squeakimage.stream_for_file(open_file_as_stream(path, mode="rb"))
+    assert isinstance(stream, squeakimage.GzipStream)
+    assert stream.length() == len(image)
+    # a tiny chunk size makes the stream refill and drop data many times
+    stream = squeakimage.GzipStream(open_file_as_stream(path, mode="rb"), chunk_size=16)
+    r = squeakimage.reader_for_image(space, stream)
+    r.read_header()
+    chunks = r.read_body()
+    expected = imagereader_mock(image)
+    expected.read_header()
+    assert chunks == expected.read_body()
+    assert r.addresses == expected.addresses
+
+def test_compressed_stream_unsupported(tmpdir):
+    from rpython.rlib.streamio import open_file_as_stream
+    path = tmpdir.join("test.image.xz")
+    path.write("\xfd7zXZ\x00" + "\x00" * 64, mode="wb")
+    f = open_file_as_stream(str(path), mode="rb")
+    py.test.raises(squeakimage.UnsupportedImageError,
+                   squeakimage.stream_for_file, f)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from functools import partial
+
+from rpython.rlib.rarithmetic import r_uint
+
+from spyvm import model
+from spyvm.plugins.utf8plugin import UTF8Plugin
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, UTF8Plugin)
+call_fails = partial(plugin_call_fails, UTF8Plugin)
+
+def wide_string(text):
+    w_string = space.w_Bitmap.as_class_get_shadow(space).new(len(text))
+    for i in range(len(text)):
+        w_string.setword(i, r_uint(ord(text[i])))
+    return w_string
+
+def encode(w_string, w_class=space.w_ByteArray):
+    w_result = call("primitiveUTF8Encode", [w_string, w_class])
+    assert w_result.getclass(space) is w_class
+    return w_result.as_string()
+
+def decode(data):
+    return call("primitiveUTF8Decode", [space.wrap_string(data), space.w_String, space.w_Bitmap])
+
+def test_encode_byte_string():
+    assert encode(space.wrap_string("abc")) == "abc"
+    assert encode(space.wrap_string("caf\xe9"), space.w_String) == u"café".encode("utf-8")
+    assert encode(space.wrap_string("")) == ""
+
+def test_encode_wide_string():
+    text = u"a\xe9€\U0001F600"
+    assert encode(wide_string(text)) == text.encode("utf-8")
+    # the leading char is not part of the code point
+    w_string = wide_string(u"x")
+    w_string.setword(0, r_uint((1 << 22) | 0x20AC))
+    assert encode(w_string) == u"€".encode("utf-8")
+    call_fails("primitiveUTF8Encode", [wide_string(u"\ud800"), space.w_ByteArray])
+    w_string.setword(0, r_uint(0x110000))
+    call_fails("primitiveUTF8Encode", [w_string, space.w_ByteArray])
+    call_fails("primitiveUTF8Encode", [space.wrap_string("a"), space.w_Bitmap])
+    call_fails("primitiveUTF8Encode", [space.wrap_list([]), space.w_ByteArray])
+
+def test_decode_to_byte_string():
+    w_result = decode(u"café".encode("utf-8"))
+    assert isinstance(w_result, model.W_BytesObject)
+    assert w_result.getclass(space) is space.w_String
+    assert w_result.as_string() == "caf\xe9"
+
+def test_decode_to_wide_string():
+    text = u"a\xe9€\U0001F600"
+    w_result = decode(text.encode("utf-8"))
+    assert isinstance(w_result, model.W_WordsObject)
+    assert [w_result.getword(i) for i in range(w_result.size())] == [
+        0x61, 0xE9, 0x20AC, 0x1F600]
+
+def test_decode_malformed():
+    for data in ["\x80", "\xc3", "\xc0\xaf", "\xe0\x80\xaf", "\xed\xa0\x80",
+                 "\xf4\x90\x80\x80", "\xf8\x88\x80\x80\x80", "a\xe2\x82"]:
+        call_fails("primitiveUTF8Decode", [space.wrap_string(data),
+                                           space.w_String, space.w_Bitmap])
+
+def test_roundtrip():
+    text = u"".join([unichr(i) for i in range(0x20, 0xD800, 7)])
+    data = encode(wide_string(text))
+    assert data == text.encode("utf-8")
+    w_result = decode(data)
+    assert u"".join([unichr(w_result.getword(i)) for i in range(w_result.size())]) == text
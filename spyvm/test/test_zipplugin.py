@@ -0,0 +1,351 @@
+import zlib
+from functools import partial
+
+from rpython.rlib.rarithmetic import r_uint
+
+from spyvm import model
+from spyvm.plugins import zipplugin
+from spyvm.plugins.zipplugin import ZipPlugin
+from spyvm.test.test_primitives import plugin_call, plugin_call_fails, space
+
+call = partial(plugin_call, ZipPlugin)
+call_fails = partial(plugin_call_fails, ZipPlugin)
+
+def byte_array(data):
+    w_bytes = model.W_BytesObject(space, space.w_ByteArray, len(data))
+    for i in range(len(data)):
+        w_bytes.setchar(i, data[i])
+    return w_bytes
+
+def word_array(words):
+    w_words = model.W_WordsObject(space, space.w_Bitmap, len(words))
+    for i in range(len(words)):
+        w_words.setword(i, r_uint(words[i]))
+    return w_words
+
+def stream(fields):
+    w_stream = model.W_PointersObject(space, space.w_Array, len(fields))
+    for i in range(len(fields)):
+        w_field = fields[i]
+        if isinstance(w_field, int):
+            w_field = space.wrap_int(w_field)
+        w_stream.store(space, i, w_field)
+    return w_stream
+
+def field(w_stream, index):
+    return space.unwrap_int(w_stream.fetch(space, index))
+
+def test_crc32():
+    data = "The quick brown fox jumps over the lazy dog"
+    w_crc = call("primitiveUpdateGZipCrc32",
+                 [space.w_nil, space.wrap_uint(r_uint(0xFFFFFFFF)), 1, len(data), byte_array(data)])
+    assert space.unwrap_uint(w_crc) ^ 0xFFFFFFFF == zlib.crc32(data) & 0xFFFFFFFF
+    w_crc = call("primitiveUpdateGZipCrc32",
+                 [space.w_nil, space.wrap_uint(r_uint(0xFFFFFFFF)), 5, 9, byte_array(data)])
+    assert space.unwrap_uint(w_crc) ^ 0xFFFFFFFF == zlib.crc32(data[4:9]) & 0xFFFFFFFF
+    call_fails("primitiveUpdateGZipCrc32", [space.w_nil, 0, 1, len(data) + 1, byte_array(data)])
+    call_fails("primitiveUpdateGZipCrc32", [space.w_nil, 0, 0, 1, byte_array(data)])
+
+def test_adler32():
+    data = "Wikipedia" * 1000
+    w_adler = call("primitiveUpdateAdler32", [space.w_nil, 1, 1, len(data), byte_array(data)])
+    assert space.unwrap_uint(w_adler) == zlib.adler32(data) & 0xFFFFFFFF
+    call_fails("primitiveUpdateAdler32", [space.w_nil, 1, 1, 1, space.wrap_list([])])
+
+# ___________________________________________________________________________
+# Inflating, with the fixed huffman tables of FastInflateStream
+
+def reversed_bits(code, width):
+    result = 0
+    for i in range(width):
+        result = (result << 1) | ((code >> i) & 1)
+    return result
+
+def canonical_codes(lengths):
+    codes = []
+    code = 0
+    for length in range(1, max(lengths) + 1):
+        for symbol in range(len(lengths)):
+            if lengths[symbol] == length:
+                codes.append((code, length, symbol))
+                code += 1
+        code <<= 1
+    return codes
+
+def huffman_table(lengths, values):
+    """A table in the format of FastInflateStream: the initial bits needed in
+    the high byte of the first entry, then (sub)tables indexed by the bit
+    reversed codes, whose non-leaf entries hold the bits needed for the sub
+    table and its one-based offset."""
+    table = [0]
+    def build(codes, prefix_length):
+        width = min([length for (code, length, symbol) in codes]) - prefix_length
+        start = len(table)
+        table.extend([0] * (1 << width))
+        groups = {}
+        for (code, length, symbol) in codes:
+            chunk = (code >> (length - prefix_length - width)) & ((1 << width) - 1)
+            if length == prefix_length + width:
+                table[start + reversed_bits(chunk, width)] = values[symbol]
+            else:
+                groups.setdefault(chunk, []).append((code, length, symbol))
+        for chunk, subcodes in groups.items():
+            sub_width, sub_start = build(subcodes, prefix_length + width)
+            table[start + reversed_bits(chunk, width)] = (sub_width << 24) | (sub_start + 1)
+        return width, start
+    width, start = build(canonical_codes(lengths), 0)
+    table[0] = width << 24
+    return word_array(table)
+
+BASE_LENGTHS = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31,
+                35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258]
+BASE_DISTANCES = [1, 2, 3, 4, 5, 7, 9, 13, 17, 25, 33, 49, 65, 97, 129, 193,
+                  257, 385, 513, 769, 1025, 1537, 2049, 3073, 4097, 6145,
+                  8193, 12289, 16385, 24577]
+
+def fixed_tables():
+    lengths = [8] * 144 + [9] * 112 + [7] * 24 + [8] * 8
+    values = range(257)
+    for code in range(len(BASE_LENGTHS)):
+        values.append(((zipplugin.EXTRA_LENGTH_BITS[code] + 1) << 16) | BASE_LENGTHS[code])
+    values += [0, 0]
+    distance_values = [(zipplugin.EXTRA_DISTANCE_BITS[code] << 16) | BASE_DISTANCES[code]
+                       for code in range(30)]
+    return (huffman_table(lengths, values),
+            huffman_table([5] * 30, distance_values))
+
+def inflate_stream(compressed, buffer_size):
+    # the block header (final bit and type) has already been read
+    first = ord(compressed[0])
+    assert first & 7 == 3 # a final block with fixed codes
+    return stream([byte_array("\x00" * buffer_size), 0, 0, 0, first >> 3, 5,
+                   byte_array(compressed), 1, len(compressed)])
+
+def test_inflate_fixed_block():
+    data = "Hello, hello, hello! " * 20 + "".join([chr(i) for i in range(256)])
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    w_lit_table, w_dist_table = fixed_tables()
+    w_stream = inflate_stream(compressed, 1000)
+    assert call("primitiveInflateDecompressBlock",
+                [w_stream, w_lit_table, w_dist_table]) is w_stream
+    read_limit = field(w_stream, zipplugin.INFLATE_READLIMIT)
+    assert w_stream.fetch(space, 0).as_string()[:read_limit] == data
+    assert field(w_stream, zipplugin.INFLATE_STATE) == 0
+
+def test_inflate_stops_when_buffer_is_full():
+    data = "abcabcabcabcabcabcabcabcabcabc" * 10
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    w_lit_table, w_dist_table = fixed_tables()
+    w_stream = inflate_stream(compressed, 100)
+    call("primitiveInflateDecompressBlock", [w_stream, w_lit_table, w_dist_table])
+    read_limit = field(w_stream, zipplugin.INFLATE_READLIMIT)
+    assert 0 < read_limit < 100
+    assert w_stream.fetch(space, 0).as_string()[:read_limit] == data[:read_limit]
+
+def test_inflate_fails_on_truncated_input():
+    data = "Hello, hello, hello! " * 20
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    w_lit_table, w_dist_table = fixed_tables()
+    w_stream = inflate_stream(compressed[:10], 1000)
+    call_fails("primitiveInflateDecompressBlock", [w_stream, w_lit_table, w_dist_table])
+    assert field(w_stream, zipplugin.INFLATE_SOURCEPOS) == 1
+
+# ___________________________________________________________________________
+# Deflating
+
+def initial_hash(data):
+    hash_value = 0
+    for c in data[:zipplugin.MIN_MATCH - 1]:
+        hash_value = ((hash_value << zipplugin.HASH_SHIFT) ^ ord(c)) & zipplugin.HASH_MASK
+    return hash_value
+
+def deflate_stream(data, literal_count=0x8000):
+    collection = data + "\x00" * (zipplugin.MAX_MATCH + 2)
+    return stream([byte_array(collection), len(data), len(data), len(collection),
+                   word_array([0] * (zipplugin.HASH_MASK + 1)),
+                   word_array([0] * zipplugin.WINDOW_SIZE),
+                   initial_hash(data), 0, 0,
+                   byte_array("\x00" * literal_count),
+                   word_array([0] * literal_count),
+                   word_array([0] * zipplugin.LITERAL_FREQ_SIZE),
+                   word_array([0] * zipplugin.DISTANCE_FREQ_SIZE), 0, 0])
+
+def decode_block(w_stream):
+    literals = w_stream.fetch(space, zipplugin.DEFLATE_LITERALS).as_string()
+    w_distances = w_stream.fetch(space, zipplugin.DEFLATE_DISTANCES)
+    result = []
+    for i in range(field(w_stream, zipplugin.DEFLATE_LITCOUNT)):
+        distance = int(w_distances.getword(i))
+        if distance == 0:
+            result.append(literals[i])
+        else:
+            for j in range(ord(literals[i]) + zipplugin.MIN_MATCH):
+                result.append(result[-distance])
+    return "".join(result)
+
+def test_deflate_block():
+    data = ("To be, or not to be, that is the question: " * 30 +
+            "".join([chr(i * 13 & 255) for i in range(500)]))
+    w_stream = deflate_stream(data)
+    w_flush = call("primitiveDeflateBlock", [w_stream, len(data) - 1, 32, 32])
+    assert w_flush is space.w_false
+    assert field(w_stream, zipplugin.DEFLATE_BLOCKPOSITION) == len(data)
+    assert decode_block(w_stream) == data
+    lit_count = field(w_stream, zipplugin.DEFLATE_LITCOUNT)
+    match_count = field(w_stream, zipplugin.DEFLATE_MATCHCOUNT)
+    assert 0 < match_count < lit_count < len(data) / 4
+    w_literal_freq = w_stream.fetch(space, zipplugin.DEFLATE_LITERALFREQ)
+    w_distance_freq = w_stream.fetch(space, zipplugin.DEFLATE_DISTANCEFREQ)
+    assert sum([w_literal_freq.getword(i) for i in range(286)]) == lit_count
+    assert sum([w_distance_freq.getword(i) for i in range(30)]) == match_count
+
+def test_deflate_block_flushes_when_literals_are_full():
+    data = "".join([chr(i * 31 & 255) for i in range(300)])
+    w_stream = deflate_stream(data, literal_count=100)
+    w_flush = call("primitiveDeflateBlock", [w_stream, len(data) - 1, 32, 32])
+    assert w_flush is space.w_true
+    assert field(w_stream, zipplugin.DEFLATE_LITCOUNT) == 100
+    assert decode_block(w_stream) == data[:field(w_stream, zipplugin.DEFLATE_BLOCKPOSITION)]
+
+def smalltalk_deflate_block(data, chain_length, good_match):
+    """The tokens DeflateStream>>deflateBlock:chainLength:goodMatch: emits
+    for data, a literal byte or a (length, distance) pair, transcribed
+    from the Smalltalk code."""
+    min_match, max_match = zipplugin.MIN_MATCH, zipplugin.MAX_MATCH
+    window_size, max_distance = zipplugin.WINDOW_SIZE, zipplugin.MAX_DISTANCE
+    collection = data + "\x00" * (max_match + 2)
+    position = len(data)
+    hash_head = [0] * (zipplugin.HASH_MASK + 1)
+    hash_tail = [0] * window_size
+    state = [initial_hash(data)]
+
+    def update_hash_at(here):
+        byte = ord(collection[here - 1])
+        return ((state[0] << zipplugin.HASH_SHIFT) ^ byte) & zipplugin.HASH_MASK
+
+    def insert_string_at(here):
+        state[0] = update_hash_at(here + min_match)
+        prev_entry = hash_head[state[0]]
+        hash_head[state[0]] = here
+        hash_tail[here & zipplugin.WINDOW_MASK] = prev_entry
+
+    def compare(here, match_pos, min_length):
+        if collection[here + min_length] != collection[match_pos + min_length]:
+            return 0
+        if collection[here] != collection[match_pos]:
+            return 0
+        if collection[here + 1] != collection[match_pos + 1]:
+            return 1
+        length = 3
+        while length <= max_match and collection[here + length - 1] == collection[match_pos + length - 1]:
+            length += 1
+        return length - 1
+
+    def find_match(here, last_length, last_match):
+        match_result = (last_length << 16) | last_match
+        if last_length >= max_match:
+            return match_result
+        match_pos = hash_head[update_hash_at(here + min_match)]
+        distance = here - match_pos
+        if not (distance > 0 and distance < max_distance):
+            return match_result
+        chain = chain_length
+        limit = here - max_distance if here > max_distance else 0
+        best_length = last_length
+        while True:
+            length = compare(here, match_pos, best_length)
+            if here + length > position:
+                length = position - here
+            if length == min_match and here - match_pos > window_size // 4:
+                length = min_match - 1
+            if length > best_length:
+                match_result = (length << 16) | match_pos
+                best_length = length
+                if best_length >= max_match:
+                    return match_result
+                if best_length > good_match:
+                    return match_result
+            chain -= 1
+            if not chain > 0:
+                return match_result
+            match_pos = hash_tail[match_pos & zipplugin.WINDOW_MASK]
+            if match_pos <= limit:
+                return match_result
+
+    tokens = []
+    has_match = False
+    here = 0
+    while here <= len(data) - 1:
+        if not has_match:
+            match_result = find_match(here, min_match - 1, here)
+            insert_string_at(here)
+            here_match, here_length = match_result & 0xFFFF, match_result >> 16
+        match_result = find_match(here + 1, here_length, here_match)
+        new_match, new_length = match_result & 0xFFFF, match_result >> 16
+        if here_length >= new_length and here_length >= min_match:
+            tokens.append((here_length, here - here_match))
+            for i in range(here_length - 1):
+                here += 1
+                insert_string_at(here)
+            has_match = False
+            here += 1
+        else:
+            tokens.append(collection[here])
+            here += 1
+            if here <= len(data) - 1:
+                insert_string_at(here)
+                has_match = True
+                here_match, here_length = new_match, new_length
+    return tokens
+
+def block_tokens(w_stream):
+    literals = w_stream.fetch(space, zipplugin.DEFLATE_LITERALS).as_string()
+    w_distances = w_stream.fetch(space, zipplugin.DEFLATE_DISTANCES)
+    tokens = []
+    for i in range(field(w_stream, zipplugin.DEFLATE_LITCOUNT)):
+        distance = int(w_distances.getword(i))
+        if distance == 0:
+            tokens.append(literals[i])
+        else:
+            tokens.append((ord(literals[i]) + zipplugin.MIN_MATCH, distance))
+    return tokens
+
+def test_deflate_block_matches_smalltalk():
+    # noise with 3 byte repeats from near and far back, and repeats of
+    # exactly and just over the good match length
+    seed = [12345]
+    def noise(n):
+        result = []
+        for i in range(n):
+            seed[0] = (seed[0] * 1103515245 + 12345) & 0x7FFFFFFF
+            result.append(chr(seed[0] >> 16 & 0xFF))
+        return "".join(result)
+    data = noise(200)
+    while len(data) < 30000:
+        for distance, length in [(9000, 3), (20000, 3), (100, 3), (5000, 3),
+                                 (300, 8), (700, 9), (12000, 8)]:
+            if len(data) > distance:
+                start = len(data) - distance
+                data += data[start:start + length]
+            data += noise(37)
+    for chain_length, good_match in [(32, 8), (4, 8), (128, 32)]:
+        w_stream = deflate_stream(data)
+        w_flush = call("primitiveDeflateBlock", [w_stream, len(data) - 1,
+                                                 chain_length, good_match])
+        assert w_flush is space.w_false
+        tokens = block_tokens(w_stream)
+        expected = smalltalk_deflate_block(data, chain_length, good_match)
+        assert tokens == expected
+        # there were far 3 byte repeats left as literals
+        assert (3, 20000) not in tokens and (3, 100) in tokens
+
+def test_match_codes():
+    assert zipplugin.MATCH_LENGTH_CODES[0] == 257
+    assert zipplugin.MATCH_LENGTH_CODES[227 - 3] == 284
+    assert zipplugin.MATCH_LENGTH_CODES[258 - 3] == 285
+    assert zipplugin.DISTANCE_CODES[0] == 0
+    assert zipplugin.DISTANCE_CODES[256 + (257 - 1 >> 7)] == 16
+    assert zipplugin.DISTANCE_CODES[256 + (32768 - 1 >> 7)] == 29
@@ -125,10 +125,42 @@ def _usage(argv):
           -r|--run [code string]
           -b|--benchmark [code string]
           -p|--poll_events
-          [image path, default: Squeak.image]
+          --headless [render into memory instead of an SDL window]
+          -c|--cache [load from and write a fast-start cache next to the image]
+          [image path, may be gzip-compressed, default: Squeak.image]
     """ % argv[0]
 
 
+def _load_image_cache(path):
+    try:
+        stamp = squeakimage.image_stamp(path)
+        f = open_file_as_stream(squeakimage.image_cache_path(path), mode="rb", buffering=0)
+        try:
+            cachedata = f.readall()
+        finally:
+            f.close()
+    except OSError:
+        return None
+    try:
+        cache_reader = squeakimage.reader_for_cache(space, squeakimage.Stream(data=cachedata), stamp)
+        if cache_reader is None:
+            return None
+        return create_image(space, cache_reader)
+    except (IndexError, squeakimage.CorruptImageError):
+        # a truncated or otherwise damaged cache, the image is loaded and
+        # the cache written again
+        os.write(2, "Ignoring corrupt image cache -- %s\n" % path)
+        return None
+
+def _write_image_cache(image, path):
+    try:
+        stamp = squeakimage.image_stamp(path)
+        writer = squeakimage.ImageCacheWriter(space, image, stamp)
+        writer.write(squeakimage.image_cache_path(path))
+    except (OSError, squeakimage.UnsupportedImageError):
+        os.write(2, "Could not write image cache -- %s\n" % path)
+
+
 def _arg_missing(argv, idx, arg):
     if len(argv) == idx + 1:
         raise RuntimeError("Error: missing argument after %s" % arg)
@@ -141,9 +173,11 @@ def entry_point(argv):
     benchmark = None
     trace = False
     evented = True
+    headless = False
     stringarg = ""
     code = None
     as_benchmark = False
+    use_cache = False
 
     while idx < len(argv):
         arg = argv[idx]
@@ -167,6 +201,10 @@ def entry_point(argv):
             trace = True
         elif arg in ["-p", "--poll_events"]:
             evented = False
+        elif arg == "--headless":
+            headless = True
+        elif arg in ["-c", "--cache"]:
+            use_cache = True
         elif arg in ["-a", "--arg"]:
             _arg_missing(argv, idx, arg)
             stringarg = argv[idx + 1]
@@ -192,19 +230,26 @@ def entry_point(argv):
         path = "Squeak.image"
 
     path = rpath.rabspath(path)
-    try:
-        f = open_file_as_stream(path, mode="rb", buffering=0)
-    except OSError as e:
-        os.write(2, "%s -- %s (LoadError)\n" % (os.strerror(e.errno), path))
-        return 1
-    try:
-        imagedata = f.readall()
-    finally:
-        f.close()
+    image = None
+    if use_cache:
+        image = _load_image_cache(path)
+    if image is None:
+        try:
+            f = open_file_as_stream(path, mode="rb", buffering=0)
+            stream = squeakimage.stream_for_file(f)
+            image_reader = squeakimage.reader_for_image(space, stream)
+        except OSError as e:
+            os.write(2, "%s -- %s (LoadError)\n" % (os.strerror(e.errno), path))
+            return 1
+        except squeakimage.UnsupportedImageError:
+            os.write(2, "Unsupported image format or compression -- %s (LoadError)\n" % path)
+            return 1
 
-    image_reader = squeakimage.reader_for_image(space, squeakimage.Stream(data=imagedata))
-    image = create_image(space, image_reader)
-    interp = interpreter.Interpreter(space, image, image_name=path, trace=trace, evented=evented)
+        image = create_image(space, image_reader)
+        if use_cache:
+            _write_image_cache(image, path)
+    interp = interpreter.Interpreter(space, image, image_name=path, trace=trace, evented=evented,
+                                     headless=headless)
     space.runtime_setup(argv[0])
     if benchmark is not None:
         return _run_benchmark(interp, number, benchmark, stringarg)
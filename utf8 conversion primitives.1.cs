@@ -0,0 +1 @@
+'From Squeak4.5 of 27 March 2014 [latest update: #13680] on 19 October 2026 at 12:00:00 pm'!!String methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!utf8EncodedAs: aClass	"Answer the receiver encoded in UTF-8 as an instance of aClass, String or ByteArray."	| encoded |	<primitive: 'primitiveUTF8Encode' module: 'UTF8Plugin'>	encoded := self convertToWithConverter: UTF8TextConverter new.	^aClass == ByteArray		ifTrue: [encoded asByteArray]		ifFalse: [encoded]! !!String methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!utf8Encoded	"Answer a ByteArray with the receiver encoded in UTF-8."	^self utf8EncodedAs: ByteArray! !!String methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!squeakToUtf8	"Convert the given string to UTF-8 from the internal encoding"	^self utf8EncodedAs: String! !!String methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!utf8ToSqueak	"Convert the given string from UTF-8 to the internal encoding"	^self utf8DecodedAs: String or: WideString! !!ArrayedCollection methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!utf8DecodedAs: aByteStringClass or: aWideStringClass	"The receiver holds UTF-8 bytes. Answer the decoded characters as an instance of aByteStringClass if they all fit into Latin-1, of aWideStringClass otherwise."	<primitive: 'primitiveUTF8Decode' module: 'UTF8Plugin'>	^self asString convertFromWithConverter: UTF8TextConverter new! !!ByteArray methodsFor: 'converting' stamp: 'spy 10/19/2026 12:00'!utf8Decoded	"Answer the String the receiver encodes in UTF-8."	^self utf8DecodedAs: String or: WideString! !
\ No newline at end of file